@@ -2,15 +2,94 @@
 import requests
 import time
 import os
-from typing import List, Dict, Optional, Callable
+import json
+from typing import List, Dict, Optional, Callable, Tuple
 from requests.exceptions import RequestException, HTTPError
 
 API_BASE_URL = "https://kemono.su/api/v1/"
 POSTS_PER_PAGE = 50
+PAGE_DELAY = 0.6 # Seconds between post pages, to be polite to the API
+RETRY_DELAY = 3.0
+
+class PostAttachment:
+    """A file of a post: just the name and API path the downloader needs."""
+    __slots__ = ('name', 'path')
+
+    def __init__(self, name: Optional[str], path: Optional[str]):
+        self.name = name
+        self.path = path
+
+    # Dict-style access, so code written for the raw API dicts keeps working
+    def get(self, key, default=None):
+        value = getattr(self, key) if key in PostAttachment.__slots__ else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        if key not in PostAttachment.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self) -> Dict:
+        return {'name': self.name, 'path': self.path}
+
+
+class PostRecord:
+    """
+    Slim version of an API post: only the fields the pipeline reads (id,
+    title, published, file, attachments). The raw post, with its `content`
+    HTML, embeds, etc., is dropped as soon as the page is parsed.
+    Supports post['id'], post.get('title'), 'file' in post... like the raw dict.
+    """
+    __slots__ = ('id', 'title', 'published', 'file', 'attachments')
+
+    def __init__(self, id: str, title: Optional[str], published: Optional[str],
+                 file: Optional[PostAttachment], attachments: Tuple[PostAttachment, ...]):
+        self.id = id
+        self.title = title
+        self.published = published
+        self.file = file
+        self.attachments = attachments
+
+    @classmethod
+    def from_api(cls, raw: Dict) -> 'PostRecord':
+        file_info = raw.get('file') or None
+        file_record = PostAttachment(file_info.get('name'), file_info.get('path')) if file_info and file_info.get('path') else None
+        attachments = tuple(PostAttachment(att.get('name') or f"att_{att.get('id')}", att['path'])
+                            for att in raw.get('attachments') or () if att.get('path'))
+        return cls(str(raw.get('id')), raw.get('title'), raw.get('published'), file_record, attachments)
+
+    def get(self, key, default=None):
+        if key not in PostRecord.__slots__:
+            return default
+        value = getattr(self, key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        if key not in PostRecord.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in PostRecord.__slots__ and getattr(self, key) is not None
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id, 'title': self.title, 'published': self.published,
+            'file': self.file.to_dict() if self.file else None,
+            'attachments': [att.to_dict() for att in self.attachments],
+        }
+
+    def __repr__(self):
+        return f"PostRecord(id={self.id!r}, title={self.title!r}, files={len(self.attachments) + (1 if self.file else 0)})"
+
 
 class KemonoAPI:
-    def __init__(self, base_url: str = API_BASE_URL):
+    def __init__(self, base_url: str = API_BASE_URL, page_delay: float = PAGE_DELAY,
+                 retry_delay: float = RETRY_DELAY):
         self.base_url = base_url
+        # Both delays can be lowered when talking to a local server (fake_kemono.py)
+        self.page_delay = page_delay
+        self.retry_delay = retry_delay
         self.session = requests.Session()
         # Use a proper user agent
         self.session.headers.update({"User-Agent": "ElZorroDownloader/1.1 (User Request)"})
@@ -18,9 +97,22 @@ class KemonoAPI:
     def get_all_creator_posts(self, service: str, creator_id: str,
                               progress_callback: Optional[Callable[[int, int], None]] = None,
                               log_callback: Optional[Callable[[str], None]] = None,
-                              check_cancel: Optional[Callable[[], bool]] = None) -> List[Dict]:
-        # --- Function body remains the same as before ---
-        # ... (copy the existing get_all_creator_posts logic here) ...
+                              check_cancel: Optional[Callable[[], bool]] = None,
+                              raw_spill_path: Optional[str] = None) -> List[PostRecord]:
+        """
+        Fetches every post of a creator as compact PostRecord objects, built
+        while each page is parsed. If `raw_spill_path` is given, the raw API
+        posts are appended there as JSON lines instead of being kept in memory.
+        """
+        raw_spill = open(raw_spill_path, 'w', encoding='utf-8') if raw_spill_path else None
+        try:
+            return self._fetch_all_posts(service, creator_id, raw_spill,
+                                         progress_callback, log_callback, check_cancel)
+        finally:
+            if raw_spill: raw_spill.close()
+
+    def _fetch_all_posts(self, service, creator_id, raw_spill,
+                         progress_callback, log_callback, check_cancel) -> List[PostRecord]:
         all_posts = []
         offset = 0
         page_num = 1
@@ -60,16 +152,20 @@ class KemonoAPI:
                        progress = min(int((current_count / estimated_total) * 50), 50)
                        progress_callback(progress, 0) # 0 for download phase progress yet
 
-                all_posts.extend(posts_page)
-                if log_callback: log_callback(f"Recibidos {len(posts_page)} posts. Total acumulado: {len(all_posts)}")
+                if raw_spill:
+                    raw_spill.writelines(json.dumps(post, ensure_ascii=False) + "\n" for post in posts_page)
+                all_posts.extend(PostRecord.from_api(post) for post in posts_page)
+                page_size = len(posts_page)
+                del posts_page # Only the slim records outlive the page
+                if log_callback: log_callback(f"Recibidos {page_size} posts. Total acumulado: {len(all_posts)}")
 
-                if len(posts_page) < POSTS_PER_PAGE:
+                if page_size < POSTS_PER_PAGE:
                     break
 
                 offset += POSTS_PER_PAGE
                 page_num += 1
                 # Be polite to the API
-                time.sleep(0.6) # Slightly increased delay
+                time.sleep(self.page_delay)
 
             except HTTPError as e:
                 if e.response.status_code == 404:
@@ -92,9 +188,11 @@ class KemonoAPI:
                        log_callback: Optional[Callable[[str], None]] = None,
                        check_cancel: Optional[Callable[[], bool]] = None,
                        max_retries: int = 2, # <<< Added Retry parameter
-                       retry_delay: float = 3.0 # <<< Added Delay parameter
+                       retry_delay: Optional[float] = None # <<< Added Delay parameter (default: self.retry_delay)
                        ) -> bool:
         """Downloads a single image with retry logic."""
+        if retry_delay is None:
+            retry_delay = self.retry_delay
         attempt = 0
         while attempt <= max_retries:
             if check_cancel and check_cancel():
@@ -148,10 +246,13 @@ class KemonoAPI:
             if attempt <= max_retries:
                 if log_callback: log_callback(f"Reintentando en {retry_delay}s...")
                 # Wait before retrying, check for cancellation during wait
-                for _ in range(int(retry_delay)):
+                waited = 0.0
+                while waited < retry_delay:
                      if check_cancel and check_cancel():
                          return False
-                     time.sleep(1)
+                     step = min(1.0, retry_delay - waited)
+                     time.sleep(step)
+                     waited += step
             else:
                  if log_callback: log_callback(f"Máximo de reintentos ({max_retries}) alcanzado para {url}. Descarga fallida.")
 
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# batch_video.py
+# Renders one video per group of a creator folder, without the Tk dialog of
+# folder_to_video.py, with the same meaning as its "Versión censurada" box
+# (ticked by default): the numbered originals are censored through censura.py
+# (zones saved in their sidecars, rendered on demand, or an old `_pixelado`
+# file when there is no sidecar) and rendered with the ffmpeg engine of
+# video_render.py into <grupo>.mp4. With --originales nothing is censored and
+# the originals go into <grupo>_original.mp4. Groups whose video is newer than
+# all of its inputs are skipped, so an interrupted overnight run just continues
+# where it stopped.
+#
+#   python batch_video.py "E:\El_Zorro\downloads\Creador" --jobs 2 --audio musica.mp3
+#   python batch_video.py Creador --dry-run      (lists what would be rendered)
+#   python batch_video.py Creador --originales
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, NamedTuple, Optional, Sequence
+
+from censura import censored_paths, pixelated_path, sidecar_path
+from scanner import scan_tree
+from video_render import (IMAGE_EXTENSIONS, RenderError, find_ffmpeg, render_slideshow,
+                          select_numbered_images)
+
+DEFAULT_IMAGE_DURATION = 10.0 # Same default as the GUI
+DEFAULT_OUTPUT_SUBDIR = '_videos'
+DEFAULT_JOBS = 2 # Each job already runs several ffmpeg/decoder processes
+
+
+class BatchJob(NamedTuple):
+    name: str               # Group folder name (also the video name)
+    group_dir: str
+    images: List[str]
+    out_file: str
+    newest_input_ns: int    # Newest mtime among the pictures, their censor sidecars/_pixelado and the group folder itself
+    censored: bool = True   # Pictures are swapped for their censored variant when rendering
+
+
+def _censor_mtimes(images: Sequence[str]) -> List[int]:
+    # Whatever censored_variant may use instead of each original
+    mtimes = []
+    for path in images:
+        for censor_input in (sidecar_path(path), pixelated_path(path)):
+            try:
+                mtimes.append(os.stat(censor_input).st_mtime_ns)
+            except OSError:
+                pass
+    return mtimes
+
+
+def plan_batch(creator_dir: str, output_dir: Optional[str] = None, censored: bool = True) -> List[BatchJob]:
+    """
+    One job per subfolder of `creator_dir` that has numbered pictures, sorted by
+    name. `censored=False` renders the originals untouched, into <grupo>_original.mp4.
+    """
+    output_dir = output_dir or os.path.join(creator_dir, DEFAULT_OUTPUT_SUBDIR)
+    snapshot = scan_tree(creator_dir, extensions=IMAGE_EXTENSIONS, max_depth=1)
+    jobs = []
+    for group in snapshot.children():
+        mtimes = {f.name: f.st_mtime_ns for f in group.files}
+        # Always the originals: when censored they are swapped at render time (sidecar, else old _pixelado)
+        images = select_numbered_images(group.path, mtimes, prefer_pixelated=False)
+        if not images:
+            continue
+        # The folder's own mtime changes when a picture is removed or renamed
+        newest = max([os.stat(group.path).st_mtime_ns] + [mtimes[os.path.basename(p)] for p in images]
+                     + (_censor_mtimes(images) if censored else []))
+        name = os.path.basename(group.path)
+        out_name = f"{name}.mp4" if censored else f"{name}_original.mp4"
+        jobs.append(BatchJob(name, group.path, images, os.path.join(output_dir, out_name), newest, censored))
+    return jobs
+
+
+def is_up_to_date(job: BatchJob, extra_inputs: Sequence[Optional[str]] = ()) -> bool:
+    """True if the video exists and is newer than the pictures, the folder and the shared audio/intro/outro."""
+    try:
+        out_mtime = os.stat(job.out_file).st_mtime_ns
+    except OSError:
+        return False
+    newest = job.newest_input_ns
+    for path in extra_inputs:
+        if path:
+            newest = max(newest, os.stat(path).st_mtime_ns)
+    return out_mtime >= newest
+
+
+def _part_path(out_file: str) -> str:
+    # Rendered next to the final name and renamed at the end: a killed run never
+    # leaves a complete-looking (and therefore "up to date") video behind.
+    root, ext = os.path.splitext(out_file)
+    return f"{root}.part{ext}"
+
+
+def run_batch(jobs: Sequence[BatchJob], jobs_at_once: int = DEFAULT_JOBS, duration: float = DEFAULT_IMAGE_DURATION,
+              audio: Optional[str] = None, intro: Optional[str] = None, outro: Optional[str] = None,
+              fps: Optional[float] = None, force: bool = False, verbose: bool = False) -> dict:
+    """Renders `jobs`, `jobs_at_once` at a time. Returns counts per outcome (ok / skipped / failed)."""
+    stats = {'ok': 0, 'skipped': 0, 'failed': 0}
+    lock = threading.Lock()
+    total = len(jobs)
+    # The CPUs are shared between the jobs running at once
+    workers = max(1, (os.cpu_count() or 1) // max(1, jobs_at_once))
+
+    def report(n, job, text):
+        with lock:
+            print(f"[{n}/{total}] {job.name}: {text}", flush=True)
+
+    def render(n, job):
+        if not force and is_up_to_date(job, (audio, intro, outro)):
+            report(n, job, "al día, se omite")
+            return 'skipped'
+        report(n, job, f"renderizando {len(job.images)} imágenes...")
+        job_log = (lambda msg: report(n, job, msg)) if verbose else (lambda msg: None)
+        os.makedirs(os.path.dirname(job.out_file), exist_ok=True)
+        part = _part_path(job.out_file)
+        start = time.perf_counter()
+        try:
+            images = censored_paths(job.images) if job.censored else job.images
+            render_slideshow(images, [duration] * len(images), part, intro=intro, outro=outro,
+                             audio=audio, fps=fps, workers=workers, log=job_log)
+            os.replace(part, job.out_file)
+        except (RenderError, OSError, ValueError) as e: # ValueError: broken censor sidecar
+            if os.path.exists(part):
+                os.remove(part)
+            report(n, job, f"ERROR: {e}")
+            return 'failed'
+        report(n, job, f"OK en {time.perf_counter() - start:.1f}s -> {job.out_file}")
+        return 'ok'
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs_at_once), thread_name_prefix="batch-video") as pool:
+        futures = [pool.submit(render, n, job) for n, job in enumerate(jobs, 1)]
+        try:
+            for future in as_completed(futures):
+                stats[future.result()] += 1
+        except KeyboardInterrupt:
+            # Jobs already encoding finish (and are kept); queued ones are dropped
+            for future in futures:
+                future.cancel()
+            print("WARN: Interrumpido, esperando a los trabajos en curso...")
+            raise
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Renderiza un video por grupo de una carpeta de creador")
+    parser.add_argument('creator_dir', help="Carpeta del creador (un grupo por subcarpeta)")
+    parser.add_argument('--output', help=f"Carpeta de los videos (por defecto <creador>/{DEFAULT_OUTPUT_SUBDIR})")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS, help="Videos renderizados a la vez")
+    parser.add_argument('--duration', type=float, default=DEFAULT_IMAGE_DURATION, help="Segundos por imagen")
+    parser.add_argument('--audio', help="Música (se repite o se corta a la duración de cada video)")
+    parser.add_argument('--intro', help="Intro (video o imagen) para todos los videos")
+    parser.add_argument('--outro', help="Outro (video o imagen) para todos los videos")
+    parser.add_argument('--fps', type=float, help="Frame rate constante (por defecto uno por imagen)")
+    parser.add_argument('--originales', action='store_true',
+                        help="Sin censura: ignora los sidecars y los _pixelado (<grupo>_original.mp4)")
+    parser.add_argument('--only', nargs='+', metavar='GRUPO', help="Solo estos grupos")
+    parser.add_argument('--force', action='store_true', help="Renderiza aunque el video esté al día")
+    parser.add_argument('--dry-run', action='store_true', help="Solo lista lo que se renderizaría")
+    parser.add_argument('--verbose', action='store_true', help="Muestra los comandos de ffmpeg")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.creator_dir):
+        print(f"ERROR: '{args.creator_dir}' no es una carpeta.")
+        return 1
+    if not args.dry_run and not find_ffmpeg():
+        print("ERROR: No se encontró ffmpeg (instala ffmpeg o imageio-ffmpeg).")
+        return 1
+    jobs = plan_batch(args.creator_dir, args.output, censored=not args.originales)
+    if args.only:
+        wanted = set(args.only)
+        jobs = [job for job in jobs if job.name in wanted]
+    print(f"INFO: {len(jobs)} grupos con imágenes en '{args.creator_dir}'.")
+    if args.dry_run:
+        for job in jobs:
+            state = "al día" if not args.force and is_up_to_date(job, (args.audio, args.intro, args.outro)) else "pendiente"
+            print(f"  {job.name}: {len(job.images)} imágenes, {state} -> {job.out_file}")
+        return 0
+
+    start = time.perf_counter()
+    stats = run_batch(jobs, args.jobs, args.duration, args.audio, args.intro, args.outro,
+                      args.fps, args.force, args.verbose)
+    print(f"INFO: {stats['ok']} renderizados, {stats['skipped']} al día, {stats['failed']} con error "
+          f"en {time.perf_counter() - start:.1f}s.")
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
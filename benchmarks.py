@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# benchmarks.py
+# Micro-benchmarks for the hot paths of El_Zorro. Run e.g.:
+#   python benchmarks.py sanitize --count 100000
+#   python benchmarks.py grouping --sizes 1000 10000 100000 --output bench.json
+#   python benchmarks.py grouping --compare bench.json   (flags regressions)
+#   python benchmarks.py download --posts 500 --rate-5xx 0.05   (full jobs against fake_kemono.py)
+#   python benchmarks.py pixelate --megapixels 24 --level 10
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+from unidecode import unidecode
+
+import censura
+import fake_kemono
+import fusionar
+import utils
+from grouper import SUFFIX_REGEX, group_posts_by_title
+
+# --- Synthetic data ---
+SERIES_WORDS = ['Playa', 'hora', 'Vacaciones', 'Montaña', 'ciudad', 'nocturna', 'Retrato', 'Bruja',
+                'Elfa', 'bosque', 'Summer', 'Beach', 'Night', 'City', 'Witch', 'Forest', 'Maid', 'Café',
+                'Halloween', 'Navidad', 'YCH', 'Reward', 'Sketch', 'Commission', 'Pin-up', 'Knight']
+UNICODE_WORDS = ['かわいい猫', '夏祭り', 'Ñandú', 'Año Nuevo', 'Café ☕', 'Überraschung', '😀', '🦊 zorro', 'Žena']
+SUFFIXES = ['parte {n}', 'part {n}', '#{n}', 'Set {c}', 'Ch. {n}', 'vol {n}', '({n})', '[{n}]', 'page {n}', '']
+WIP_MARKERS = ['WIP', 'wip', 'Preview', 'Sketch', 'Final', 'FINAL', 'v2']
+
+
+def _base_title(rng: random.Random, unicode_ratio: float) -> str:
+    words = rng.sample(SERIES_WORDS, rng.randint(2, 4))
+    if rng.random() < unicode_ratio:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(UNICODE_WORDS))
+    return ' '.join(words)
+
+
+def generate_titles(count: int, seed: int = 1234, unicode_ratio: float = 0.2, series_count: int = None):
+    """
+    Realistic post titles: series with part numbers, a share of Unicode
+    titles, WIP/preview variants and near-duplicate spellings. Titles repeat
+    the way they do across a creator's posts and attachments.
+    """
+    rng = random.Random(seed)
+    series_count = series_count or max(1, count // 40)
+    series = [_base_title(rng, unicode_ratio) for _ in range(series_count)]
+    titles = []
+    for _ in range(count):
+        base = rng.choice(series)
+        roll = rng.random()
+        if roll < 0.1:
+            title = f"{rng.choice(WIP_MARKERS)} {base}"
+        elif roll < 0.15:
+            title = base.lower() + rng.choice(['', '!', ' ', '  ', '.'])  # Near duplicate
+        else:
+            title = base
+        suffix = rng.choice(SUFFIXES).format(n=rng.randint(1, 12), c=rng.choice('ABCD'))
+        titles.append(f"{title} {suffix}".strip())
+    return titles
+
+
+def generate_creator(post_count: int, seed: int = 1234, unicode_ratio: float = 0.2):
+    """
+    A synthetic creator in the shape returned by the API: series with part
+    numbers, Unicode titles, WIP sets and near-duplicates, 1-5 images per
+    post and ~5% text-only posts (which the grouper must skip).
+    """
+    rng = random.Random(seed)
+    posts = []
+    for i, title in enumerate(generate_titles(post_count, seed, unicode_ratio)):
+        post = {'id': str(100000 + i), 'title': title, 'published': f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T00:00:00"}
+        if rng.random() >= 0.05:
+            post['file'] = {'name': f"{i}_main.png", 'path': f"/data/{i:08x}/main.png"}
+            post['attachments'] = [{'name': f"{i}_{a}.jpg", 'path': f"/data/{i:08x}/{a}.jpg"} for a in range(rng.randint(0, 4))]
+        posts.append(post)
+    return posts
+
+
+# --- sanitize_filename ---
+def legacy_sanitize_filename(name, replace_space_with='_'):
+    """sanitize_filename before memoization: unidecode and uncompiled regexes on every call."""
+    if not isinstance(name, str):
+        name = str(name)
+    sanitized = unidecode(name)
+    sanitized = re.sub(r'[\\/*?:"<>|\x00-\x1f\x7f]', '', sanitized)
+    if replace_space_with is not None:
+        sanitized = re.sub(r'\s+', replace_space_with, sanitized)
+    sanitized = sanitized.strip(". " + (replace_space_with if replace_space_with else ''))
+    if not sanitized or all(c == '.' for c in sanitized):
+        return "untitled"
+    return sanitized
+
+
+def _time_per_call(func, inputs):
+    start = time.perf_counter()
+    for value in inputs:
+        func(value)
+    return (time.perf_counter() - start) / len(inputs)
+
+
+def bench_sanitize(count: int, seed: int):
+    # Same call pattern as the downloader: the full title and its group basis
+    # (title without the part suffix) are sanitized for every post.
+    titles = []
+    for title in generate_titles(count // 2, seed):
+        titles.append(title)
+        titles.append(SUFFIX_REGEX.sub('', title).strip() or title)
+    for title in titles[:2000]:
+        assert legacy_sanitize_filename(title) == utils.sanitize_filename(title), title
+    utils._sanitize_filename_cached.cache_clear()
+
+    results = {
+        'legacy (unidecode always)': _time_per_call(legacy_sanitize_filename, titles),
+        'split/join, no cache': _time_per_call(utils._sanitize_filename_uncached, titles),
+        'memoized (cold cache)': _time_per_call(utils.sanitize_filename, titles),
+        'memoized (warm cache)': _time_per_call(utils.sanitize_filename, titles),
+    }
+    info = utils._sanitize_filename_cached.cache_info()
+    print(f"sanitize_filename: {len(titles)} llamadas ({len(set(titles))} distintos):")
+    baseline = results['legacy (unidecode always)']
+    for label, per_call in results.items():
+        print(f"  {label:<28} {per_call * 1e6:8.2f} µs/llamada  (x{baseline / per_call:.1f})")
+    print(f"  caché: {info.hits} aciertos, {info.misses} fallos, {info.currsize}/{info.maxsize} entradas")
+    return results
+
+
+# --- Grouping engines ---
+GROUPING_SIZES = (1_000, 10_000, 100_000)
+REGRESSION_THRESHOLD = 1.2 # Slower than this ratio vs. the previous results is flagged...
+REGRESSION_MIN_SECONDS = 0.005 # ...unless the difference is below timer noise
+
+
+def _measure(func, *args, repeat=3):
+    """Best wall time of `repeat` calls, then peak traced memory of one more call."""
+    elapsed = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = min(elapsed, time.perf_counter() - start)
+        del result
+    gc.collect()
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': round(elapsed, 6), 'peak_mb': round(peak / (1024 * 1024), 2)}
+
+
+def _cold_cache(func):
+    def wrapper(*args):
+        utils._sanitize_filename_cached.cache_clear()
+        return func(*args)
+    return wrapper
+
+
+def _comunes_pairs(names, pairs):
+    for a, b in pairs:
+        fusionar.encontrar_comunes(names[a], names[b])
+
+
+def bench_grouping(sizes, seed: int, repeat: int = 3):
+    results = []
+    for size in sizes:
+        posts = generate_creator(size, seed)
+        # The folders a download of this creator produces are what fusionar clusters
+        folders = [os.path.join('creator', name) for name in group_posts_by_title(posts)]
+        names = [os.path.basename(f) for f in folders]
+        rng = random.Random(seed)
+        pairs = [(rng.randrange(len(names)), rng.randrange(len(names))) for _ in range(min(size, 20_000))]
+
+        for engine, func, args, items in (
+            ('grouper.group_posts_by_title', group_posts_by_title, (posts,), size),
+            ('fusionar.agrupar_rutas', fusionar.agrupar_rutas, (folders,), len(folders)),
+            ('fusionar.encontrar_comunes', _comunes_pairs, (names, pairs), len(pairs)),
+        ):
+            utils._sanitize_filename_cached.cache_clear() # Every size starts cold
+            if func is group_posts_by_title: # ...and each timed call too
+                func = _cold_cache(group_posts_by_title)
+            entry = {'engine': engine, 'posts': size, 'items': items, **_measure(func, *args, repeat=repeat)}
+            results.append(entry)
+            print(f"  {engine:<30} {size:>7} posts  {items:>7} ítems  {entry['seconds']:8.3f}s  pico {entry['peak_mb']:8.2f} MB")
+    return results
+
+
+# --- Download engine (full DownloadWorker jobs against fake_kemono.py) ---
+def _percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def bench_download(posts, file_size: int, faults: fake_kemono.FaultConfig, retry_delay: float = 0.2):
+    """
+    Runs one complete download job (listing, grouping, manifests, downloads)
+    into a temporary folder and returns throughput, per-file latency
+    percentiles and what the server answered.
+    """
+    from worker import DownloadWorker # PyQt6 / google-genai: only this benchmark needs them
+    os.environ['GEMINI_API_KEY'] = '' # Title grouping: the fake server is the only network peer
+    with fake_kemono.FakeKemonoServer(posts, file_size=file_size, faults=faults) as server, \
+            tempfile.TemporaryDirectory() as output_dir:
+        worker = DownloadWorker(server.service, server.creator_id, output_dir, api_base_url=server.api_base_url)
+        worker.api.page_delay = 0
+        worker.api.retry_delay = retry_delay
+        latencies = []
+        download_image = worker.api.download_image
+
+        def timed_download(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return download_image(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start) # Includes retries, like the user sees it
+
+        worker.api.download_image = timed_download
+        outcome = {}
+        worker.finished.connect(lambda ok, message: outcome.update(ok=ok, message=message))
+        start = time.perf_counter()
+        worker.run() # In this thread: no Qt event loop needed
+        elapsed = time.perf_counter() - start
+        server_stats = dict(server.stats)
+
+    downloaded = worker.total_images_downloaded
+    return {
+        'posts': len(posts),
+        'file_size': file_size,
+        'files': downloaded,
+        'failed': worker.total_images_failed,
+        'ok': outcome.get('ok', False),
+        'seconds': round(elapsed, 3),
+        'files_per_s': round(downloaded / elapsed, 1) if elapsed else 0.0,
+        'mb_per_s': round(downloaded * file_size / (1024 * 1024) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 1),
+        'server': server_stats,
+    }
+
+
+# --- Pixelation (censura) ---
+def legacy_pixelate(img, boxes, level):
+    """pixelate_and_save before NumPy: RGBA copy, then crop -> BILINEAR down -> NEAREST up -> alpha paste."""
+    pixelated = img.copy()
+    if pixelated.mode != 'RGBA':
+        pixelated = pixelated.convert('RGBA')
+    for box in boxes:
+        region = pixelated.crop(box)
+        small = region.resize((max(1, region.width // level), max(1, region.height // level)), Image.Resampling.BILINEAR)
+        region = small.resize(region.size, Image.Resampling.NEAREST)
+        pixelated.paste(region, box[:2], region.split()[-1])
+    return pixelated.convert('RGB') # Saved as JPEG
+
+
+def bench_pixelate(megapixels: float, level: int, regions: int, mode: str, seed: int, repeat: int = 3):
+    """Best time of both pipelines on a noise image (worst case for any codec-side shortcut)."""
+    width = int((megapixels * 1e6 * 3 / 2) ** 0.5) # 3:2, like a camera: 24 MP -> 6000x4000
+    height = int(megapixels * 1e6 / width)
+    rng = np.random.default_rng(seed)
+    channels = {'L': 1, 'RGB': 3, 'RGBA': 4}[mode]
+    pixels = rng.integers(0, 256, (height, width, channels), dtype=np.uint8)
+    img = Image.fromarray(pixels[:, :, 0] if channels == 1 else pixels, mode)
+    if regions <= 1:
+        boxes = [(0, 0, width, height)]
+    else:
+        boxes = []
+        for _ in range(regions):
+            w, h = rng.integers(width // 10, width // 3), rng.integers(height // 10, height // 3)
+            x, y = rng.integers(0, width - w), rng.integers(0, height - h)
+            boxes.append((int(x), int(y), int(x + w), int(y + h)))
+    results = {}
+    for name, func in (('legacy', legacy_pixelate), ('numpy', censura.pixelate_regions)):
+        best = float('inf')
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            func(img, boxes, level)
+            best = min(best, time.perf_counter() - start)
+        results[name] = round(best, 4)
+        print(f"  {name:<7} {best * 1000:8.1f} ms  ({width}x{height} {mode}, {len(boxes)} zonas, nivel {level})")
+    print(f"  Aceleración: x{results['legacy'] / results['numpy']:.1f}")
+    return results
+
+
+def _git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare_results(previous, current):
+    """Prints current vs. previous timings; returns the entries that got slower than REGRESSION_THRESHOLD."""
+    old = {(r['engine'], r['posts']): r for r in previous.get('results', [])}
+    regressions = []
+    for entry in current['results']:
+        before = old.get((entry['engine'], entry['posts']))
+        if not before or not before['seconds']:
+            continue
+        ratio = entry['seconds'] / before['seconds']
+        slower = entry['seconds'] - before['seconds'] > REGRESSION_MIN_SECONDS
+        flag = 'REGRESIÓN' if ratio > REGRESSION_THRESHOLD and slower else ''
+        print(f"  {entry['engine']:<30} {entry['posts']:>7}  {before['seconds']:8.3f}s -> {entry['seconds']:8.3f}s  x{ratio:.2f} {flag}")
+        if flag:
+            regressions.append(entry)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de El_Zorro")
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+    p_sanitize = sub.add_parser('sanitize', help="Coste por llamada de utils.sanitize_filename")
+    p_sanitize.add_argument('--count', type=int, default=100_000)
+    p_sanitize.add_argument('--seed', type=int, default=1234)
+    p_grouping = sub.add_parser('grouping', help="Tiempo y memoria de los motores de agrupado")
+    p_grouping.add_argument('--sizes', type=int, nargs='+', default=list(GROUPING_SIZES))
+    p_grouping.add_argument('--seed', type=int, default=1234)
+    p_grouping.add_argument('--repeat', type=int, default=3, help="Repeticiones por medida (se guarda la mejor)")
+    p_grouping.add_argument('--output', metavar='RESULTS.json', help="Guarda los resultados en JSON")
+    p_grouping.add_argument('--compare', metavar='RESULTS.json', help="Compara con resultados anteriores")
+    p_download = sub.add_parser('download', help="Trabajos de descarga completos contra fake_kemono.py")
+    p_download.add_argument('--posts', type=int, default=200)
+    p_download.add_argument('--fixture', help="Posts grabados (JSON o JSON lines) en vez de sintéticos")
+    p_download.add_argument('--file-size', type=int, default=fake_kemono.DEFAULT_FILE_SIZE)
+    p_download.add_argument('--latency', type=float, default=0.005)
+    p_download.add_argument('--jitter', type=float, default=0.02)
+    p_download.add_argument('--rate-429', type=float, default=0.0)
+    p_download.add_argument('--rate-5xx', type=float, default=0.0)
+    p_download.add_argument('--rate-reset', type=float, default=0.0)
+    p_download.add_argument('--rate-slow', type=float, default=0.0)
+    p_download.add_argument('--retry-delay', type=float, default=0.2, help="Espera entre reintentos (la real es 3s)")
+    p_download.add_argument('--seed', type=int, default=1234)
+    p_download.add_argument('--output', metavar='RESULTS.json', help="Guarda los resultados en JSON")
+    p_pixelate = sub.add_parser('pixelate', help="Pixelado de censura.py contra el de PIL anterior")
+    p_pixelate.add_argument('--megapixels', type=float, default=24.0)
+    p_pixelate.add_argument('--level', type=int, default=10)
+    p_pixelate.add_argument('--regions', type=int, default=1, help="1 = la imagen entera; más = zonas al azar")
+    p_pixelate.add_argument('--mode', choices=('L', 'RGB', 'RGBA'), default='RGB')
+    p_pixelate.add_argument('--repeat', type=int, default=3)
+    p_pixelate.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args(argv)
+
+    if args.benchmark == 'sanitize':
+        bench_sanitize(args.count, args.seed)
+    elif args.benchmark == 'grouping':
+        print("Motores de agrupado:")
+        report = {
+            'benchmark': 'grouping',
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'repeat': args.repeat,
+            'results': bench_grouping(args.sizes, args.seed, args.repeat),
+        }
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Resultados guardados en {args.output}")
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+            print(f"Comparación con {args.compare} (revisión {previous.get('revision')}):")
+            if compare_results(previous, report):
+                return 1
+    elif args.benchmark == 'download':
+        posts = fake_kemono.load_fixture(args.fixture) if args.fixture else fake_kemono.synthetic_posts(args.posts, seed=args.seed)
+        faults = fake_kemono.FaultConfig(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                                         rate_5xx=args.rate_5xx, rate_reset=args.rate_reset,
+                                         rate_slow=args.rate_slow, seed=args.seed, retry_after=0)
+        result = bench_download(posts, args.file_size, faults, args.retry_delay)
+        print(f"Descarga: {result['files']} archivos ({result['failed']} fallidos) de {result['posts']} posts en {result['seconds']:.2f}s")
+        print(f"  {result['files_per_s']} archivos/s, {result['mb_per_s']} MB/s")
+        print(f"  latencia por archivo: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms")
+        print(f"  respuestas del servidor: {result['server']}")
+        if args.output:
+            report = {'benchmark': 'download', 'revision': _git_revision(), 'python': platform.python_version(),
+                      'seed': args.seed, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'result': result}
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Resultados guardados en {args.output}")
+    elif args.benchmark == 'pixelate':
+        print("Pixelado:")
+        bench_pixelate(args.megapixels, args.level, args.regions, args.mode, args.seed, args.repeat)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,407 @@
+# censura.py
+# Censura no destructiva, sin Tk: la usan censurador_manual.py, la galería web
+# y las herramientas de video.
+#
+# Las zonas marcadas y el nivel de pixelado de cada imagen viven en un sidecar
+# pequeño junto a ella (12.jpg -> 12.jpg.censura.json); la original no se toca.
+# La versión censurada se genera cuando alguien la pide (censored_variant) y se
+# guarda en una caché con clave hash(original, zonas, nivel): cambiar las zonas
+# o la imagen da otra clave, y las versiones viejas se van podando solas.
+# Los `_pixelado` escritos a mano antes siguen valiendo para las imágenes sin sidecar.
+#
+# El sidecar solo está unido a su imagen por el nombre: quien renombre, mueva o
+# borre imágenes (reordenar y fusionar en la galería, fusionar.py) tiene que
+# llevarse el sidecar con ella (sidecar_renames / orphan_sidecars). Por si acaso,
+# el sidecar guarda la huella (tamaño y sha1) de su imagen y censored_variant se
+# niega a usarlo con otra.
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+
+from group_manifest import file_fingerprint
+from utils import get_cache_dir, prune_cache_dir
+
+# Modos que se pixelan tal cual con NumPy; el resto (P, 1, I;16...) se convierte antes
+NUMPY_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK')
+ALPHA_MODES = ('LA', 'RGBA')
+PIXELATE_STRIP_PIXELS = 1 << 20 # Píxeles por franja en pixelate_array
+
+# Zonas marcadas: un JSON junto a cada imagen (12.jpg -> 12.jpg.censura.json) con
+# coordenadas normalizadas (0-1), así que cualquiera sirve de plantilla para otras
+# imágenes aunque tengan otro tamaño.
+CENSURA_SUFFIX = '.censura.json'
+CENSURA_VERSION = 2 # 2: huella de la imagen ('source'); los de la versión 1 no la tienen
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+DEFAULT_BATCH_WORKERS = max(1, min(8, os.cpu_count() or 1))
+
+# Versiones censuradas generadas a partir del sidecar (ver censored_variant)
+RENDER_CACHE_NAME = 'censura'
+RENDER_CACHE_MAX_BYTES = 1024 ** 3 # Las menos usadas se borran pasado este tamaño
+RENDER_CACHE_VERSION = 1 # Subir si cambia pixelate_regions
+RENDER_PRUNE_EVERY = 64 # Renders nuevos entre podas de la caché
+
+
+# --- Pixelación ---
+def _sum_blocks(arr, blocks, size, dtype):
+    """
+    Suma `blocks` bloques de `size` filas consecutivas de `arr`; las filas
+    que sobran al final van al último bloque. Se suman vistas (una por fila
+    del bloque) en vez de reducir un eje corto, que en NumPy es varias veces
+    más lento.
+    """
+    main = blocks * size
+    view = arr[:main].reshape((blocks, size) + arr.shape[1:]) # Vista: no copia
+    sums = view[:, 0].astype(dtype)
+    for k in range(1, size):
+        sums += view[:, k]
+    if main < arr.shape[0]:
+        sums[-1] += arr[main:].sum(axis=0, dtype=dtype)
+    return sums
+
+
+def _block_counts(length, level):
+    blocks = max(1, length // level)
+    counts = np.full(blocks, length // blocks)
+    counts[-1] += length - blocks * (length // blocks)
+    return counts
+
+
+def pixelate_array(arr, level, has_alpha=False, out=None):
+    """
+    Pixela un array uint8 (alto x ancho x canales) en bloques: cada bloque
+    pasa a ser la media de sus píxeles. Hay ancho // level bloques por fila
+    (y alto // level por columna), igual que con el slider de la GUI.
+
+    Con alfa, el color se promedia ponderado por la opacidad, para que los
+    píxeles transparentes no oscurezcan el bloque. Se procesa por franjas de
+    filas de bloques (PIXELATE_STRIP_PIXELS), así los temporales caben en
+    caché. `out` puede ser el mismo `arr` para pixelar en el sitio.
+    """
+    h, w = arr.shape[:2]
+    out = np.empty_like(arr) if out is None else out
+    if has_alpha and arr[:, :, -1].min() == 255:
+        has_alpha = False # Alfa opaco (muy común en PNG): no hace falta ponderar
+    counts_y, counts_x = _block_counts(h, level), _block_counts(w, level)
+    size_y, size_x = int(counts_y[0]), int(counts_x[0])
+    largest = int(counts_y[-1]) * int(counts_x[-1])
+    peak = 255 * 255 if has_alpha else 255
+    dtype = np.uint32 if largest * peak < 2 ** 32 else np.uint64
+    step = max(1, PIXELATE_STRIP_PIXELS // (size_y * w)) # Filas de bloques por franja
+    for first in range(0, len(counts_y), step):
+        last = min(len(counts_y), first + step)
+        y0 = first * size_y
+        y1 = h if last == len(counts_y) else last * size_y
+        strip = arr[y0:y1]
+        if has_alpha:
+            # Color premultiplicado; canal a canal, que es bastante más rápido que con broadcasting
+            premultiplied = np.empty(strip.shape, np.uint16)
+            alpha = strip[:, :, -1]
+            for channel in range(strip.shape[2] - 1):
+                np.multiply(strip[:, :, channel], alpha, out=premultiplied[:, :, channel], dtype=np.uint16)
+            premultiplied[:, :, -1] = alpha
+            strip = premultiplied
+        # Primero por filas (contiguo) y luego por columnas, sobre el resultado ya pequeño
+        sums = _sum_blocks(strip, last - first, size_y, dtype)
+        sums = _sum_blocks(sums.swapaxes(0, 1), len(counts_x), size_x, dtype).swapaxes(0, 1)
+        area = (counts_y[first:last, None] * counts_x[None, :])[:, :, None]
+        if has_alpha:
+            alpha_sum = sums[:, :, -1:]
+            color = np.divide(sums[:, :, :-1], alpha_sum, out=np.zeros(sums[:, :, :-1].shape), where=alpha_sum > 0)
+            means = np.concatenate((color, alpha_sum / area), axis=2)
+        else:
+            means = sums / area
+        rows = np.repeat(np.rint(means).clip(0, 255).astype(np.uint8), counts_x, axis=1)
+        # Cada fila de bloques se copia directamente a sus size_y filas de salida
+        full = (last - first) * size_y
+        out[y0:y0 + full].reshape((last - first, size_y) + out.shape[1:])[:] = rows[:, None]
+        if y0 + full < y1:
+            out[y0 + full:y1] = rows[-1]
+    return out
+
+
+def pixelate_regions(img, boxes, level):
+    """
+    Devuelve una copia de `img` con las cajas (x1, y1, x2, y2, en píxeles de
+    la imagen) pixeladas. Trabaja en el modo de la imagen: un JPEG RGB sigue
+    siendo RGB (sin ida y vuelta a RGBA); solo P/1/etc. se convierten a RGB(A)/L.
+    """
+    if img.mode not in NUMPY_MODES:
+        has_transparency = img.mode in ('PA', 'La') or 'transparency' in img.info
+        img = img.convert('RGBA' if has_transparency else 'L' if img.mode == '1' else 'RGB')
+    pixels = np.array(img) # La única copia de la imagen entera
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+    img_h, img_w = pixels.shape[:2]
+    for x1, y1, x2, y2 in boxes:
+        x1, x2 = max(0, min(int(x1), img_w)), max(0, min(int(x2), img_w))
+        y1, y2 = max(0, min(int(y1), img_h)), max(0, min(int(y2), img_h))
+        if x2 > x1 and y2 > y1:
+            region = pixels[y1:y2, x1:x2]
+            pixelate_array(region, level, img.mode in ALPHA_MODES, out=region)
+    return Image.fromarray(pixels[:, :, 0] if img.mode == 'L' else pixels, img.mode)
+
+
+def pixelated_path(path):
+    """Nombre del resultado censurado: 12.jpg -> 12_pixelado.jpg."""
+    base, ext = os.path.splitext(path)
+    return f"{base}_pixelado{ext}"
+
+
+def save_pixelated(img, path):
+    """Guarda en el formato de `path`; JPEG no admite alfa, así que solo ahí se quita."""
+    if os.path.splitext(path)[1].lower() in ('.jpg', '.jpeg') and img.mode not in ('RGB', 'L', 'CMYK'):
+        img = img.convert('RGB')
+    img.save(path)
+
+
+# --- Plantillas de zonas (JSON con coordenadas normalizadas) ---
+class SidecarMismatchError(ValueError):
+    """El sidecar se guardó para otra imagen (renombrada, reordenada o editada después)."""
+
+
+def sidecar_path(image_path):
+    return image_path + CENSURA_SUFFIX
+
+
+def is_sidecar(name):
+    return name.endswith(CENSURA_SUFFIX)
+
+
+def sidecar_renames(mapping, names):
+    """
+    Renombres de los sidecars que acompañan a `mapping` (imagen -> nombre
+    nuevo), para añadirlos al mismo plan o moverlos con ellas a otra carpeta:
+    solo los que existen en `names`.
+    """
+    names = set(names)
+    return {sidecar_path(src): sidecar_path(dst) for src, dst in mapping.items()
+            if sidecar_path(src) in names}
+
+
+def orphan_sidecars(names):
+    """Sidecars de `names` cuya imagen ya no está: la siguiente con ese nombre heredaría sus zonas."""
+    names = set(names)
+    return sorted(n for n in names if is_sidecar(n) and n[:-len(CENSURA_SUFFIX)] not in names)
+
+
+def source_fingerprint(image_path):
+    """Huella que el sidecar guarda de su imagen."""
+    sha1, size, _ = file_fingerprint(image_path)
+    return {'size': size, 'sha1': sha1}
+
+
+def check_source(image_path, source, full=True):
+    """
+    SidecarMismatchError si `image_path` no es la imagen de huella `source`
+    (None: sidecar antiguo, sin huella). El tamaño se compara siempre; el
+    sha1, que lee la imagen entera, solo con `full`.
+    """
+    if not source:
+        return
+    if os.path.getsize(image_path) != source.get('size') or (full and file_fingerprint(image_path)[0] != source.get('sha1')):
+        raise SidecarMismatchError(
+            f"{os.path.basename(sidecar_path(image_path))}: las zonas se guardaron para otra imagen "
+            f"(¿renombrada, reordenada o editada?). Vuelve a marcarlas en censurador_manual.")
+
+
+def normalize_boxes(boxes, size):
+    """Cajas en píxeles -> fracciones del ancho/alto (0-1), recortadas a la imagen."""
+    w, h = size
+    regions = []
+    for x1, y1, x2, y2 in boxes:
+        region = [round(min(max(v / d, 0.0), 1.0), 6) for v, d in ((x1, w), (y1, h), (x2, w), (y2, h))]
+        if region[2] > region[0] and region[3] > region[1]:
+            regions.append(region)
+    return regions
+
+
+def denormalize_boxes(regions, size):
+    w, h = size
+    return [(round(x1 * w), round(y1 * h), round(x2 * w), round(y2 * h)) for x1, y1, x2, y2 in regions]
+
+
+def save_regions(path, regions, level, source=None):
+    """
+    Escribe una plantilla / sidecar (regiones normalizadas y nivel) de forma
+    atómica. Un sidecar lleva además la huella de su imagen (`source`).
+    """
+    data = {'version': CENSURA_VERSION, 'level': int(level), 'regions': regions}
+    if source:
+        data['source'] = source
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_sidecar(path):
+    """(regiones normalizadas, nivel, huella o None) de una plantilla o sidecar. ValueError si no es válido."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    try:
+        regions = [[float(v) for v in region] for region in data['regions']]
+        level = int(data['level'])
+        source = data.get('source')
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"{os.path.basename(path)} no es una plantilla de censura: {e}") from e
+    if level < 1 or any(len(region) != 4 for region in regions) or not isinstance(source, (dict, type(None))):
+        raise ValueError(f"{os.path.basename(path)} no es una plantilla de censura válida.")
+    return regions, level, source
+
+
+def load_regions(path):
+    """(regiones normalizadas, nivel) de una plantilla o sidecar. ValueError si no es válido."""
+    return load_sidecar(path)[:2]
+
+
+def censorable_images(folder):
+    """Imágenes originales de `folder` (sin los resultados _pixelado), por nombre."""
+    names = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS)
+                   and not os.path.splitext(f)[0].lower().endswith('_pixelado'))
+    return [os.path.join(folder, f) for f in names]
+
+
+def apply_regions(image_path, regions, level, bake=False):
+    """
+    Guarda el sidecar con `regions` (normalizadas) y `level`, y deja la
+    versión censurada ya generada en la caché. Con `bake` también escribe
+    el _pixelado de siempre junto a la imagen. Es lo que ejecuta cada
+    proceso del lote; devuelve la ruta de la versión censurada.
+    """
+    save_regions(sidecar_path(image_path), regions, level, source_fingerprint(image_path))
+    if not bake:
+        return render_censored(image_path, regions, level)
+    censored = _pixelate_file(image_path, regions, level)
+    out_path = pixelated_path(image_path)
+    save_pixelated(censored, out_path)
+    _store_render(censored, render_cache_path(image_path, regions, level))
+    return out_path
+
+
+def apply_template(images, regions, level, workers=DEFAULT_BATCH_WORKERS, progress=None, bake=False):
+    """
+    Aplica la misma plantilla a muchas imágenes en un pool de procesos (la
+    pixelación es CPU pura y cada imagen es independiente). `progress(hechas,
+    total, ruta, error)` se llama al terminar cada una. Devuelve los errores
+    como [(ruta, mensaje)].
+    """
+    errors = []
+    if not images:
+        return errors
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(images)))) as pool:
+        futures = {pool.submit(apply_regions, path, regions, level, bake): path for path in images}
+        for done, future in enumerate(as_completed(futures), 1):
+            path, error = futures[future], None
+            try:
+                future.result()
+            except Exception as e: # Una imagen rota no para el lote
+                error = str(e)
+                errors.append((path, error))
+            if progress:
+                progress(done, len(images), path, error)
+    prune_render_cache()
+    return errors
+
+
+# --- Versiones censuradas bajo demanda (caché por hash de original, zonas y nivel) ---
+_prune_lock = threading.Lock()
+_renders_since_prune = 0
+
+
+def render_cache_path(image_path, regions, level):
+    """Dónde se guarda la versión censurada: la clave cambia con la imagen (ruta, mtime, tamaño), las zonas o el nivel."""
+    st = os.stat(image_path)
+    raw = json.dumps([RENDER_CACHE_VERSION, os.path.abspath(image_path), st.st_mtime_ns, st.st_size,
+                      int(level), regions])
+    key = hashlib.sha1(raw.encode('utf-8', 'surrogatepass')).hexdigest()
+    ext = os.path.splitext(image_path)[1].lower()
+    return os.path.join(get_cache_dir(RENDER_CACHE_NAME), key[:2], key + ext)
+
+
+def _pixelate_file(image_path, regions, level):
+    with Image.open(image_path) as img:
+        img.load()
+        return pixelate_regions(img, denormalize_boxes(regions, img.size), level)
+
+
+def _store_render(img, dst):
+    """Escribe en la caché de forma atómica: otro hilo o proceso nunca lee un archivo a medias."""
+    global _renders_since_prune
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    base, ext = os.path.splitext(dst)
+    tmp = f"{base}.{os.getpid()}.{threading.get_ident()}{ext}" # Misma extensión: PIL elige el formato por ella
+    try:
+        save_pixelated(img, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    with _prune_lock:
+        _renders_since_prune += 1
+        prune = _renders_since_prune >= RENDER_PRUNE_EVERY
+        if prune:
+            _renders_since_prune = 0
+    if prune:
+        prune_render_cache()
+
+
+def render_censored(image_path, regions, level, source=None):
+    """
+    Ruta en caché de `image_path` con `regions` pixeladas; solo se pixela si
+    aún no está, y antes se comprueba la huella `source` del sidecar (la
+    clave de la caché ya incluye ruta, mtime y tamaño de la imagen comprobada).
+    """
+    dst = render_cache_path(image_path, regions, level)
+    if os.path.exists(dst):
+        try:
+            os.utime(dst) # La poda borra primero las menos usadas
+        except OSError:
+            pass
+        return dst
+    check_source(image_path, source)
+    _store_render(_pixelate_file(image_path, regions, level), dst)
+    return dst
+
+
+def censored_variant(image_path):
+    """
+    La versión censurada de `image_path`, o None si la imagen no tiene censura:
+    con sidecar se genera (o se reutiliza de la caché) a partir de sus zonas;
+    sin él vale un `_pixelado` antiguo si existe. Un sidecar sin zonas devuelve
+    la propia imagen. ValueError si el sidecar está roto, y SidecarMismatchError
+    si es de otra imagen: mejor fallar que servir una sin censurar.
+    """
+    sidecar = sidecar_path(image_path)
+    if os.path.exists(sidecar):
+        regions, level, source = load_sidecar(sidecar)
+        check_source(image_path, source, full=False) # El sha1 se comprueba al pixelar
+        return render_censored(image_path, regions, level, source) if regions else image_path
+    baked = pixelated_path(image_path)
+    return baked if os.path.exists(baked) else None
+
+
+def censored_paths(paths):
+    """`paths` con cada imagen cambiada por su versión censurada, si la tiene (para las herramientas de video)."""
+    return [censored_variant(path) or path for path in paths]
+
+
+def prune_render_cache(max_bytes=RENDER_CACHE_MAX_BYTES):
+    """Borra las versiones censuradas menos usadas hasta que la caché quepa en `max_bytes`."""
+    prune_cache_dir(get_cache_dir(RENDER_CACHE_NAME), max_bytes)
+
+
+if __name__ == '__main__':
+    # python censura.py 12.jpg 13.jpg -> dónde queda la versión censurada de cada una
+    import sys
+    for arg in sys.argv[1:]:
+        try:
+            variant = censored_variant(arg)
+        except (OSError, ValueError) as e:
+            print(f"ERROR: {arg}: {e}")
+            continue
+        print(f"{arg} -> {variant or 'sin censura'}")
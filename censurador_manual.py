@@ -1,12 +1,134 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk, ImageDraw, ImageFilter
+from PIL import Image, ImageTk
+import argparse
 import os
+import queue
+import sys
+import threading
+
+from censura import (CENSURA_SUFFIX, DEFAULT_BATCH_WORKERS, SidecarMismatchError, apply_regions, apply_template,
+                     censorable_images, check_source, denormalize_boxes, load_regions, load_sidecar,
+                     normalize_boxes, save_regions, sidecar_path)
 
 # Tamaño máximo para mostrar la imagen en la interfaz (para evitar ventanas enormes)
 MAX_DISPLAY_WIDTH = 800
 MAX_DISPLAY_HEIGHT = 600
 
+PREFETCH_RADIUS = 2 # Imágenes preparadas a cada lado de la actual
+
+
+# --- Lote sin interfaz (la pixelación y los sidecars están en censura.py) ---
+def main_batch(argv=None):
+    parser = argparse.ArgumentParser(description="Aplica una plantilla de censura a carpetas enteras")
+    parser.add_argument('plantilla', help=f"Plantilla o sidecar ({CENSURA_SUFFIX}) con las zonas")
+    parser.add_argument('carpetas', nargs='+', help="Carpetas con imágenes (o de creador, con --grupos)")
+    parser.add_argument('--grupos', action='store_true', help="Cada carpeta es de creador: aplica a todos sus grupos")
+    parser.add_argument('--nivel', type=int, help="Nivel de pixelación (por defecto el de la plantilla)")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_BATCH_WORKERS, help="Procesos en paralelo")
+    parser.add_argument('--pixelado', action='store_true', help="Escribe también los _pixelado junto a las originales")
+    args = parser.parse_args(argv)
+
+    try:
+        regions, level = load_regions(args.plantilla)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}")
+        return 1
+    folders = []
+    for folder in args.carpetas:
+        if args.grupos:
+            folders += sorted(e.path for e in os.scandir(folder) if e.is_dir())
+        else:
+            folders.append(folder)
+    images = [path for folder in folders for path in censorable_images(folder)]
+    print(f"INFO: {len(regions)} zonas, nivel {args.nivel or level}, {len(images)} imágenes en {len(folders)} carpetas.")
+
+    def report(done, total, path, error):
+        name = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+        print(f"[{done}/{total}] {name}" + (f": ERROR: {error}" if error else ""), flush=True)
+
+    errors = apply_template(images, regions, args.nivel or level, args.jobs, report, bake=args.pixelado)
+    print(f"INFO: {len(images) - len(errors)} imágenes censuradas, {len(errors)} con error.")
+    return 1 if errors else 0
+
+
+# --- Imágenes para mostrar (reducidas, con prefetch) ---
+def load_display_image(path):
+    """
+    (imagen reducida para el canvas, tamaño original, factor de escala).
+    Con JPEG se decodifica directamente a 1/2, 1/4 o 1/8 (draft), así que
+    una foto de 24 MP nunca llega a descomprimirse entera solo para verla.
+    """
+    with Image.open(path) as img:
+        img_w, img_h = img.size
+        scale_factor = 1.0
+        if img_w > MAX_DISPLAY_WIDTH or img_h > MAX_DISPLAY_HEIGHT:
+            scale_factor = min(MAX_DISPLAY_WIDTH / img_w, MAX_DISPLAY_HEIGHT / img_h)
+        display_size = (int(img_w * scale_factor), int(img_h * scale_factor))
+        img.draft(img.mode if img.mode in ('RGB', 'L') else None, display_size)
+        if img.size != display_size:
+            display = img.resize(display_size, Image.Resampling.LANCZOS)
+        else:
+            display = img.copy()
+    return display, (img_w, img_h), scale_factor
+
+
+class DisplayPrefetcher:
+    """
+    Anillo de imágenes ya reducidas alrededor de la actual: mientras se
+    censura una, un hilo prepara las PREFETCH_RADIUS siguientes y
+    anteriores, así "Siguiente" / "Anterior" no esperan a decodificar.
+    Solo se guardan las versiones para mostrar; la original se abre al
+    guardar.
+    """
+
+    def __init__(self, radius=PREFETCH_RADIUS):
+        self.capacity = 2 * radius + 1
+        self._ring = {} # ruta -> (display, tamaño original, escala)
+        self._todo = []
+        self._window = set()
+        self._in_progress = None
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="censor-prefetch", daemon=True).start()
+
+    def get(self, path):
+        """La imagen para mostrar: del anillo, esperando al hilo si justo la está preparando, o decodificada aquí."""
+        with self._cond:
+            while self._in_progress == path:
+                self._cond.wait()
+            entry = self._ring.get(path)
+        return entry if entry is not None else load_display_image(path)
+
+    def focus(self, paths, current):
+        """`paths` es la ventana alrededor de `current` (en orden de prioridad): el resto sale del anillo."""
+        with self._cond:
+            self._window = keep = set(paths)
+            for path in [p for p in self._ring if p not in keep]:
+                del self._ring[path]
+            self._todo = [p for p in paths if p != current and p not in self._ring][:self.capacity]
+            self._cond.notify()
+
+    def store(self, path, entry):
+        with self._cond:
+            self._ring[path] = entry
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._todo:
+                    self._cond.wait()
+                path = self._in_progress = self._todo.pop(0)
+            try:
+                entry = load_display_image(path)
+            except Exception:
+                entry = None # Se vuelve a intentar (y se informa) al mostrarla
+            with self._cond:
+                if entry is not None and path in self._window: # Si aún está cerca de la actual
+                    self._ring[path] = entry
+                self._in_progress = None
+                self._cond.notify_all()
+
+
 class SuperCensuradorMagico:
     def __init__(self, master):
         self.master = master
@@ -16,7 +138,8 @@ class SuperCensuradorMagico:
         self.folder_path = ""
         self.image_files = []
         self.current_image_index = -1
-        self.original_image = None # Imagen original cargada con Pillow
+        self.original_size = None # Tamaño de la original; la imagen completa solo se abre al guardar
+        self.prefetcher = DisplayPrefetcher()
         self.display_image_tk = None # Imagen formateada para Tkinter
         self.scale_factor = 1.0 # Factor de escala entre original y mostrada
         self.rectangles_coords = [] # Coordenadas de los rectángulos dibujados (en coords de display)
@@ -71,9 +194,28 @@ class SuperCensuradorMagico:
         self.btn_clear_rects = ttk.Button(self.pixel_frame, text="Borrar Marcas", command=self.clear_rectangles)
         self.btn_clear_rects.pack(side=tk.LEFT, padx=5)
 
-        self.btn_pixelate = ttk.Button(self.pixel_frame, text="Pixelar y Guardar", command=self.pixelate_and_save, state=tk.DISABLED)
+        # No destructivo: se guardan las zonas (sidecar) y la versión censurada se genera al pedirla
+        self.bake_copy = tk.BooleanVar(value=False)
+        self.chk_bake = ttk.Checkbutton(self.pixel_frame, text="Crear también _pixelado", variable=self.bake_copy)
+        self.chk_bake.pack(side=tk.LEFT, padx=5)
+
+        self.btn_pixelate = ttk.Button(self.pixel_frame, text="Guardar Zonas", command=self.pixelate_and_save, state=tk.DISABLED)
         self.btn_pixelate.pack(side=tk.LEFT, padx=5)
 
+        # Plantillas: guardar las marcas actuales y aplicarlas a una carpeta entera
+        self.template_frame = ttk.Frame(master)
+        self.template_frame.pack(pady=5, padx=10, fill=tk.X)
+
+        self.btn_save_template = ttk.Button(self.template_frame, text="Guardar Plantilla", command=self.save_template, state=tk.DISABLED)
+        self.btn_save_template.pack(side=tk.LEFT, padx=5)
+
+        self.btn_apply_template = ttk.Button(self.template_frame, text="Aplicar Plantilla a Carpeta", command=self.apply_template_to_folder)
+        self.btn_apply_template.pack(side=tk.LEFT, padx=5)
+
+        self.lbl_batch = ttk.Label(self.template_frame, text="")
+        self.lbl_batch.pack(side=tk.LEFT, padx=10, fill=tk.X, expand=True)
+        self.batch_queue = queue.Queue() # Hilo del lote -> Tk
+
 
     def select_folder(self):
         """Abre el diálogo para seleccionar una carpeta."""
@@ -87,6 +229,7 @@ class SuperCensuradorMagico:
                 self.load_image()
                 self.update_navigation_buttons()
                 self.btn_pixelate.config(state=tk.NORMAL)
+                self.btn_save_template.config(state=tk.NORMAL)
             else:
                 messagebox.showinfo("Info", "No se encontraron imágenes soportadas (.png, .jpg, .jpeg, .bmp, .gif) en la carpeta.")
                 self.reset_interface()
@@ -111,7 +254,8 @@ class SuperCensuradorMagico:
         self.btn_prev.config(state=tk.DISABLED)
         self.btn_next.config(state=tk.DISABLED)
         self.btn_pixelate.config(state=tk.DISABLED)
-        self.original_image = None
+        self.btn_save_template.config(state=tk.DISABLED)
+        self.original_size = None
         self.display_image_tk = None
         self.clear_rectangles_data()
 
@@ -123,20 +267,10 @@ class SuperCensuradorMagico:
 
         image_path = self.image_files[self.current_image_index]
         try:
-            self.original_image = Image.open(image_path)
-            # Copia para mostrar (evita modificar la original al redimensionar para display)
-            img_display = self.original_image.copy()
-
-            # Calcular factor de escala y redimensionar si es necesario
-            img_w, img_h = img_display.size
-            self.scale_factor = 1.0
-            if img_w > MAX_DISPLAY_WIDTH or img_h > MAX_DISPLAY_HEIGHT:
-                ratio_w = MAX_DISPLAY_WIDTH / img_w
-                ratio_h = MAX_DISPLAY_HEIGHT / img_h
-                self.scale_factor = min(ratio_w, ratio_h)
-                new_w = int(img_w * self.scale_factor)
-                new_h = int(img_h * self.scale_factor)
-                img_display = img_display.resize((new_w, new_h), Image.Resampling.LANCZOS)
+            # Versión reducida (del anillo de prefetch si ya está); la original se abre al guardar
+            entry = self.prefetcher.get(image_path)
+            self.prefetcher.store(image_path, entry)
+            img_display, self.original_size, self.scale_factor = entry
 
             # Convertir a formato Tkinter
             self.display_image_tk = ImageTk.PhotoImage(img_display)
@@ -151,6 +285,9 @@ class SuperCensuradorMagico:
 
             # Limpiar rectángulos anteriores
             self.clear_rectangles_data()
+            # Volver a dibujar las zonas usadas la última vez (sidecar .censura.json)
+            self.draw_saved_regions(image_path)
+            self.prefetch_neighbours()
 
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo cargar la imagen {os.path.basename(image_path)}:\n{e}")
@@ -163,6 +300,15 @@ class SuperCensuradorMagico:
             else:
                 self.reset_interface()
 
+    def prefetch_neighbours(self):
+        """Pide al hilo de prefetch las imágenes de alrededor, las siguientes primero."""
+        index = self.current_image_index
+        order = [index]
+        for step in range(1, PREFETCH_RADIUS + 1):
+            order += [index + step, index - step]
+        paths = [self.image_files[i] for i in order if 0 <= i < len(self.image_files)]
+        self.prefetcher.focus(paths, self.image_files[index])
+
     def update_navigation_buttons(self):
         """Habilita o deshabilita los botones de navegación."""
         if not self.image_files:
@@ -241,78 +387,133 @@ class SuperCensuradorMagico:
          self.start_y = None
 
 
+    def draw_saved_regions(self, image_path):
+        """Marca en el canvas las zonas del sidecar de la imagen, si lo tiene."""
+        sidecar = sidecar_path(image_path)
+        if not os.path.exists(sidecar):
+            return
+        try:
+            regions, level, source = load_sidecar(sidecar)
+            check_source(image_path, source)
+        except SidecarMismatchError as e:
+            # No se dibujan: guardarlas otra vez las daría por buenas para esta imagen
+            print(f"ERROR: {e}")
+            messagebox.showwarning("Zonas de otra imagen", str(e))
+            return
+        except (OSError, ValueError) as e:
+            print(f"WARN: {e}")
+            return
+        self.pixel_level.set(level)
+        for x1, y1, x2, y2 in denormalize_boxes(regions, self.original_size):
+            coords = tuple(c * self.scale_factor for c in (x1, y1, x2, y2))
+            self.rectangles_coords.append(coords)
+            self.drawn_rectangles.append(self.canvas.create_rectangle(*coords, outline="red", width=2))
+
+    def current_regions(self):
+        """Marcas actuales en coordenadas normalizadas de la imagen original."""
+        boxes = [tuple(c / self.scale_factor for c in rect) for rect in self.rectangles_coords]
+        return normalize_boxes(boxes, self.original_size)
+
+    # --- Plantillas ---
+    def save_template(self):
+        """Guarda las marcas actuales como plantilla para aplicarla a otras imágenes."""
+        if not self.original_size or not self.rectangles_coords:
+            messagebox.showwarning("Advertencia", "No has marcado ninguna zona para guardar como plantilla.")
+            return
+        path = filedialog.asksaveasfilename(initialdir=self.folder_path, initialfile="plantilla" + CENSURA_SUFFIX,
+                                            defaultextension=".json", filetypes=[("Plantilla de censura", "*.json")])
+        if not path:
+            return
+        try:
+            save_regions(path, self.current_regions(), self.pixel_level.get())
+            messagebox.showinfo("Plantilla", f"Plantilla guardada:\n{os.path.basename(path)}")
+        except OSError as e:
+            messagebox.showerror("Error", f"No se pudo guardar la plantilla:\n{e}")
+
+    def apply_template_to_folder(self):
+        """Aplica una plantilla (o el sidecar de cualquier imagen) a todas las imágenes de una carpeta."""
+        template = filedialog.askopenfilename(initialdir=self.folder_path or None,
+                                              filetypes=[("Plantilla de censura", "*.json")])
+        if not template:
+            return
+        try:
+            regions, level = load_regions(template)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", str(e))
+            return
+        folder = filedialog.askdirectory(initialdir=self.folder_path or None, title="Carpeta a censurar")
+        if not folder:
+            return
+        images = censorable_images(folder)
+        if not images:
+            messagebox.showinfo("Info", "No hay imágenes para censurar en esa carpeta.")
+            return
+        bake = self.bake_copy.get()
+        result = "y se guardarán como _pixelado" if bake else "(las originales no se tocan)"
+        if not messagebox.askyesno("Aplicar plantilla", f"Se censurarán {len(images)} imágenes con {len(regions)} zonas "
+                                   f"(nivel {level}) {result}. ¿Continuar?"):
+            return
+        self.btn_apply_template.config(state=tk.DISABLED)
+        self.lbl_batch.config(text=f"Pixelando 0/{len(images)}...")
+
+        def run():
+            progress = lambda done, total, path, error: self.batch_queue.put(('progress', (done, total)))
+            try:
+                errors = apply_template(images, regions, level, progress=progress, bake=bake)
+            except Exception as e: # El pool no pudo arrancar
+                errors = [(folder, str(e))]
+            self.batch_queue.put(('done', (len(images), errors)))
+
+        threading.Thread(target=run, daemon=True).start()
+        self.master.after(100, self._poll_batch)
+
+    def _poll_batch(self):
+        try:
+            while True:
+                kind, value = self.batch_queue.get_nowait()
+                if kind == 'progress':
+                    self.lbl_batch.config(text=f"Pixelando {value[0]}/{value[1]}...")
+                    continue
+                total, errors = value
+                self.btn_apply_template.config(state=tk.NORMAL)
+                self.lbl_batch.config(text=f"{total - len(errors)}/{total} imágenes pixeladas.")
+                if errors:
+                    detail = "\n".join(f"{os.path.basename(p)}: {e}" for p, e in errors[:10])
+                    messagebox.showerror("Errores", f"{len(errors)} imágenes no se pudieron pixelar:\n{detail}")
+                if self.image_files:
+                    self.load_image() # La imagen actual puede tener ahora zonas guardadas
+                return
+        except queue.Empty:
+            self.master.after(100, self._poll_batch)
+
     # --- Pixelación ---
     def pixelate_and_save(self):
-        """Aplica la pixelación a las áreas seleccionadas y guarda la imagen."""
-        if not self.original_image:
+        """Guarda las zonas marcadas en el sidecar de la imagen (y, si se pide, el _pixelado)."""
+        if not self.original_size:
             messagebox.showwarning("Advertencia", "No hay ninguna imagen cargada.")
             return
+        current_path = self.image_files[self.current_image_index]
         if not self.rectangles_coords:
-            messagebox.showwarning("Advertencia", "No has marcado ninguna zona para pixelar.\n(Haz clic y arrastra sobre la imagen)")
+            sidecar = sidecar_path(current_path)
+            if os.path.exists(sidecar) and messagebox.askyesno("Quitar censura", "No hay zonas marcadas. ¿Quitar la censura guardada de esta imagen?"):
+                try:
+                    os.remove(sidecar)
+                except OSError as e:
+                    messagebox.showerror("Error", f"No se pudo quitar la censura:\n{e}")
+            elif not os.path.exists(sidecar):
+                messagebox.showwarning("Advertencia", "No has marcado ninguna zona para pixelar.\n(Haz clic y arrastra sobre la imagen)")
             return
 
         try:
-            # Crear una copia de la imagen original para modificarla
-            pixelated_img = self.original_image.copy()
-            # Convertir a RGBA si es necesario para asegurar canal alfa si se usa en el futuro
-            if pixelated_img.mode != 'RGBA':
-                 pixelated_img = pixelated_img.convert('RGBA')
-
             level = self.pixel_level.get() # Obtener nivel del slider
+            # La original no se toca: las zonas van al sidecar y la versión censurada
+            # se genera ya en la caché (la imagen completa solo se decodifica ahora)
+            new_path = apply_regions(current_path, self.current_regions(), level, bake=self.bake_copy.get())
 
-            for rect_coords_display in self.rectangles_coords:
-                # Convertir coordenadas del display a coordenadas de la imagen original
-                x1_disp, y1_disp, x2_disp, y2_disp = rect_coords_display
-                # Aplicar el inverso del factor de escala
-                x1_orig = int(x1_disp / self.scale_factor)
-                y1_orig = int(y1_disp / self.scale_factor)
-                x2_orig = int(x2_disp / self.scale_factor)
-                y2_orig = int(y2_disp / self.scale_factor)
-
-                # Asegurar que las coordenadas estén dentro de los límites de la imagen original
-                img_w, img_h = self.original_image.size
-                x1_orig = max(0, min(x1_orig, img_w - 1))
-                y1_orig = max(0, min(y1_orig, img_h - 1))
-                x2_orig = max(0, min(x2_orig, img_w)) # El límite superior es exclusivo en crop
-                y2_orig = max(0, min(y2_orig, img_h)) # El límite superior es exclusivo en crop
-
-                # Validar que el área tenga tamaño > 0
-                if x2_orig <= x1_orig or y2_orig <= y1_orig:
-                    continue
-
-                # 1. Recortar la región
-                region = pixelated_img.crop((x1_orig, y1_orig, x2_orig, y2_orig))
-
-                # 2. Calcular el tamaño del bloque de pixelación
-                region_w, region_h = region.size
-                # Tamaño de la imagen reducida (más pequeño = bloques más grandes)
-                # Aseguramos un mínimo de 1 pixel
-                pixel_w = max(1, region_w // level)
-                pixel_h = max(1, region_h // level)
-
-                # 3. Reducir la imagen
-                small_region = region.resize((pixel_w, pixel_h), Image.Resampling.BILINEAR)
-
-                # 4. Agrandar la imagen pequeña al tamaño original de la región usando NEAREST para crear los bloques
-                pixelated_region = small_region.resize(region.size, Image.Resampling.NEAREST)
-
-                # 5. Pegar la región pixelada de vuelta en la imagen
-                pixelated_img.paste(pixelated_region, (x1_orig, y1_orig), pixelated_region.split()[-1] if pixelated_region.mode == 'RGBA' else None) # Usar máscara alfa si existe
-
-            # Construir el nuevo nombre de archivo
-            current_path = self.image_files[self.current_image_index]
-            base, ext = os.path.splitext(current_path)
-            new_path = f"{base}_pixelado{ext}"
-
-            # Guardar la imagen pixelada
-            # Si la original era JPG, convertir a RGB antes de guardar para evitar problemas
-            save_img = pixelated_img
-            if ext.lower() in ['.jpg', '.jpeg'] and save_img.mode == 'RGBA':
-                 save_img = save_img.convert('RGB')
-
-            save_img.save(new_path)
-
-            messagebox.showinfo("Éxito", f"Imagen guardada como:\n{os.path.basename(new_path)}")
+            if self.bake_copy.get():
+                messagebox.showinfo("Éxito", f"Imagen guardada como:\n{os.path.basename(new_path)}")
+            else:
+                messagebox.showinfo("Éxito", f"Zonas guardadas en:\n{os.path.basename(sidecar_path(current_path))}")
             # Opcional: Limpiar las marcas después de guardar
             self.clear_rectangles()
             # Opcional: Actualizar la lista de imágenes por si el usuario quiere ver la recién guardada
@@ -324,6 +525,9 @@ class SuperCensuradorMagico:
 
 # --- Ejecución ---
 if __name__ == "__main__":
+    # Con argumentos: lote sin interfaz (python censurador_manual.py plantilla.json carpeta...)
+    if len(sys.argv) > 1:
+        sys.exit(main_batch())
     root = tk.Tk()
     app = SuperCensuradorMagico(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# fake_kemono.py
+# Local stand-in for kemono.su, so KemonoAPI / DownloadWorker can be exercised
+# and benchmarked offline. Serves synthetic (or recorded) creators with the
+# same 50-posts-per-page pagination as the real API, file payloads of a
+# configurable size, and can inject latency, 429s, 5xx, resets and slow reads.
+#
+#   python fake_kemono.py --posts 500 --file-size 200000 --rate-429 0.05
+#   python fake_kemono.py --fixture posts.json        (replays a recorded creator)
+#
+# Then point the downloader at it: DownloadWorker(..., api_base_url=server.api_base_url)
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+POSTS_PER_PAGE = 50 # Same page size as the real API (api_client.POSTS_PER_PAGE)
+DEFAULT_FILE_SIZE = 256 * 1024
+SLOW_READ_CHUNK = 4096
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping a connection (after a reset or a cancel) is expected here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FaultConfig:
+    """
+    What can go wrong on each request. Rates are probabilities in [0, 1].
+
+    Faults are decided from (seed, path, attempt number of that path), not
+    from a shared RNG, so every run sees exactly the same failures for the
+    same requests whatever the thread interleaving is.
+    """
+    __slots__ = ('latency', 'jitter', 'rate_429', 'rate_5xx', 'rate_reset', 'rate_slow',
+                 'slow_delay', 'retry_after', 'seed', 'api_faults')
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rate_429: float = 0.0,
+                 rate_5xx: float = 0.0, rate_reset: float = 0.0, rate_slow: float = 0.0,
+                 slow_delay: float = 0.01, retry_after: int = 1, seed: int = 1234,
+                 api_faults: bool = False):
+        self.latency = latency         # Seconds added before every response...
+        self.jitter = jitter           # ...plus up to this much, deterministic per request
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rate_reset = rate_reset   # Connection closed half-way through the body
+        self.rate_slow = rate_slow     # Body sent in small chunks, `slow_delay` apart
+        self.slow_delay = slow_delay
+        self.retry_after = retry_after # Retry-After header of the 429s
+        self.seed = seed
+        self.api_faults = api_faults   # Also inject errors on the post listing (not only files)
+
+    def decide(self, path: str, attempt: int):
+        """(fault or None, extra latency) for the `attempt`-th request of `path`."""
+        rng = random.Random(f"{self.seed}:{path}:{attempt}")
+        delay = self.latency + (rng.random() * self.jitter if self.jitter else 0.0)
+        roll = rng.random()
+        for fault, rate in (('429', self.rate_429), ('5xx', self.rate_5xx),
+                            ('reset', self.rate_reset), ('slow', self.rate_slow)):
+            if roll < rate:
+                return fault, delay
+            roll -= rate
+        return None, delay
+
+
+def synthetic_posts(count: int, files_per_post: int = 3, seed: int = 1234) -> List[Dict]:
+    """Posts in the raw API shape: series titles with part numbers, a file and some attachments."""
+    rng = random.Random(seed)
+    series = [f"Serie {n}" for n in range(max(1, count // 10))]
+    posts = []
+    for i in range(count):
+        post_id = str(900000 - i) # The API lists newest first
+        attachments = [{'name': f"{post_id}_{a}.jpg", 'path': f"/data/{post_id}/{a}.jpg"}
+                       for a in range(rng.randint(0, max(0, files_per_post - 1)))]
+        posts.append({
+            'id': post_id,
+            'user': 'fake',
+            'title': f"{rng.choice(series)} parte {rng.randint(1, 9)}",
+            'content': "<p>" + "Lorem ipsum " * 40 + "</p>",
+            'published': f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T00:00:00",
+            'file': {'name': f"{post_id}_main.png", 'path': f"/data/{post_id}/main.png"},
+            'attachments': attachments,
+        })
+    return posts
+
+
+def load_fixture(path) -> List[Dict]:
+    """
+    Posts recorded from the real API: a JSON list, or JSON lines such as the
+    _posts_raw.jsonl written by DownloadWorker(keep_raw_posts=True).
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class FakeKemonoServer:
+    """
+    Serves `posts` as creator `service/creator_id` on 127.0.0.1.
+
+        with FakeKemonoServer(posts, faults=FaultConfig(rate_5xx=0.1)) as server:
+            api = KemonoAPI(server.api_base_url)
+
+    File payloads are deterministic bytes derived from the path, so repeated
+    runs download identical content. `stats` counts the responses by outcome.
+    """
+
+    def __init__(self, posts: List[Dict], service: str = 'fanbox', creator_id: str = 'fake',
+                 file_size: int = DEFAULT_FILE_SIZE, faults: Optional[FaultConfig] = None,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.posts = posts
+        self.service = service
+        self.creator_id = creator_id
+        self.file_size = file_size
+        self.faults = faults or FaultConfig()
+        self._attempts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+        self._httpd = _QuietHTTPServer((host, port), self._make_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_base_url(self) -> str:
+        return f"{self.base_url}/api/v1/"
+
+    def start(self) -> 'FakeKemonoServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-kemono", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self.stats[outcome] = self.stats.get(outcome, 0) + 1
+
+    def _next_attempt(self, path: str) -> int:
+        with self._lock:
+            attempt = self._attempts.get(path, 0)
+            self._attempts[path] = attempt + 1
+            return attempt
+
+    def payload(self, path: str) -> bytes:
+        block = hashlib.sha256(path.encode('utf-8')).digest()
+        return (block * (self.file_size // len(block) + 1))[:self.file_size]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-alive, like the real CDN
+
+            def log_message(self, format, *args):
+                pass # One line per request would drown the benchmark output
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                is_api = parsed.path.startswith('/api/')
+                fault, delay = server.faults.decide(self.path, server._next_attempt(self.path))
+                if is_api and not server.faults.api_faults:
+                    fault = None
+                if delay:
+                    time.sleep(delay)
+                if fault == '429':
+                    server._count('429')
+                    return self._send(429, b'Too Many Requests', extra={'Retry-After': str(server.faults.retry_after)})
+                if fault == '5xx':
+                    server._count('5xx')
+                    return self._send(503, b'Service Unavailable')
+
+                if is_api:
+                    body = self._api_response(parsed)
+                    if body is None:
+                        server._count('404')
+                        return self._send(404, b'{"error": "Creator not found."}', 'application/json')
+                    content_type = 'application/json'
+                elif parsed.path.startswith('/data/'):
+                    body, content_type = server.payload(parsed.path), 'application/octet-stream'
+                else:
+                    server._count('404')
+                    return self._send(404, b'Not Found')
+
+                if fault == 'reset':
+                    server._count('reset')
+                    # Promise the whole body, send half of it and drop the connection
+                    self._send_headers(200, content_type, len(body))
+                    self.wfile.write(body[:len(body) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                server._count('slow' if fault == 'slow' else 'ok')
+                self._send_headers(200, content_type, len(body))
+                if fault == 'slow':
+                    for start in range(0, len(body), SLOW_READ_CHUNK):
+                        self.wfile.write(body[start:start + SLOW_READ_CHUNK])
+                        self.wfile.flush()
+                        time.sleep(server.faults.slow_delay)
+                else:
+                    self.wfile.write(body)
+
+            def _api_response(self, parsed) -> Optional[bytes]:
+                # /api/v1/<service>/user/<creator_id>?o=<offset>
+                parts = parsed.path.strip('/').split('/')
+                if parts[2:] != [server.service, 'user', server.creator_id]:
+                    return None
+                try:
+                    offset = int(parse_qs(parsed.query).get('o', ['0'])[0])
+                except ValueError:
+                    offset = 0
+                page = server.posts[offset:offset + POSTS_PER_PAGE]
+                return json.dumps(page, ensure_ascii=False).encode('utf-8')
+
+            def _send_headers(self, status, content_type, length, extra=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(length))
+                for key, value in (extra or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+
+            def _send(self, status, body, content_type='text/plain', extra=None):
+                self._send_headers(status, content_type, len(body), extra)
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de kemono.su")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--service', default='fanbox')
+    parser.add_argument('--creator', default='fake')
+    parser.add_argument('--posts', type=int, default=200, help="Posts sintéticos (ignorado con --fixture)")
+    parser.add_argument('--fixture', help="JSON o JSON lines con posts grabados de la API")
+    parser.add_argument('--file-size', type=int, default=DEFAULT_FILE_SIZE, help="Bytes por archivo")
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--rate-5xx', type=float, default=0.0)
+    parser.add_argument('--rate-reset', type=float, default=0.0)
+    parser.add_argument('--rate-slow', type=float, default=0.0)
+    parser.add_argument('--api-faults', action='store_true', help="Inyecta errores también en el listado de posts")
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args(argv)
+
+    posts = load_fixture(args.fixture) if args.fixture else synthetic_posts(args.posts, seed=args.seed)
+    faults = FaultConfig(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                         rate_5xx=args.rate_5xx, rate_reset=args.rate_reset, rate_slow=args.rate_slow,
+                         seed=args.seed, api_faults=args.api_faults)
+    server = FakeKemonoServer(posts, args.service, args.creator, args.file_size, faults, port=args.port)
+    print(f"INFO: {len(posts)} posts en {server.api_base_url}{args.service}/user/{args.creator} (Ctrl+C para salir)")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+        print(f"INFO: Respuestas: {server.stats}")
+
+
+if __name__ == '__main__':
+    main()
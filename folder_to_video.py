@@ -1,11 +1,159 @@
 import os
-import re
+import queue
 import threading
+from collections import OrderedDict
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk
 # Importamos afx junto con los demás módulos de moviepy.editor
 from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips, VideoFileClip, afx
+from proglog import ProgressBarLogger # Viene con moviepy
+from censura import censored_paths
+from video_render import (extract_poster, find_ffmpeg, is_video, poster_cache_path, render_slideshow,
+                          select_numbered_images, RenderCancelled, RenderError, RenderMonitor)
+
+PROGRESS_POLL_MS = 100
+MOVIEPY_FPS = 24
+PREVIEW_POLL_MS = 30
+PREVIEW_CACHE_SIZE = 48 # Thumbnails kept in memory (LRU)
+PREVIEW_PREFETCH = 2 # Rows decoded ahead on each side of the selection
+PREVIEW_DEFAULT_SIZE = (480, 360) # Until the preview label has been laid out
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "calculando..."
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class MoviepyProgressLogger(ProgressBarLogger):
+    """Passes moviepy's frame bar to a RenderMonitor, and stops write_videofile when it is cancelled."""
+
+    def __init__(self, monitor):
+        super().__init__()
+        self.monitor = monitor
+        self._started = False
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        # Raising here unwinds write_videofile, which closes its ffmpeg writer
+        self.monitor.check()
+        if bar == 't' and attr == 'index':
+            total = self.bars[bar].get('total') or 0
+            if not self._started and total:
+                self.monitor.start_encoding([('moviepy', total / MOVIEPY_FPS)])
+                self._started = True
+            self.monitor.encoded('moviepy', (value + 1) / MOVIEPY_FPS, value + 1)
+
+def load_preview(path, size):
+    """Thumbnail of an image or of a video's poster frame, fitting in `size`."""
+    if is_video(path):
+        path = _video_poster(path)
+    with Image.open(path) as img:
+        img.draft('RGB', size) # JPEG: decode at 1/2, 1/4 or 1/8 scale instead of full size
+        img.thumbnail(size)
+        return img.convert('RGB') if img.mode not in ('RGB', 'RGBA') else img.copy()
+
+
+def _video_poster(video):
+    if find_ffmpeg():
+        return extract_poster(video)
+    # Sin ffmpeg propio: moviepy, guardando el fotograma en la misma caché
+    poster = poster_cache_path(video)
+    if not os.path.exists(poster):
+        clip = VideoFileClip(video)
+        try:
+            frame = clip.get_frame(min(1.0, clip.duration / 2.0))
+        finally:
+            clip.close()
+        os.makedirs(os.path.dirname(poster), exist_ok=True)
+        Image.fromarray(frame).save(poster, 'JPEG', quality=90)
+    return poster
+
+
+class PreviewLoader:
+    """
+    Decodes preview thumbnails on one worker thread, so moving through the
+    list never blocks Tk. Thumbnails are kept in a bounded LRU keyed by
+    (path, mtime, size); after the selected row, its neighbours are decoded
+    too, so stepping with the arrow keys usually hits the cache.
+
+    Results are picked up with poll() from the Tk thread (PhotoImage must be
+    created there).
+    """
+
+    def __init__(self, cache_size=PREVIEW_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict() # (path, mtime_ns, size) -> PIL thumbnail
+        self._todo = [] # Paths still to decode for the current request, selection first
+        self._size = None
+        self._wanted = None # Path whose thumbnail is waiting to be shown
+        self._results = queue.Queue() # (path, thumbnail or None, error or None)
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="preview", daemon=True).start()
+
+    def _key(self, path, size):
+        try:
+            return (path, os.stat(path).st_mtime_ns, size)
+        except OSError:
+            return None
+
+    def _cached(self, key):
+        with self._cond:
+            thumb = self._cache.get(key)
+            if thumb is not None:
+                self._cache.move_to_end(key)
+            return thumb
+
+    def request(self, path, size, neighbours=()):
+        """Thumbnail of `path` if it is cached; otherwise None, and it arrives through poll()."""
+        thumb = self._cached(self._key(path, size))
+        with self._cond:
+            # A new selection replaces whatever was still pending from the previous one
+            self._todo = ([] if thumb is not None else [path]) + list(neighbours)
+            self._size = size
+            self._wanted = None if thumb is not None else path
+            self._cond.notify()
+        return thumb
+
+    @property
+    def waiting(self):
+        return self._wanted is not None
+
+    def poll(self):
+        """Results for the selected path: (path, thumbnail, error), or None."""
+        try:
+            while True:
+                path, thumb, error = self._results.get_nowait()
+                if path == self._wanted:
+                    self._wanted = None
+                    return path, thumb, error
+        except queue.Empty:
+            return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._todo:
+                    self._cond.wait()
+                path, size = self._todo.pop(0), self._size
+            key = self._key(path, size)
+            if key is None:
+                self._results.put((path, None, f"No existe: {path}"))
+                continue
+            thumb = self._cached(key)
+            if thumb is None:
+                try:
+                    thumb = load_preview(path, size)
+                except Exception as e:
+                    self._results.put((path, None, str(e)))
+                    continue
+                with self._cond:
+                    self._cache[key] = thumb
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+            self._results.put((path, thumb, None))
+
 
 class ImageVideoGUI(tk.Tk):
     def __init__(self):
@@ -20,8 +168,13 @@ class ImageVideoGUI(tk.Tk):
         self.intro_file = None
         self.outro_file = None
         self.preview_label = None
+        self.progress_queue = queue.Queue() # Render thread -> Tk: ('progress', RenderProgress) / ('done'|'error'|'cancelled', text)
+        self.render_monitor = None
+        self.preview_loader = PreviewLoader()
+        self._preview_polling = False
 
         self._build_widgets()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
 
     def _build_widgets(self):
         # Paned window to split tree and preview
@@ -39,7 +192,23 @@ class ImageVideoGUI(tk.Tk):
         tk.Button(btn_frame, text="Seleccionar Carpeta", command=self.select_folder).pack(side=tk.LEFT, padx=5)
         tk.Button(btn_frame, text="Seleccionar Música", command=self.select_audio).pack(side=tk.LEFT, padx=5)
         tk.Button(btn_frame, text="Intro/Outro", command=self.select_intro_outro).pack(side=tk.LEFT, padx=5)
-        tk.Button(btn_frame, text="Exportar Video", command=self.export_video).pack(side=tk.LEFT, padx=5)
+        self.btn_export = tk.Button(btn_frame, text="Exportar Video", command=self.export_video)
+        self.btn_export.pack(side=tk.LEFT, padx=5)
+        self.btn_cancel = tk.Button(btn_frame, text="Cancelar", command=self.cancel_export, state=tk.DISABLED)
+        self.btn_cancel.pack(side=tk.LEFT, padx=5)
+        # Censored: originals + their censor sidecars (censura.py, else old _pixelado), rendered
+        # at export time; unticked, the originals as they are. Only read when the export starts.
+        self.use_censored = tk.BooleanVar(value=True)
+        tk.Checkbutton(btn_frame, text="Versión censurada", variable=self.use_censored, fg="white", bg="#2e2e2e",
+                       selectcolor="#2e2e2e", activebackground="#2e2e2e").pack(side=tk.LEFT, padx=5)
+
+        # Export progress
+        status_frame = tk.Frame(left_frame, bg="#2e2e2e")
+        status_frame.pack(fill=tk.X, padx=10)
+        self.progress_bar = ttk.Progressbar(status_frame, maximum=1.0)
+        self.progress_bar.pack(fill=tk.X)
+        self.status_label = tk.Label(status_frame, text="", fg="white", bg="#2e2e2e", anchor="w")
+        self.status_label.pack(fill=tk.X)
 
         # Treeview for images and durations
         cols = ("imagen", "duración(s)")
@@ -63,18 +232,9 @@ class ImageVideoGUI(tk.Tk):
         folder = filedialog.askdirectory(initialdir=r"E:\El_Zorro\downloads")
         if not folder:
             return
-        files = os.listdir(folder)
-        # Find numbered images, prefer censored
-        pattern = re.compile(r"^(\d+)(?:_pixelado)?\.(png|jpg|jpeg|bmp|gif)$", re.IGNORECASE)
-        matches = {}
-        for f in files:
-            m = pattern.match(f)
-            if m:
-                num = int(m.group(1))
-                is_censored = '_pixelado' in f.lower()
-                if num not in matches or is_censored:
-                    matches[num] = f
-        ordered = [os.path.join(folder, matches[num]) for num in sorted(matches)] # Join path here
+        # Find numbered images (same selection as batch_video.py): always the originals,
+        # "Versión censurada" swaps them on export, so toggling it never leaves this list stale
+        ordered = select_numbered_images(folder, prefer_pixelated=False)
         # make sure intro/outro files are not included in image_list if they match pattern
         # This is a potential bug if intro/outro are in the selected folder AND match the pattern.
         # A more robust way would be to explicitly filter them out or only select based on the list derived from pattern matches.
@@ -136,66 +296,53 @@ class ImageVideoGUI(tk.Tk):
 
     def _preview_media(self, event):
         sel = self.tree.selection()
-        if not sel:
+        rows = self.tree.get_children()
+        if not sel or sel[0] not in rows:
             # Clear preview if nothing is selected
-            self.preview_label.config(image='')
-            self.preview_label.image = None
+            self._set_preview(None)
             return
-        rowid = sel[0]
-        # Find the actual image path corresponding to the treeview row
-        item_values = self.tree.item(rowid, 'values')
-        if not item_values:
-            return # Should not happen if something is selected
-        fname_in_tree = item_values[0]
-        path = next((img for img in self.image_list if os.path.basename(img) == fname_in_tree), None)
-
-        if not path:
-            # Clear preview if path not found (e.g., after deleting an item, not implemented here)
-            self.preview_label.config(image='')
-            self.preview_label.image = None
+        # The tree rows follow self.image_list, so the row index is the image index
+        index = rows.index(sel[0])
+        if index >= len(self.image_list):
+            self._set_preview(None)
             return
-
-        ext = os.path.splitext(path)[1].lower()
-        # Clear previous image to prevent flickering or mixing previews
-        self.preview_label.config(image='')
-        self.preview_label.image = None
-
-        try:
-            if ext in ['.png', '.jpg', '.jpeg', '.bmp', '.gif']:
-                img = Image.open(path)
-                # Resize image to fit within preview_label dimensions while maintaining aspect ratio
-                img.thumbnail((self.preview_label.winfo_width(), self.preview_label.winfo_height()))
-                photo = ImageTk.PhotoImage(img)
-                self.preview_label.config(image=photo)
-                self.preview_label.image = photo # Keep a reference!
-                img.close() # Close the PIL image file
-            elif ext in ['.mp4', '.mov']:
-                # Note: Previewing video frames like this is basic and might not be smooth
-                # Real video preview requires more complex handling (e.g., using OpenCV or a dedicated video player widget)
-                clip = VideoFileClip(path)
-                if clip.duration > 0: # Ensure clip has duration before getting a frame
-                     frame_time = min(1.0, clip.duration / 2.0) # Get a frame from the middle or 1s mark
-                     frame = clip.get_frame(frame_time)
-                     img = Image.fromarray(frame)
-                     # Resize image
-                     img.thumbnail((self.preview_label.winfo_width(), self.preview_label.winfo_height()))
-                     photo = ImageTk.PhotoImage(img)
-                     self.preview_label.config(image=photo)
-                     self.preview_label.image = photo # Keep a reference!
-                     img.close() # Close the PIL image
-                clip.close() # Close the moviepy clip to release resources
+        path = self.image_list[index]
+        width, height = self.preview_label.winfo_width(), self.preview_label.winfo_height()
+        size = (width, height) if width > 1 and height > 1 else PREVIEW_DEFAULT_SIZE
+        neighbours = []
+        for step in range(1, PREVIEW_PREFETCH + 1):
+            neighbours += [self.image_list[i] for i in (index + step, index - step) if 0 <= i < len(self.image_list)]
+        thumb = self.preview_loader.request(path, size, neighbours)
+        if thumb is not None:
+            self._set_preview(thumb)
+        elif not self._preview_polling:
+            self._preview_polling = True
+            self.after(PREVIEW_POLL_MS, self._poll_preview)
+
+    def _poll_preview(self):
+        result = self.preview_loader.poll()
+        if result is None:
+            if self.preview_loader.waiting:
+                self.after(PREVIEW_POLL_MS, self._poll_preview)
             else:
-                 # Clear preview if the file type is not supported for preview
-                 self.preview_label.config(image='')
-                 self.preview_label.image = None
-
-
-        except Exception as e:
-            # Clear preview on error
+                self._preview_polling = False
+            return
+        self._preview_polling = False
+        path, thumb, error = result
+        if error:
+            self._set_preview(None)
+            messagebox.showerror("Error Preview", error)
+        else:
+            self._set_preview(thumb)
+
+    def _set_preview(self, thumb):
+        if thumb is None:
             self.preview_label.config(image='')
             self.preview_label.image = None
-            # Use after to show messagebox on main thread
-            self.after(0, lambda: messagebox.showerror("Error Preview", str(e)))
+            return
+        photo = ImageTk.PhotoImage(thumb)
+        self.preview_label.config(image=photo)
+        self.preview_label.image = photo # Keep a reference!
 
 
     def select_audio(self):
@@ -249,19 +396,103 @@ class ImageVideoGUI(tk.Tk):
         if not out_file:
             return
 
-        # Disable export button while processing (basic example)
-        # self.btn_export.config(state=tk.DISABLED) # You'd need to store the button reference
-
-        # Use a progress bar (more advanced, requires updating from thread)
-        # For now, just indicate it's running (e.g., label)
-        # self.status_label.config(text="Exportando...") # You'd need a status label
+        self.btn_export.config(state=tk.DISABLED)
+        self.btn_cancel.config(state=tk.NORMAL)
+        self.progress_bar['value'] = 0
+        self.status_label.config(text="Exportando...")
+        # The checkbox, list and durations as they are now: Tk state is only read on the Tk thread
+        censored = self.use_censored.get()
+        images = list(self.image_list)
+        durations = [self.durations.get(img, 10) for img in images]
+        # The monitor's callback runs on the render threads: it only queues, _poll_progress updates the widgets
+        self.render_monitor = RenderMonitor(lambda p: self.progress_queue.put(('progress', p)))
 
         # Launch the video creation in a separate thread
-        threading.Thread(target=self._make_video, args=(out_file,), daemon=True).start() # daemon=True lets app exit even if thread is running
-
-    def _make_video(self, out_file):
+        threading.Thread(target=self._make_video, args=(out_file, self.render_monitor, images, durations, censored), daemon=True).start() # daemon=True lets app exit even if thread is running
+        self.after(PROGRESS_POLL_MS, self._poll_progress)
+
+    def cancel_export(self):
+        if self.render_monitor:
+            self.btn_cancel.config(state=tk.DISABLED)
+            self.status_label.config(text="Cancelando...")
+            self.render_monitor.cancel()
+
+    def _on_close(self):
+        # Closing the window kills the encoder too, instead of leaving ffmpeg running
+        if self.render_monitor:
+            self.render_monitor.cancel()
+        self.destroy()
+
+    def _poll_progress(self):
+        latest, final = None, None
+        try:
+            while True:
+                kind, value = self.progress_queue.get_nowait()
+                if kind == 'progress':
+                    latest = value # Only the newest update is drawn
+                else:
+                    final = (kind, value)
+        except queue.Empty:
+            pass
+        if latest:
+            self._show_progress(latest)
+        if not final:
+            self.after(PROGRESS_POLL_MS, self._poll_progress)
+            return
+        self.render_monitor = None
+        self.btn_export.config(state=tk.NORMAL)
+        self.btn_cancel.config(state=tk.DISABLED)
+        kind, value = final
+        if kind == 'done':
+            self.progress_bar['value'] = 1.0
+            self.status_label.config(text="Listo.")
+            messagebox.showinfo("Listo", f"Video exportado en {value}")
+        elif kind == 'cancelled':
+            self.progress_bar['value'] = 0
+            self.status_label.config(text="Exportación cancelada.")
+        else:
+            self.status_label.config(text="Error en la exportación.")
+            messagebox.showerror("Error de Exportación", value)
+
+    def _show_progress(self, p):
+        self.progress_bar['value'] = p.fraction
+        if p.stage == 'preparar':
+            text = f"Preparando imágenes: {int(p.done)}/{int(p.total)}"
+        elif p.stage == 'unir':
+            text = "Uniendo segmentos..."
+        else:
+            text = f"Codificando: {p.done:.0f}/{p.total:.0f}s de video, {p.frames} fotogramas ({p.fps:.0f} fps)"
+            if p.segments_total > 1:
+                text += f", segmentos {p.segments_done}/{p.segments_total}"
+            text += f" - quedan {format_eta(p.eta)}"
+        self.status_label.config(text=text)
+
+    def _make_video(self, out_file, monitor, images, durations, censored=True):
+        try:
+            # Censored variants are rendered (or taken from their cache) here, off the Tk thread
+            if censored:
+                images = censored_paths(images)
+        except (OSError, ValueError) as e: # ValueError: broken censor sidecar
+            self.progress_queue.put(('error', f"No se pudo censurar: {e}"))
+            return
+        # ffmpeg directo: un fotograma por imagen en vez de 24 por segundo. moviepy queda de respaldo.
+        if not find_ffmpeg():
+            print("WARN: ffmpeg no encontrado, se exporta con moviepy (mucho más lento).")
+            return self._make_video_moviepy(out_file, monitor, images, durations)
+        try:
+            render_slideshow(images, durations, out_file, intro=self.intro_file,
+                             outro=self.outro_file, audio=self.audio_file, monitor=monitor)
+            self.progress_queue.put(('done', out_file))
+        except RenderCancelled:
+            self.progress_queue.put(('cancelled', None))
+        except (RenderError, OSError) as e:
+            self.progress_queue.put(('error', str(e)))
+
+    def _make_video_moviepy(self, out_file, monitor, images, durations):
         clips = []
         video = None # Initialize video to None
+        temp_audio = os.path.splitext(out_file)[0] + "_audio_tmp.mp3"
+        finished = False
 
         try:
             # Intro
@@ -273,8 +504,7 @@ class ImageVideoGUI(tk.Tk):
                     clips.append(ImageClip(self.intro_file).set_duration(3))
                 # else: unsupported type is ignored
             # Images
-            for img in self.image_list:
-                dur = self.durations.get(img, 10)  # default 10s
+            for img, dur in zip(images, durations):
                 clips.append(ImageClip(img).set_duration(dur))
             # Outro
             if self.outro_file:
@@ -287,7 +517,7 @@ class ImageVideoGUI(tk.Tk):
 
             if not clips:
                  # This check is also done before threading, but good defensive programming
-                 self.after(0, lambda: messagebox.showerror("Error", "No hay contenido para crear el video."))
+                 self.progress_queue.put(('error', "No hay contenido para crear el video."))
                  return
 
             # Concatenate clips
@@ -303,16 +533,16 @@ class ImageVideoGUI(tk.Tk):
                 audio.close() # Close original audio clip
                 looped_audio.close() # Close the looped audio clip
 
-            # Write video file
-            # Adding a progress callback is possible with write_videofile but requires more setup
-            video.write_videofile(out_file, fps=24, codec='libx264')
-
-            # Show success message on the main thread
-            self.after(0, lambda: messagebox.showinfo("Listo", f"Video exportado en {out_file}"))
+            # Write video file (the logger reports the frames and raises RenderCancelled on cancel)
+            video.write_videofile(out_file, fps=MOVIEPY_FPS, codec='libx264', temp_audiofile=temp_audio,
+                                  logger=MoviepyProgressLogger(monitor))
+            finished = True
+            self.progress_queue.put(('done', out_file))
 
+        except RenderCancelled:
+            self.progress_queue.put(('cancelled', None))
         except Exception as e:
-             # Show error message on the main thread
-             self.after(0, lambda: messagebox.showerror("Error de Exportación", str(e)))
+             self.progress_queue.put(('error', str(e)))
         finally:
              # Ensure resources are released whether successful or not
              if video:
@@ -334,9 +564,14 @@ class ImageVideoGUI(tk.Tk):
                  except Exception as e:
                     print(f"Error closing clip: {e}")
 
-             # Re-enable export button and clear status label (if implemented)
-             # self.after(0, lambda: self.btn_export.config(state=tk.NORMAL))
-             # self.after(0, lambda: self.status_label.config(text=""))
+             # Partial output of a cancelled/failed export (moviepy only removes its temp audio on success)
+             if not finished:
+                 for leftover in (temp_audio, out_file):
+                     if os.path.exists(leftover):
+                         try:
+                             os.remove(leftover)
+                         except OSError as e:
+                             print(f"WARN: No se pudo borrar '{leftover}': {e}")
 
 
 if __name__ == '__main__':
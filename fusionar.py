@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
+import argparse
+import json
 import os
 import re
 import shutil
 import sys
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from colorama import init, Fore, Style
 
+from censura import is_sidecar, orphan_sidecars, sidecar_path
+from group_manifest import GroupManifest, MANIFEST_FILENAME, MANIFEST_JSON_FILENAME
+from scanner import scan_tree
+
 # Inicializar colores en Windows
 init(autoreset=True)
 
@@ -15,6 +24,9 @@ STOPWORDS = {'page', 'libro', 'commision', 'commission', 'reward'}
 # Patrón para detectar ficheros manifest
 MANIFEST_RE = re.compile(r'.*manifest.*\.txt$', re.IGNORECASE)
 
+def es_manifest(item):
+    return bool(MANIFEST_RE.match(item)) or item == MANIFEST_JSON_FILENAME
+
 def normalizar_nombre(nombre):
     s = nombre.replace('_', ' ')
     s = re.sub(r'[^A-Za-z0-9 ]+', '', s)
@@ -22,7 +34,9 @@ def normalizar_nombre(nombre):
     return [t for t in tokens if not t.isdigit() and t not in STOPWORDS]
 
 def encontrar_comunes(n1, n2):
-    p1, p2 = normalizar_nombre(n1), normalizar_nombre(n2)
+    return comunes_tokens(normalizar_nombre(n1), normalizar_nombre(n2))
+
+def comunes_tokens(p1, p2):
     comunes = set()
     for i in range(len(p1)):
         for j in range(len(p2)):
@@ -33,26 +47,77 @@ def encontrar_comunes(n1, n2):
                     comunes.add(' '.join(p1[i:i+k]))
     return list(comunes)
 
+def claves_indice(tokens):
+    # Dos nombres coinciden si comparten un trigrama (en cualquier posición)
+    # o un bigrama en la misma posición: esas son justo las claves del índice.
+    claves = {tuple(tokens[i:i+3]) for i in range(len(tokens) - 2)}
+    claves.update((i, tokens[i], tokens[i+1]) for i in range(len(tokens) - 1))
+    return claves
+
+def construir_indice(tokens_por_carpeta):
+    indice = defaultdict(list)
+    for idx, tokens in enumerate(tokens_por_carpeta):
+        for clave in claves_indice(tokens):
+            indice[clave].append(idx)
+    return indice
+
+def listar_carpetas(raiz):
+    return scan_tree(raiz, keep_names=False).subdirectories()
+
+class UnionFind:
+    def __init__(self, n):
+        self.padre = list(range(n))
+
+    def buscar(self, x):
+        while self.padre[x] != x:
+            self.padre[x] = self.padre[self.padre[x]]
+            x = self.padre[x]
+        return x
+
+    def unir(self, a, b):
+        ra, rb = self.buscar(a), self.buscar(b)
+        if ra != rb:
+            # La raíz es siempre el índice menor: el resultado no depende del orden
+            self.padre[max(ra, rb)] = min(ra, rb)
+
+def nombre_cluster(aristas, tokens):
+    # Frase común compartida por más carpetas del cluster; empates: más tokens, luego orden alfabético
+    carpetas_por_frase = defaultdict(set)
+    for a, b in aristas:
+        for frase in comunes_tokens(tokens[a], tokens[b]):
+            carpetas_por_frase[frase].update((a, b))
+    return min(carpetas_por_frase, key=lambda f: (-len(carpetas_por_frase[f]), -len(f.split()), f))
+
 def agrupar_carpetas_unicas(raiz):
-    carpetas = []
-    for root, dirs, _ in os.walk(raiz):
-        for d in dirs:
-            carpetas.append(os.path.join(root, d))
-
-    grupos, usadas = [], set()
-    for idx, ci in enumerate(carpetas):
-        if ci in usadas: continue
-        ni = os.path.basename(ci)
-        grupo, todas = [ci], []
-        for cj in carpetas[idx+1:]:
-            if cj in usadas: continue
-            com = encontrar_comunes(ni, os.path.basename(cj))
-            if com:
-                grupo.append(cj)
-                todas.extend(com)
-        if len(grupo) > 1:
-            usadas.update(grupo)
-            grupos.append((max(set(todas), key=len), grupo))
+    return agrupar_rutas(listar_carpetas(raiz))
+
+def agrupar_rutas(carpetas):
+    carpetas = sorted(carpetas)
+    tokens = [normalizar_nombre(os.path.basename(c)) for c in carpetas]
+    indice = construir_indice(tokens)
+
+    # Todas las carpetas que comparten una clave cumplen la regla entre sí,
+    # así que basta con unir cada lista del índice (cierre transitivo incluido).
+    uf = UnionFind(len(carpetas))
+    aristas = set()
+    for miembros in indice.values():
+        for j in miembros[1:]:
+            uf.unir(miembros[0], j)
+            aristas.add((miembros[0], j))
+
+    aristas_por_cluster = defaultdict(list)
+    for a, b in sorted(aristas):
+        aristas_por_cluster[uf.buscar(a)].append((a, b))
+    clusters = defaultdict(list)
+    for idx in range(len(carpetas)):
+        clusters[uf.buscar(idx)].append(idx)
+
+    grupos = []
+    for raiz_cluster, miembros in clusters.items():
+        if len(miembros) > 1:
+            nombre = nombre_cluster(aristas_por_cluster[raiz_cluster], tokens)
+            grupos.append((nombre, [carpetas[j] for j in miembros]))
+    grupos.sort(key=lambda g: (g[0], g[1]))
     return grupos
 
 def mostrar_grupos(grupos):
@@ -62,96 +127,317 @@ def mostrar_grupos(grupos):
         for r in rutas:
             print("  " + Fore.YELLOW + r + Style.RESET_ALL)
 
-def fusionar_y_resumir(grupos):
-    confirm = input(Fore.CYAN + "\n¿Procedemos? (sí/no): " + Style.RESET_ALL).strip().lower()
-    if confirm != 'sí':
-        print(Fore.RED + "⚠️ Operación cancelada." + Style.RESET_ALL)
-        return
+def nombre_libre(nombre, ocupados):
+    if nombre not in ocupados: return nombre
+    base, ext = os.path.splitext(nombre)
+    n = 1
+    while f"{base}_{n}{ext}" in ocupados: n += 1
+    return f"{base}_{n}{ext}"
 
-    resumen = []
+def crear_plan(grupos, raiz=None):
+    plan = {'raiz': raiz, 'creado': time.strftime('%Y-%m-%d %H:%M:%S'), 'grupos': []}
     for nombre, rutas in grupos:
         padre = os.path.dirname(rutas[0])
-        nueva = os.path.join(padre, nombre.replace(' ', '_'))
-        os.makedirs(nueva, exist_ok=True)
+        plan['grupos'].append({
+            'nombre': nombre,
+            'destino': os.path.join(padre, nombre.replace(' ', '_')),
+            'carpetas': list(rutas),
+        })
+    return plan
 
-        moved_count = 0
-        manifest_entries = []
-        seen_entries = set()
+def guardar_plan(plan, ruta):
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, ensure_ascii=False, indent=2)
 
-        # Recolectar y mover
-        for carpeta in rutas:
-            for item in os.listdir(carpeta):
-                src = os.path.join(carpeta, item)
-                dst = os.path.join(nueva, item)
+def cargar_plan(ruta):
+    with open(ruta, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
-                # MANIFEST: recolectar contenido y luego eliminar
-                if MANIFEST_RE.match(item):
-                    try:
-                        with open(src, 'r', encoding='utf-8') as mf:
-                            for line in mf:
-                                line = line.rstrip('\n')
-                                # saltar encabezados o separadores
-                                if line.startswith('#') or set(line) <= {'-', ' '}:
-                                    continue
-                                if line and line not in seen_entries:
-                                    manifest_entries.append(line)
-                                    seen_entries.add(line)
-                    except Exception:
-                        pass
+class Journal:
+    # Diario de deshacer: una línea JSON por operación, escrita en cuanto se completa
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.lock = threading.Lock()
+        self.f = open(ruta, 'a', encoding='utf-8')
+
+    def registrar(self, **op):
+        with self.lock:
+            self.f.write(json.dumps(op, ensure_ascii=False) + '\n')
+            self.f.flush()
+
+    def cerrar(self):
+        self.f.close()
+
+def leer_manifest(ruta):
+    entradas = []
+    with open(ruta, 'r', encoding='utf-8') as mf:
+        for line in mf:
+            line = line.rstrip('\n')
+            # saltar encabezados o separadores
+            if not line or line.startswith('#') or set(line) <= {'-', ' '}:
+                continue
+            entradas.append(line)
+    return entradas
+
+def misma_carpeta(a, b):
+    # Con samefile, "Foo" y "foo" en Windows (o un enlace) también son la misma carpeta
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return os.path.normcase(os.path.abspath(a)) == os.path.normcase(os.path.abspath(b))
+
+def mover(src, dst, mismo_disco):
+    # Mismo disco: un rename atómico. Si no, copia + borrado.
+    size = os.path.getsize(src) if os.path.isfile(src) else 0
+    if mismo_disco:
+        os.rename(src, dst)
+    else:
+        shutil.move(src, dst)
+    return size
+
+def ejecutar_plan(plan, journal_path, workers=8):
+    journal = Journal(journal_path)
+    resumen = {'grupos': 0, 'archivos': 0, 'bytes': 0, 'errores': [], 'journal': journal_path}
+    try:
+        for grupo in plan['grupos']:
+            nueva, rutas = grupo['destino'], grupo['carpetas']
+            if not os.path.isdir(nueva):
+                os.makedirs(nueva)
+                journal.registrar(op='mkdir', path=nueva)
+            dev_destino = os.stat(nueva).st_dev
+            ocupados = set(os.listdir(nueva))
+            # La carpeta destino puede ser una de las fusionadas: sus archivos no se mueven
+            origenes = [c for c in rutas if not misma_carpeta(c, nueva)]
+
+            manifest_entries, seen_entries = [], set()
+            # El manifest del destino es la base: sus líneas y entradas se conservan
+            mf_destino = os.path.join(nueva, MANIFEST_FILENAME)
+            if os.path.isfile(mf_destino):
+                try:
+                    for line in leer_manifest(mf_destino):
+                        if line not in seen_entries:
+                            manifest_entries.append(line)
+                            seen_entries.add(line)
+                except (OSError, UnicodeDecodeError) as e:
+                    resumen['errores'].append(f"{mf_destino}: {e}")
+            json_destino = None
+            if MANIFEST_JSON_FILENAME in ocupados or MANIFEST_FILENAME in ocupados:
+                json_destino = GroupManifest.load(nueva) # Antes de reescribir el .txt (sin .json se siembra de él)
+            movimientos = []
+            sidecars = [] # (imagen de origen, sidecar, destino, mismo disco): se mueven si su imagen se movió
+            renombres_json = [] # (carpeta, renombres) de las carpetas con manifest del descargador
+            for carpeta in origenes:
+                if not os.path.isdir(carpeta):
+                    resumen['errores'].append(f"{carpeta}: ya no existe")
                     continue
+                mismo_disco = os.stat(carpeta).st_dev == dev_destino
+                items = sorted(os.listdir(carpeta))
+                # Un sidecar de censura sin su imagen censuraría a la que herede su nombre
+                for item in orphan_sidecars(items):
+                    path = os.path.join(carpeta, item)
+                    try:
+                        contenido = open(path, 'r', encoding='utf-8').read()
+                        os.remove(path)
+                        journal.registrar(op='remove', path=path, contenido=contenido)
+                        items.remove(item)
+                    except (OSError, UnicodeDecodeError) as e:
+                        resumen['errores'].append(f"{path}: {e}")
+                renombres = {}
+                for item in items:
+                    if es_manifest(item) or is_sidecar(item): continue # Los sidecars siguen a su imagen, tras moverla
+                    destino = nombre_libre(item, ocupados)
+                    ocupados.add(destino)
+                    renombres[item] = destino
+                    movimientos.append((os.path.join(carpeta, item), os.path.join(nueva, destino), mismo_disco))
+                for item, destino in list(renombres.items()):
+                    if sidecar_path(item) not in items: continue
+                    if sidecar_path(destino) in ocupados:
+                        resumen['errores'].append(f"{os.path.join(carpeta, sidecar_path(item))}: ya existe {sidecar_path(destino)} en el destino, no se mueve")
+                        continue
+                    ocupados.add(sidecar_path(destino))
+                    renombres[sidecar_path(item)] = sidecar_path(destino)
+                    sidecars.append((os.path.join(carpeta, item), os.path.join(carpeta, sidecar_path(item)),
+                                     os.path.join(nueva, sidecar_path(destino)), mismo_disco))
+                if MANIFEST_JSON_FILENAME in items or MANIFEST_FILENAME in items:
+                    renombres_json.append((carpeta, renombres))
+                # MANIFEST: recolectar contenido con los nombres nuevos; se elimina al final
+                for item in items:
+                    if not MANIFEST_RE.match(item): continue # El .json se fusiona tras mover
+                    src = os.path.join(carpeta, item)
+                    try:
+                        for line in leer_manifest(src):
+                            nombre, sep, resto = line.partition(' : ')
+                            if sep and nombre in renombres:
+                                line = f"{renombres[nombre]} : {resto}"
+                            if line not in seen_entries:
+                                manifest_entries.append(line)
+                                seen_entries.add(line)
+                    except (OSError, UnicodeDecodeError) as e:
+                        resumen['errores'].append(f"{src}: {e}")
 
-                # Mover ficheros normales
-                if not os.path.exists(dst):
+            # Mover ficheros normales en paralelo
+            movidos = 0
+            movidos_ok = set()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futuros = {pool.submit(mover, src, dst, mismo): (src, dst) for src, dst, mismo in movimientos}
+                for futuro in as_completed(futuros):
+                    src, dst = futuros[futuro]
                     try:
-                        shutil.move(src, dst)
-                        moved_count += 1
-                    except Exception:
-                        pass
-
-            # tras procesar, eliminar posibles manifest y luego carpeta
-            for item in os.listdir(carpeta):
-                path = os.path.join(carpeta, item)
-                if MANIFEST_RE.match(item):
-                    try: os.remove(path)
-                    except: pass
-            try:
-                os.rmdir(carpeta)
-            except:
-                pass
-
-        # escribir manifest fusionado
-        if manifest_entries:
-            mfpath = os.path.join(nueva, '_manifest.txt')
-            try:
-                with open(mfpath, 'w', encoding='utf-8') as mf:
-                    mf.write('# Mapping: Sequential Filename : Original Filename (PostID: ...)\n')
-                    mf.write('------------------------------------------------------------\n')
-                    for entry in manifest_entries:
-                        mf.write(entry + '\n')
-            except Exception:
-                pass
-
-        print(Fore.GREEN + f"✅ Fusionado '{nombre}' ({moved_count} ítems) → {nueva}" + Style.RESET_ALL)
-        resumen.append((nueva, len(rutas)))
-
-    # Resumen final
+                        size = futuro.result()
+                    except (OSError, shutil.Error) as e:
+                        resumen['errores'].append(f"{src}: {e}")
+                        continue
+                    journal.registrar(op='move', src=src, dst=dst, bytes=size)
+                    movidos += 1
+                    resumen['bytes'] += size
+                    movidos_ok.add(src)
+            for imagen, src, dst, mismo in sidecars:
+                if imagen not in movidos_ok: continue # La imagen sigue en el origen: su sidecar también
+                try:
+                    size = mover(src, dst, mismo)
+                except (OSError, shutil.Error) as e:
+                    resumen['errores'].append(f"{src}: {e}")
+                    continue
+                journal.registrar(op='move', src=src, dst=dst, bytes=size)
+                movidos_ok.add(src)
+
+            # escribir manifest fusionado (el anterior queda en el diario)
+            if manifest_entries:
+                mfpath = os.path.join(nueva, '_manifest.txt')
+                try:
+                    previo = open(mfpath, 'r', encoding='utf-8').read() if os.path.exists(mfpath) else None
+                    with open(mfpath, 'w', encoding='utf-8') as mf:
+                        mf.write('# Mapping: Sequential Filename : Original Filename (PostID: ...)\n')
+                        mf.write('------------------------------------------------------------\n')
+                        for entry in manifest_entries:
+                            mf.write(entry + '\n')
+                    journal.registrar(op='write', path=mfpath, previo=previo)
+                except OSError as e:
+                    resumen['errores'].append(f"{mfpath}: {e}")
+
+            # _manifest.json: el descargador numera con él, así que sigue a los archivos movidos
+            if renombres_json:
+                mfpath = os.path.join(nueva, MANIFEST_JSON_FILENAME)
+                try:
+                    previo = open(mfpath, 'r', encoding='utf-8').read() if os.path.exists(mfpath) else None
+                    fusionado = json_destino or GroupManifest(nueva)
+                    for carpeta, renombres in renombres_json:
+                        hechos = {k: v for k, v in renombres.items() if os.path.join(carpeta, k) in movidos_ok}
+                        fusionado.merge_from(GroupManifest.load(carpeta), hechos)
+                    fusionado.save(write_txt=False)
+                    journal.registrar(op='write', path=mfpath, previo=previo)
+                except OSError as e:
+                    resumen['errores'].append(f"{mfpath}: {e}")
+
+            # tras procesar, eliminar manifests y luego carpetas vacías
+            for carpeta in origenes:
+                if not os.path.isdir(carpeta): continue
+                for item in os.listdir(carpeta):
+                    path = os.path.join(carpeta, item)
+                    if es_manifest(item):
+                        try:
+                            contenido = open(path, 'r', encoding='utf-8').read()
+                            os.remove(path)
+                            journal.registrar(op='remove', path=path, contenido=contenido)
+                        except (OSError, UnicodeDecodeError) as e:
+                            resumen['errores'].append(f"{path}: {e}")
+                try:
+                    os.rmdir(carpeta)
+                    journal.registrar(op='rmdir', path=carpeta)
+                except OSError as e:
+                    resumen['errores'].append(f"{carpeta}: no se pudo eliminar ({e})")
+
+            print(Fore.GREEN + f"✅ Fusionado '{grupo['nombre']}' ({movidos} ítems) → {nueva}" + Style.RESET_ALL)
+            resumen['grupos'] += 1
+            resumen['archivos'] += movidos
+    finally:
+        journal.cerrar()
+    return resumen
+
+def deshacer(journal_path):
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        ops = []
+        for line in f:
+            try: ops.append(json.loads(line))
+            except ValueError: break # Última línea cortada
+    errores = []
+    for op in reversed(ops):
+        try:
+            if op['op'] == 'move':
+                os.makedirs(os.path.dirname(op['src']), exist_ok=True)
+                shutil.move(op['dst'], op['src'])
+            elif op['op'] == 'rmdir':
+                os.makedirs(op['path'], exist_ok=True)
+            elif op['op'] == 'remove':
+                with open(op['path'], 'w', encoding='utf-8') as mf: mf.write(op['contenido'])
+            elif op['op'] == 'write':
+                if op['previo'] is None: os.remove(op['path'])
+                else:
+                    with open(op['path'], 'w', encoding='utf-8') as mf: mf.write(op['previo'])
+            elif op['op'] == 'mkdir':
+                os.rmdir(op['path'])
+        except (OSError, shutil.Error) as e:
+            errores.append(f"{op['op']} {op.get('path', op.get('dst'))}: {e}")
+    return len(ops), errores
+
+def mostrar_resumen(resumen):
     print(Fore.CYAN + "\n=== RESUMEN FINAL ===" + Style.RESET_ALL)
-    for nueva, count in resumen:
-        print(Fore.GREEN + f"• {os.path.basename(nueva)}:" + Style.RESET_ALL +
-              f" {count} carpetas fusionadas → {nueva}")
+    print(f"• {resumen['grupos']} fusiones, {resumen['archivos']} archivos, {resumen['bytes'] / (1024 * 1024):.1f} MB movidos")
+    print(f"• Diario para deshacer: {resumen['journal']}")
+    for error in resumen['errores']:
+        print(Fore.RED + f"  ⚠️ {error}" + Style.RESET_ALL)
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(Fore.RED + "Uso: python fusion_carpetas.py <ruta_carpeta_raíz>" + Style.RESET_ALL)
-        sys.exit(1)
-    raiz = sys.argv[1]
-    if not os.path.isdir(raiz):
+def ruta_journal(base):
+    return f"{base}.journal-{time.strftime('%Y%m%d-%H%M%S')}.jsonl"
+
+def fusionar_y_resumir(grupos, raiz, confirmar=True, workers=8):
+    if confirmar:
+        confirm = input(Fore.CYAN + "\n¿Procedemos? (sí/no): " + Style.RESET_ALL).strip().lower()
+        if confirm != 'sí':
+            print(Fore.RED + "⚠️ Operación cancelada." + Style.RESET_ALL)
+            return None
+    resumen = ejecutar_plan(crear_plan(grupos, raiz), ruta_journal(os.path.join(raiz, '_fusion')), workers)
+    mostrar_resumen(resumen)
+    return resumen
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sugiere y fusiona carpetas con nombres parecidos.")
+    parser.add_argument('raiz', nargs='?', help="Carpeta raíz a analizar")
+    parser.add_argument('--plan', metavar='PLAN.json', help="Guarda el plan de fusión en JSON y termina")
+    parser.add_argument('--execute', metavar='PLAN.json', help="Ejecuta un plan guardado sin preguntar")
+    parser.add_argument('--undo', metavar='JOURNAL.jsonl', help="Deshace una fusión a partir de su diario")
+    parser.add_argument('--yes', '-y', action='store_true', help="No pedir confirmación")
+    parser.add_argument('--workers', type=int, default=8, help="Movimientos en paralelo (por defecto 8)")
+    args = parser.parse_args(argv)
+
+    if args.undo:
+        total, errores = deshacer(args.undo)
+        print(Fore.GREEN + f"↩️ Deshechas {total} operaciones de {args.undo}" + Style.RESET_ALL)
+        for error in errores:
+            print(Fore.RED + f"  ⚠️ {error}" + Style.RESET_ALL)
+        return 1 if errores else 0
+
+    if args.execute:
+        plan = cargar_plan(args.execute)
+        resumen = ejecutar_plan(plan, ruta_journal(os.path.splitext(args.execute)[0]), args.workers)
+        mostrar_resumen(resumen)
+        return 1 if resumen['errores'] else 0
+
+    if not args.raiz or not os.path.isdir(args.raiz):
         print(Fore.RED + "❌ Ruta inválida." + Style.RESET_ALL)
-        sys.exit(1)
+        return 1
 
-    grupos = agrupar_carpetas_unicas(raiz)
+    grupos = agrupar_carpetas_unicas(args.raiz)
     if not grupos:
         print(Fore.GREEN + "✔️ No se encontraron carpetas para fusionar." + Style.RESET_ALL)
-    else:
-        mostrar_grupos(grupos)
-        fusionar_y_resumir(grupos)
+        return 0
+    if args.plan:
+        guardar_plan(crear_plan(grupos, args.raiz), args.plan)
+        print(Fore.GREEN + f"📝 Plan con {len(grupos)} fusiones guardado en {args.plan}" + Style.RESET_ALL)
+        return 0
+    mostrar_grupos(grupos)
+    fusionar_y_resumir(grupos, args.raiz, confirmar=not args.yes, workers=args.workers)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
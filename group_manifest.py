@@ -0,0 +1,252 @@
+# group_manifest.py
+import os
+import re
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+# Every group folder has a human-readable _manifest.txt and, next to it, a
+# _manifest.json that ties each (post id, attachment index) to its filename.
+# The JSON is what keeps numbering stable across resyncs: a file keeps its
+# name forever and new files get the next free number.
+MANIFEST_FILENAME = "_manifest.txt"
+MANIFEST_JSON_FILENAME = "_manifest.json"
+MANIFEST_VERSION = 1
+DEFAULT_PADDING = 4
+
+MANIFEST_HEADER = "# Mapping: Sequential Filename : Original Filename (PostID: ...)"
+MANIFEST_LINE_RE = re.compile(r'^(?P<filename>.+?) : (?P<original>.*) \(PostID: (?P<post_id>[^)]*)\)$')
+SEQUENCE_RE = re.compile(r'^(\d+)')
+
+
+def entry_key(post_id, index: int) -> str:
+    return f"{post_id}:{index}"
+
+
+def _sequence_of(filename: str) -> int:
+    m = SEQUENCE_RE.match(filename)
+    return int(m.group(1)) if m else 0
+
+
+def _filename_sort_key(filename: str):
+    return (_sequence_of(filename) == 0, _sequence_of(filename), filename)
+
+
+def file_fingerprint(path) -> Tuple[str, int, int]:
+    """(sha1, size, mtime_ns) of a file, read in 1 MB chunks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    st = os.stat(path)
+    return digest.hexdigest(), st.st_size, st.st_mtime_ns
+
+
+def read_manifest_txt(path) -> Iterable[Tuple[str, str, str]]:
+    """Yields (filename, original, post_id) for each mapping line of a _manifest.txt."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            m = MANIFEST_LINE_RE.match(line.rstrip('\n'))
+            if m:
+                yield m.group('filename'), m.group('original'), m.group('post_id')
+
+
+class GroupManifest:
+    """
+    The file mapping of one group folder.
+
+    Entries are keyed by "post_id:attachment_index" and hold filename, API
+    path, original name and, once downloaded, sha1/size/mtime_ns of the file.
+    """
+
+    def __init__(self, group_dir, data: Optional[Dict] = None):
+        self.group_dir = Path(group_dir)
+        data = data or {}
+        self.files: Dict[str, Dict] = data.get('files', {})
+        self.next_seq: int = data.get('next_seq', 1)
+        self.rename_plan: Optional[str] = data.get('rename_plan') # Last rename_planner plan applied
+        self._by_path: Optional[Dict[Tuple[str, str], str]] = None
+
+    # --- Loading / saving ---
+    @classmethod
+    def load(cls, group_dir) -> 'GroupManifest':
+        """
+        Reads _manifest.json; without it, seeds the mapping from _manifest.txt
+        (attachment index = order of the post's lines), so folders downloaded
+        before the JSON existed keep their names.
+        """
+        group_dir = Path(group_dir)
+        manifest = None
+        json_path = group_dir / MANIFEST_JSON_FILENAME
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.get('version') == MANIFEST_VERSION:
+                manifest = cls(group_dir, data)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"WARN: {json_path} ilegible: {e}. Se reconstruye desde {MANIFEST_FILENAME}.")
+
+        if manifest is None:
+            manifest = cls(group_dir)
+            seen_per_post: Dict[str, int] = {}
+            try:
+                for filename, original, post_id in read_manifest_txt(group_dir / MANIFEST_FILENAME):
+                    index = seen_per_post.get(post_id, 0)
+                    seen_per_post[post_id] = index + 1
+                    manifest.files[entry_key(post_id, index)] = {
+                        'filename': filename, 'post_id': post_id, 'index': index,
+                        'original': original, 'path': None,
+                    }
+            except FileNotFoundError:
+                pass
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"WARN: No se pudo leer {group_dir / MANIFEST_FILENAME}: {e}")
+
+        # Never hand out a number already used by an entry or by a file on disk
+        highest = max((_sequence_of(e['filename']) for e in manifest.files.values()), default=0)
+        try:
+            with os.scandir(group_dir) as entries:
+                highest = max([highest] + [_sequence_of(e.name) for e in entries])
+        except OSError:
+            pass
+        manifest.next_seq = max(manifest.next_seq, highest + 1)
+        return manifest
+
+    def to_dict(self) -> Dict:
+        data = {'version': MANIFEST_VERSION, 'next_seq': self.next_seq, 'files': self.files}
+        if self.rename_plan:
+            data['rename_plan'] = self.rename_plan
+        return data
+
+    def save(self, write_txt: bool = True):
+        """Writes _manifest.json atomically and regenerates _manifest.txt from it."""
+        self.group_dir.mkdir(parents=True, exist_ok=True)
+        json_path = self.group_dir / MANIFEST_JSON_FILENAME
+        tmp_path = json_path.with_name(json_path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, json_path)
+        if write_txt and self.files:
+            with open(self.group_dir / MANIFEST_FILENAME, 'w', encoding='utf-8') as f:
+                f.write(MANIFEST_HEADER + "\n")
+                f.write("-" * 60 + "\n")
+                f.write("\n".join(self.txt_lines()))
+
+    def txt_lines(self):
+        entries = sorted(self.files.values(), key=lambda e: _filename_sort_key(e['filename']))
+        return [f"{e['filename']} : {e.get('original', '')} (PostID: {e['post_id']})" for e in entries]
+
+    # --- Numbering ---
+    def assign(self, post_id, index: int, api_path: str, original_name: str, extension: str,
+               padding: int = DEFAULT_PADDING) -> str:
+        """
+        Filename for attachment `index` of `post_id`. Known attachments keep
+        their filename (also if they moved to another index in the post);
+        new ones get the next free number.
+        """
+        post_id = str(post_id)
+        key = entry_key(post_id, index)
+        by_path = self._path_index()
+        entry = self.files.get(key)
+        if entry is not None and entry.get('path') and api_path and entry['path'] != api_path:
+            # Another file used to be at this index: keep it (and its filename) under a spare key
+            spare_key = f"{key}~{entry['filename']}"
+            self.files[spare_key] = self.files.pop(key)
+            by_path[(post_id, entry['path'])] = spare_key
+            entry = None
+        if entry is None:
+            # Same file under another index (the creator reordered/removed attachments)?
+            moved_key = by_path.get((post_id, api_path))
+            if moved_key is not None:
+                entry = self.files.pop(moved_key)
+        if entry is None:
+            entry = {'filename': f"{self.next_seq:0{padding}d}{extension}", 'post_id': post_id}
+            self.next_seq += 1
+        entry.update({'index': index, 'path': api_path, 'original': original_name})
+        self.files[key] = entry
+        if api_path:
+            by_path[(post_id, api_path)] = key
+        return entry['filename']
+
+    def _path_index(self) -> Dict[Tuple[str, str], str]:
+        if self._by_path is None:
+            self._by_path = {(e['post_id'], e['path']): k for k, e in self.files.items() if e.get('path')}
+        return self._by_path
+
+    def record_file(self, post_id, index: int, sha1: str, size: int, mtime_ns: int) -> bool:
+        """Stores the content fingerprint of a downloaded file (used as its ETag by the gallery)."""
+        entry = self.files.get(entry_key(post_id, index))
+        if entry is None:
+            return False
+        entry.update({'sha1': sha1, 'size': size, 'mtime_ns': mtime_ns})
+        return True
+
+    # --- Maintenance from the gallery / fusionar ---
+    def by_filename(self) -> Dict[str, Dict]:
+        return {e['filename']: e for e in self.files.values()}
+
+    def post_ids(self):
+        return {e['post_id'] for e in self.files.values()}
+
+    def rename_files(self, mapping: Dict[str, str], plan_id: Optional[str] = None) -> bool:
+        """
+        Applies old filename -> new filename renames done on disk. With the
+        `plan_id` of a rename_planner journal, a plan already applied (the
+        roll-forward after a crash between saving and removing the journal)
+        is skipped, since swaps would be undone. Returns False if skipped.
+        """
+        if plan_id and plan_id == self.rename_plan:
+            return False
+        self.rename_plan = plan_id or self.rename_plan
+        for entry in self.files.values():
+            new_name = mapping.get(entry['filename'])
+            if new_name:
+                entry['filename'] = new_name
+        self.next_seq = max([self.next_seq] + [_sequence_of(n) + 1 for n in mapping.values()])
+        return True
+
+    def merge_from(self, other: 'GroupManifest', mapping: Dict[str, str]):
+        """
+        Adds the entries of `other` whose files were moved here (old name ->
+        new name in `mapping`). Entries of files that did not move are dropped.
+        """
+        for key, entry in other.files.items():
+            new_name = mapping.get(entry['filename'])
+            if not new_name:
+                continue
+            entry = dict(entry, filename=new_name)
+            if key in self.files: # Same attachment downloaded in two groups: keep both
+                key = f"{key}@{new_name}"
+            self.files[key] = entry
+            self.next_seq = max(self.next_seq, _sequence_of(new_name) + 1)
+        self._by_path = None
+
+
+def locate_posts(creator_dir) -> Dict[str, str]:
+    """post id -> group folder, from the _manifest.json files under a creator folder."""
+    located = {}
+    try:
+        group_dirs = [e.path for e in os.scandir(creator_dir) if e.is_dir(follow_symlinks=False)]
+    except OSError:
+        return located
+    for group_dir in group_dirs:
+        if not os.path.exists(os.path.join(group_dir, MANIFEST_JSON_FILENAME)):
+            continue
+        for post_id in GroupManifest.load(group_dir).post_ids():
+            located.setdefault(post_id, os.path.basename(group_dir))
+    return located
+
+
+if __name__ == '__main__':
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        m = GroupManifest.load(tmp)
+        print(m.assign('101', 0, '/a/x.png', 'x.png', '.png'))  # 0001.png
+        print(m.assign('102', 0, '/a/y.jpg', 'y.jpg', '.jpg'))  # 0002.jpg
+        m.save()
+        m = GroupManifest.load(tmp)
+        print(m.assign('100', 0, '/a/w.jpg', 'w.jpg', '.jpg'))  # An older post appears: 0003.jpg
+        print(m.assign('101', 0, '/a/x.png', 'x.png', '.png'))  # Still 0001.png
@@ -1,7 +1,9 @@
 # grouper.py
+import os
 import re
+import json
 from collections import defaultdict
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
 from pathlib import Path
 # Import the UPDATED sanitize_filename
 from utils import sanitize_filename
@@ -23,19 +25,43 @@ SUFFIX_REGEX = re.compile(
 )
 MIN_WORDS_FOR_GROUP = 2
 
+# Persisted per creator so a resync keeps every known post in its folder
+GROUPING_INDEX_FILENAME = "_grouping_index.json"
+GROUPING_INDEX_VERSION = 1
+
+def has_images(post: Dict) -> bool:
+    """True if the post has a file or at least one attachment with a path."""
+    return bool((post.get('file') and post['file'].get('path')) or
+                (post.get('attachments') and any(att.get('path') for att in post['attachments'])))
+
+def is_groupable(post: Dict) -> bool:
+    """Posts with images and a non-empty title are the ones that get a folder."""
+    return has_images(post) and isinstance(post.get('title'), str) and bool(post['title'].strip())
+
+def base_names(title: str) -> Tuple[str, str]:
+    """
+    Returns (normalized_base, folder_basis) for a title: the suffix-free,
+    lowercased alphanumeric form used for matching, and the suffix-free text
+    the folder name is built from.
+    """
+    title = title.strip()
+    # Remove common suffixes BEFORE normalization for better matching
+    base_name = SUFFIX_REGEX.sub('', title).strip()
+    # Normalize for comparison: lowercase, keep only alphanumeric and spaces, collapse spaces
+    normalized_base = re.sub(r'\s+', ' ', re.sub(r'[^a-z0-9\s]', '', base_name.lower())).strip()
+    # Use the original `base_name` (or `title` if `base_name` is empty) for folder name generation later
+    return normalized_base, (base_name if base_name else title)
+
+def is_groupable_base(normalized_base: str) -> bool:
+    return bool(normalized_base) and len(normalized_base.split()) >= MIN_WORDS_FOR_GROUP
+
 def group_posts_by_title(posts: List[Dict]) -> Dict[str, List[Dict]]:
     """
     Groups posts based on common prefixes in their titles after removing suffixes.
     Uses robust sanitization for folder names. Posts with sufficiently similar base
     titles (after suffix removal and normalization) are grouped.
     """
-    posts_with_images = []
-    for post in posts:
-        # Check for images in 'file' or 'attachments' and ensure title exists
-        has_images = (post.get('file') and post['file'].get('path')) or \
-                     (post.get('attachments') and any(att.get('path') for att in post['attachments']))
-        if has_images and post.get('title') and isinstance(post['title'], str) and post['title'].strip():
-            posts_with_images.append(post)
+    posts_with_images = [post for post in posts if is_groupable(post)]
 
     if not posts_with_images:
         return {}
@@ -43,15 +69,7 @@ def group_posts_by_title(posts: List[Dict]) -> Dict[str, List[Dict]]:
     # 1. Pre-process: Extract potential base names and normalize
     processed_posts = []
     for post in posts_with_images:
-        title = post['title'].strip()
-        # Remove common suffixes BEFORE normalization for better matching
-        base_name = SUFFIX_REGEX.sub('', title).strip()
-        # Normalize for comparison: lowercase, keep only alphanumeric and spaces, collapse spaces
-        normalized_base = re.sub(r'\s+', ' ', re.sub(r'[^a-z0-9\s]', '', base_name.lower())).strip()
-
-        # Use the original `base_name` (or `title` if `base_name` is empty) for folder name generation later
-        folder_basis = base_name if base_name else title
-
+        normalized_base, folder_basis = base_names(post['title'])
         processed_posts.append({
             'post_data': post,
             'normalized_base': normalized_base,
@@ -64,7 +82,7 @@ def group_posts_by_title(posts: List[Dict]) -> Dict[str, List[Dict]]:
 
     for p_info in processed_posts:
         # Only group if the normalized base name has enough words
-        if p_info['normalized_base'] and len(p_info['normalized_base'].split()) >= MIN_WORDS_FOR_GROUP:
+        if is_groupable_base(p_info['normalized_base']):
             temp_groups[p_info['normalized_base']].append(p_info)
         else:
             # Treat as individual if base name is too short or empty after normalization
@@ -112,6 +130,113 @@ def group_posts_by_title(posts: List[Dict]) -> Dict[str, List[Dict]]:
     return dict(final_groups)
 
 
+# --- Incremental grouping ---
+def new_grouping_index() -> Dict:
+    """
+    Empty grouping index. Layout:
+      bases: normalized base title -> folder
+      posts: post id -> {'folder': name}
+    File numbering lives in each folder's _manifest.json (group_manifest.py).
+    """
+    return {'version': GROUPING_INDEX_VERSION, 'bases': {}, 'posts': {}}
+
+def load_grouping_index(creator_dir) -> Dict:
+    """Reads the creator's grouping index; a missing or unreadable file gives an empty index."""
+    index_path = Path(creator_dir) / GROUPING_INDEX_FILENAME
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return new_grouping_index()
+    except (OSError, ValueError) as e:
+        print(f"WARN: Índice de agrupación ilegible ({index_path}): {e}. Se reconstruye.")
+        return new_grouping_index()
+    if not isinstance(index, dict) or index.get('version') != GROUPING_INDEX_VERSION:
+        return new_grouping_index()
+    for key in ('bases', 'posts'):
+        index.setdefault(key, {})
+    index.pop('folders', None) # Numbering moved to each folder's _manifest.json
+    return index
+
+def save_grouping_index(creator_dir, index: Dict):
+    """Writes the index atomically (temp file + replace), so a crash never leaves half a file."""
+    index_path = Path(creator_dir) / GROUPING_INDEX_FILENAME
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, index_path)
+
+def group_posts_incremental(posts: List[Dict], index: Dict,
+                            group_new: Optional[Callable[[List[Dict]], Dict[str, List[Dict]]]] = None) -> Dict[str, List[Dict]]:
+    """
+    Groups posts keeping every post already in `index` in its folder.
+
+    - Known posts go back to their folder, whatever their title says now.
+    - New posts whose normalized base title is known join that folder.
+    - The remaining new posts are grouped among themselves by `group_new`
+      (group_posts_by_title by default) and recorded in the index.
+
+    `index` is updated in place; the caller saves it once the files are
+    numbered.
+    """
+    group_new = group_new or group_posts_by_title
+    known = defaultdict(list)
+    new_posts = []
+    for post in posts:
+        if not is_groupable(post):
+            continue
+        post_id = str(post['id'])
+        entry = index['posts'].get(post_id)
+        if entry:
+            known[entry['folder']].append(post)
+            continue
+        normalized_base, _ = base_names(post['title'])
+        folder = index['bases'].get(normalized_base) if is_groupable_base(normalized_base) else None
+        if folder:
+            index['posts'][post_id] = {'folder': folder}
+            known[folder].append(post)
+        else:
+            new_posts.append(post)
+
+    grouped = {}
+    # Known posts keep their files whatever the order (see group_manifest), so date order is enough
+    for folder, folder_posts in known.items():
+        grouped[folder] = sorted(folder_posts, key=lambda p: str(p.get('published', '')))
+
+    if new_posts:
+        for folder, folder_posts in group_new(new_posts).items():
+            grouped.setdefault(folder, []).extend(folder_posts)
+            for post in folder_posts:
+                index['posts'].setdefault(str(post['id']), {'folder': folder})
+                normalized_base, _ = base_names(post.get('title') or '')
+                if is_groupable_base(normalized_base):
+                    index['bases'].setdefault(normalized_base, folder)
+    return grouped
+
+def reconcile_grouping_index(index: Dict, existing_folders, post_locations: Dict[str, str]):
+    """
+    Follows folders that were renamed or merged outside the downloader (web
+    gallery, fusionar): posts whose folder is gone are pointed at the folder
+    that now holds them (`post_locations`: post id -> folder), and base titles
+    follow their posts. Returns the number of posts relocated.
+    """
+    existing_folders = set(existing_folders)
+    moved_folders = {}
+    relocated = 0
+    for post_id, entry in index['posts'].items():
+        if entry['folder'] in existing_folders:
+            continue
+        new_folder = post_locations.get(post_id)
+        if new_folder and new_folder in existing_folders:
+            moved_folders.setdefault(entry['folder'], new_folder)
+            entry['folder'] = new_folder
+            relocated += 1
+    for base, folder in index['bases'].items():
+        if folder in moved_folders:
+            index['bases'][base] = moved_folders[folder]
+    return relocated
+
+
 if __name__ == '__main__':
     # Example usage
     sample_posts = [
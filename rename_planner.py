@@ -0,0 +1,223 @@
+# rename_planner.py
+import os
+import hashlib
+import json
+import re
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Journal written next to the files while a rename plan is being applied.
+# If the process dies half-way, recover_pending_renames() rolls it forward.
+# The header also keeps the old name -> new name mapping, so whatever has to
+# follow the files (the group's _manifest.json) is updated on roll-forward too.
+JOURNAL_FILENAME = "_rename_journal.jsonl"
+TEMP_PREFIX = ".reorder_tmp_"
+MIN_SEQUENCE_PADDING = 3
+
+NUMERIC_STEM_RE = re.compile(r'^(\d+)$')
+
+
+class RenamePlanError(ValueError):
+    """The requested renames cannot be applied without overwriting a file."""
+
+
+def detect_padding(filenames: Iterable[str], total: int) -> int:
+    """
+    Returns the zero-padding to use for sequential names (NNN.ext).
+
+    Keeps the padding the folder already uses (e.g. 4 for '0001.jpg' from the
+    downloader) so a reorder does not rename every file just to change width.
+    """
+    widths: Dict[int, int] = {}
+    for name in filenames:
+        m = NUMERIC_STEM_RE.match(Path(name).stem)
+        if m:
+            widths[len(m.group(1))] = widths.get(len(m.group(1)), 0) + 1
+    current = max(widths, key=lambda w: (widths[w], w)) if widths else MIN_SEQUENCE_PADDING
+    return max(current, len(str(total)), MIN_SEQUENCE_PADDING)
+
+
+def sequential_names(ordered_filenames: List[str], padding: Optional[int] = None, start: int = 1) -> Dict[str, str]:
+    """Maps each filename to its sequential name (by position) keeping its extension."""
+    if padding is None:
+        padding = detect_padding(ordered_filenames, len(ordered_filenames) + start - 1)
+    return {
+        name: f"{i:0{padding}d}{Path(name).suffix}"
+        for i, name in enumerate(ordered_filenames, start=start)
+    }
+
+
+def plan_renames(mapping: Dict[str, str], occupied: Iterable[str] = ()) -> List[Tuple[str, str]]:
+    """
+    Computes an ordered list of (src, dst) renames that applies `mapping`
+    (current name -> desired name, same directory) without ever renaming onto
+    an existing file.
+
+    - Entries that already have their final name are skipped.
+    - Chains (a->b, b->c) are ordered so each target is free when used.
+    - Cycles (a->b, b->a) are broken with a single temporary name.
+    - `occupied` lists other names present in the directory; targeting one of
+      them raises RenamePlanError instead of clobbering it.
+    """
+    pending = {src: dst for src, dst in mapping.items() if src != dst}
+    if not pending:
+        return []
+
+    target_to_src: Dict[str, str] = {}
+    for src, dst in pending.items():
+        if dst in target_to_src:
+            raise RenamePlanError(f"'{target_to_src[dst]}' y '{src}' tendrían el mismo nombre final '{dst}'.")
+        target_to_src[dst] = src
+    # Files keeping their name, and unrelated files, must not be overwritten
+    occupied_set = (set(occupied) - set(mapping)) | {src for src, dst in mapping.items() if src == dst}
+    clashes = sorted(dst for dst in target_to_src if dst in occupied_set)
+    if clashes:
+        raise RenamePlanError(f"Los nombres de destino ya existen: {', '.join(clashes)}")
+
+    used_names = set(mapping) | set(target_to_src) | occupied_set
+    temp_counter = 0
+    steps: List[Tuple[str, str]] = []
+    # A rename is ready when its target is not the current name of a pending file
+    ready = sorted((src for src, dst in pending.items() if dst not in pending), reverse=True)
+
+    while pending:
+        while ready:
+            src = ready.pop()
+            dst = pending.pop(src)
+            steps.append((src, dst))
+            # `src` is free now: whoever wanted that name can go next
+            waiting = target_to_src.get(src)
+            if waiting is not None and waiting in pending:
+                ready.append(waiting)
+        if pending:
+            # Only cycles remain: park one member under a temporary name
+            src = min(pending)
+            while True:
+                temp_name = f"{TEMP_PREFIX}{temp_counter}{Path(src).suffix}"
+                temp_counter += 1
+                if temp_name not in used_names:
+                    break
+            used_names.add(temp_name)
+            dst = pending.pop(src)
+            steps.append((src, temp_name))
+            pending[temp_name] = dst
+            target_to_src[dst] = temp_name
+            waiting = target_to_src.get(src)
+            if waiting is not None and waiting in pending:
+                ready.append(waiting)
+    return steps
+
+
+def steps_mapping(steps: List[Tuple[str, str]]) -> Dict[str, str]:
+    """Original name -> final name of the files moved by `steps` (temporary names resolved)."""
+    original_of: Dict[str, str] = {}
+    for src, dst in steps:
+        original_of[dst] = original_of.pop(src, src)
+    return {original: final for final, original in original_of.items() if original != final}
+
+
+FinishCallback = Callable[[Dict[str, str], str], None]
+
+
+def apply_renames(directory, steps: List[Tuple[str, str]],
+                  progress_callback: Optional[Callable[[int, int], None]] = None,
+                  mapping: Optional[Dict[str, str]] = None, on_finish: Optional[FinishCallback] = None) -> int:
+    """
+    Applies the planned renames inside `directory`, journaling each step.
+
+    The journal holds the whole plan (and `mapping`, the renames it stands
+    for) plus one line per completed step, so a crash at any point can be
+    rolled forward by recover_pending_renames(). Once every file has its
+    new name, `on_finish(mapping, plan_id)` runs *before* the journal is
+    removed: if it fails or the process dies, the roll-forward calls it
+    again, with the same plan_id so it can tell a plan it already applied.
+    Returns the number of renames applied.
+    """
+    directory = Path(directory)
+    if not steps:
+        return 0
+    journal_path = directory / JOURNAL_FILENAME
+    if journal_path.exists():
+        # Finish the previous plan first; its names are what `steps` was computed against
+        raise RenamePlanError("Hay un reordenado anterior sin terminar; recupéralo antes de continuar.")
+
+    mapping = {src: dst for src, dst in (mapping or {}).items() if src != dst}
+    plan_id = uuid.uuid4().hex
+    with open(journal_path, 'w', encoding='utf-8') as journal:
+        journal.write(json.dumps({"steps": steps, "mapping": mapping, "id": plan_id}) + "\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+        _run_steps(directory, steps, 0, journal, progress_callback)
+    if on_finish and mapping:
+        on_finish(mapping, plan_id)
+    journal_path.unlink()
+    return len(steps)
+
+
+def recover_pending_renames(directory,
+                            progress_callback: Optional[Callable[[int, int], None]] = None,
+                            on_finish: Optional[FinishCallback] = None) -> int:
+    """
+    Rolls forward an interrupted apply_renames() in `directory`, if any,
+    including its `on_finish` step (see apply_renames).
+    Returns the number of steps that were still pending (0 if no journal).
+    """
+    directory = Path(directory)
+    journal_path = directory / JOURNAL_FILENAME
+    if not journal_path.exists():
+        return 0
+
+    with open(journal_path, 'r', encoding='utf-8') as journal:
+        lines = [line for line in journal.read().splitlines() if line.strip()]
+    try:
+        header = json.loads(lines[0])
+        steps = [tuple(step) for step in header["steps"]]
+    except (IndexError, KeyError, ValueError, TypeError):
+        # The header never made it to disk: nothing was renamed yet
+        journal_path.unlink()
+        return 0
+
+    completed = -1
+    for line in lines[1:]:
+        try:
+            completed = max(completed, int(json.loads(line)["done"]))
+        except (KeyError, ValueError, TypeError):
+            break # Torn last line
+    first_pending = completed + 1
+
+    with open(journal_path, 'a', encoding='utf-8') as journal:
+        _run_steps(directory, steps, first_pending, journal, progress_callback)
+    # Journals written before the mapping was recorded: it follows from the steps
+    mapping = header.get("mapping")
+    if mapping is None:
+        mapping = steps_mapping(steps)
+    if on_finish and mapping:
+        on_finish(mapping, header.get("id") or hashlib.sha1(lines[0].encode('utf-8')).hexdigest())
+    journal_path.unlink()
+    return len(steps) - first_pending
+
+
+def _run_steps(directory: Path, steps, first_index: int, journal, progress_callback):
+    total = len(steps)
+    for index in range(first_index, total):
+        src, dst = steps[index]
+        src_path, dst_path = directory / src, directory / dst
+        if src_path.exists():
+            if dst_path.exists():
+                raise RenamePlanError(f"No se puede renombrar '{src}' a '{dst}': el destino ya existe.")
+            os.rename(src_path, dst_path)
+        elif not dst_path.exists():
+            raise RenamePlanError(f"Falta el archivo '{src}' durante el reordenado.")
+        # else: renamed before a crash, but the journal line was not written
+        journal.write(json.dumps({"done": index}) + "\n")
+        journal.flush()
+        if progress_callback:
+            progress_callback(index + 1, total)
+
+
+if __name__ == '__main__':
+    # Example: swap two files and move a third into a freed slot
+    plan = plan_renames({'001.jpg': '002.jpg', '002.jpg': '001.jpg', '005.png': '003.png'})
+    for step in plan:
+        print(f"{step[0]} -> {step[1]}")
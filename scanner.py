@@ -0,0 +1,139 @@
+# scanner.py
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Directory listings are I/O bound (especially on network shares), so several
+# directories are listed at once. Each worker only does one os.scandir().
+DEFAULT_SCAN_WORKERS = 8
+
+
+class FileEntry(NamedTuple):
+    """A file seen during the scan. Field names match os.stat_result on purpose,
+    so an entry can be passed wherever only st_size / st_mtime_ns are read."""
+    name: str
+    st_size: int
+    st_mtime_ns: int
+
+
+class DirSnapshot(NamedTuple):
+    path: str
+    depth: int                   # 0 for the scan root
+    subdirs: Tuple[str, ...]     # Names of the subdirectories (symlinks are not followed)
+    files: Tuple[FileEntry, ...] # Matching files; empty when keep_names=False
+    file_count: int              # Matching files
+    total_size: int              # Bytes of the matching files
+    newest_mtime_ns: int         # Newest mtime among the matching files (0 if none)
+    entry_count: int             # Every entry in the directory, whatever its type
+
+
+class TreeSnapshot:
+    """Result of scan_tree(): one DirSnapshot per directory, keyed by path."""
+
+    def __init__(self, root: str, dirs: Dict[str, DirSnapshot]):
+        self.root = root
+        self.dirs = dirs
+
+    def __len__(self):
+        return len(self.dirs)
+
+    def get(self, path) -> Optional[DirSnapshot]:
+        return self.dirs.get(os.fspath(path))
+
+    def subdirectories(self, include_root: bool = False) -> List[str]:
+        """Every scanned directory path, sorted."""
+        return sorted(p for p in self.dirs if include_root or p != self.root)
+
+    def children(self, path=None) -> List[DirSnapshot]:
+        """Snapshots of the direct subdirectories of `path` (the root by default), sorted by name."""
+        parent = self.dirs.get(os.fspath(path) if path is not None else self.root)
+        if parent is None:
+            return []
+        found = (self.dirs.get(os.path.join(parent.path, name)) for name in sorted(parent.subdirs))
+        return [d for d in found if d is not None]
+
+    def empty_dirs(self) -> List[str]:
+        """Directories with no entries at all, deepest first (the root is never included)."""
+        empty = [d for d in self.dirs.values() if d.entry_count == 0 and d.path != self.root]
+        return [d.path for d in sorted(empty, key=lambda d: (-d.depth, d.path))]
+
+
+def _scan_one(path: str, depth: int, extensions, keep_names: bool):
+    subdirs, files = [], []
+    file_count = total_size = newest = entry_count = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            entry_count += 1
+            try:
+                # is_dir()/is_file() use the type cached by scandir: no extra syscall
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                    continue
+                if not entry.is_file():
+                    continue
+                if extensions is not None and os.path.splitext(entry.name)[1].lower() not in extensions:
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue # Vanished or unreadable entry: skip it, keep scanning
+            file_count += 1
+            total_size += st.st_size
+            newest = max(newest, st.st_mtime_ns)
+            if keep_names:
+                files.append(FileEntry(entry.name, st.st_size, st.st_mtime_ns))
+    return DirSnapshot(path, depth, tuple(subdirs), tuple(files), file_count, total_size, newest, entry_count)
+
+
+def scan_tree(root, extensions: Optional[Iterable[str]] = None, keep_names: bool = True,
+              max_depth: Optional[int] = None, workers: int = DEFAULT_SCAN_WORKERS) -> TreeSnapshot:
+    """
+    Walks `root` with os.scandir, listing several directories in parallel.
+
+    - extensions: only files with these suffixes (lowercase, with dot) are
+      counted and kept; None keeps every file.
+    - keep_names: store a FileEntry per file. Set to False when only the
+      counts/sizes are needed, to keep the snapshot small on huge trees.
+    - max_depth: 0 lists only the root, 1 the root and its children, etc.
+
+    Directories that cannot be listed are left out of the snapshot (except
+    the root, whose error is raised).
+    """
+    root = os.fspath(root)
+    if extensions is not None:
+        extensions = {e.lower() for e in extensions}
+    dirs: Dict[str, DirSnapshot] = {root: _scan_one(root, 0, extensions, keep_names)}
+
+    def children_of(snap: DirSnapshot):
+        if max_depth is not None and snap.depth >= max_depth:
+            return []
+        return [(os.path.join(snap.path, name), snap.depth + 1) for name in snap.subdirs]
+
+    todo = children_of(dirs[root])
+    if not todo:
+        return TreeSnapshot(root, dirs)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="scan") as pool:
+        pending = {pool.submit(_scan_one, path, depth, extensions, keep_names) for path, depth in todo}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    snap = future.result()
+                except OSError:
+                    continue
+                dirs[snap.path] = snap
+                for path, depth in children_of(snap):
+                    pending.add(pool.submit(_scan_one, path, depth, extensions, keep_names))
+    return TreeSnapshot(root, dirs)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    target = sys.argv[1] if len(sys.argv) > 1 else '.'
+    start = time.perf_counter()
+    snapshot = scan_tree(target, keep_names=False)
+    elapsed = time.perf_counter() - start
+    files = sum(d.file_count for d in snapshot.dirs.values())
+    size = sum(d.total_size for d in snapshot.dirs.values())
+    print(f"{len(snapshot)} directorios, {files} archivos, {size / (1024 * 1024):.1f} MB en {elapsed:.2f}s")
+    print(f"Carpetas vacías: {len(snapshot.empty_dirs())}")
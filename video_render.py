@@ -0,0 +1,681 @@
+# video_render.py
+# Renders folder_to_video slideshows with ffmpeg directly instead of moviepy.
+#
+# moviepy turns every image into 24 full frames per second and pushes them
+# through numpy; a still image only needs ONE frame shown for N seconds. Here
+# the images go to ffmpeg's concat demuxer with a per-image `duration`, are
+# encoded with variable frame rate and `-tune stillimage`. Long slideshows and
+# video intros/outros are encoded as separate segments, in parallel, joined
+# without re-encoding; the looped music is muxed once at the end. The images
+# are letterboxed in a process pool and cached, so re-exports skip them.
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from typing import Callable, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from utils import get_cache_dir, prune_cache_dir
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+VIDEO_EXTENSIONS = ('.mp4', '.mov')
+IMAGE_INTRO_DURATION = 3.0 # Seconds an intro/outro picture is shown (same as the moviepy path)
+
+# Same encoder for every render, so outputs are comparable (and concatenable)
+# (no B-frames: useless on stills, and their reordering delay made mp4 cut the last slide short)
+VIDEO_CODEC_ARGS = ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23', '-tune', 'stillimage', '-bf', '0', '-pix_fmt', 'yuv420p']
+AUDIO_CODEC_ARGS = ['-c:a', 'aac', '-b:a', '192k']
+AUDIO_FORMAT_FILTER = 'aresample=44100,aformat=sample_fmts=fltp:channel_layouts=stereo'
+PREPARED_JPEG_QUALITY = 95
+IMAGE_TIMESTAMP_OPTION = 'option framerate 1000'
+# Long slideshows are cut into segments of this many slides, encoded in parallel
+SEGMENT_IMAGES = 25
+DEFAULT_PREPARE_WORKERS = max(1, min(8, os.cpu_count() or 1))
+PREPARE_WINDOW_PER_WORKER = 2 # Images in flight per worker: bounds decoded frames held at once
+PREPARED_CACHE_NAME = 'video_frames'
+PREPARED_CACHE_MAX_BYTES = 2 * 1024 ** 3 # Oldest prepared frames are pruned past this
+PREPARED_CACHE_VERSION = 1 # Bump when prepare_image output changes
+POSTER_CACHE_NAME = 'video_posters'
+POSTER_TIME = 1.0 # Poster frame of a video preview (the first frame is often black)
+DEFAULT_SEGMENT_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+# Numbered pictures of a group folder ("12.jpg"); "12_pixelado.png" wins over the original
+NUMBERED_IMAGE_RE = re.compile(r"^(\d+)(?:_pixelado)?\.(png|jpg|jpeg|bmp|gif)$", re.IGNORECASE)
+DURATION_RE = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+VIDEO_STREAM_RE = re.compile(r'Stream #\d+:\d+.*?: Video: .*?(\d{2,5})x(\d{2,5})')
+
+
+class RenderError(RuntimeError):
+    """ffmpeg is missing or failed; the message carries the end of its output."""
+
+
+class RenderCancelled(RenderError):
+    """RenderMonitor.cancel() was called; the partial output has been removed."""
+
+
+class RenderProgress(NamedTuple):
+    stage: str                # 'preparar' (images), 'codificar' (seconds of video) or 'unir'
+    done: float
+    total: float
+    frames: int               # Frames encoded so far (all segments)
+    fps: float                # Encoding speed, frames per second
+    segments_done: int
+    segments_total: int
+    eta: Optional[float]      # Seconds left, None until there is something to extrapolate from
+
+    @property
+    def fraction(self) -> float:
+        return min(1.0, self.done / self.total) if self.total else 0.0
+
+
+class RenderMonitor:
+    """
+    Progress and cancellation of one render, shared between the thread that
+    renders and the one that watches (the Tk loop, the batch...).
+
+    `callback` gets a RenderProgress from the rendering threads: it must be
+    thread-safe (e.g. queue.Queue.put). cancel() kills the running ffmpeg
+    processes; the render then raises RenderCancelled.
+    """
+
+    def __init__(self, callback: Optional[Callable[[RenderProgress], None]] = None):
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._procs = set()
+        self._tasks = {}      # task -> [seconds done, seconds total, frames, finished]
+        self._segments_done = 0
+        self._start = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            procs = list(self._procs)
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+
+    def check(self):
+        if self.cancelled:
+            raise RenderCancelled("Exportación cancelada.")
+
+    def attach(self, proc: subprocess.Popen):
+        with self._lock:
+            self._procs.add(proc)
+        if self.cancelled: # cancel() ran between check() and Popen
+            proc.kill()
+
+    def detach(self, proc: subprocess.Popen):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def _emit(self, stage, done, total, frames=0, fps=0.0, eta=None):
+        if self.callback:
+            self.callback(RenderProgress(stage, done, total, frames, fps, self._segments_done,
+                                         len(self._tasks), eta))
+
+    def prepared(self, done: int, total: int):
+        self._emit('preparar', done, total)
+
+    def start_encoding(self, tasks: Sequence[Tuple[str, float]]):
+        """Registers the encoder commands to come as (task, seconds of video it produces)."""
+        with self._lock:
+            self._tasks = {task: [0.0, seconds, 0, False] for task, seconds in tasks}
+            self._segments_done = 0
+            self._start = time.monotonic()
+        self._emit('codificar', 0.0, sum(seconds for _, seconds in tasks))
+
+    def encoded(self, task: str, seconds: float, frames: int, finished: bool = False):
+        with self._lock:
+            state = self._tasks.get(task)
+            if state is None:
+                return
+            if finished and not state[3]:
+                state[3] = True
+                self._segments_done += 1
+                seconds = state[1]
+            state[0] = min(max(seconds, 0.0), state[1])
+            state[2] = max(frames, state[2])
+            done = sum(t[0] for t in self._tasks.values())
+            total = sum(t[1] for t in self._tasks.values())
+            frames = sum(t[2] for t in self._tasks.values())
+            elapsed = time.monotonic() - self._start
+        eta = elapsed * (total - done) / done if done > 0 else None
+        self._emit('codificar', done, total, frames, frames / elapsed if elapsed > 0 else 0.0, eta)
+
+    def joining(self):
+        self._emit('unir', 0, 1)
+
+
+class MediaInfo(NamedTuple):
+    duration: float
+    width: int
+    height: int
+    has_audio: bool
+
+
+def find_ffmpeg() -> Optional[str]:
+    """
+    ffmpeg executable: $FFMPEG_BINARY, then the PATH, then the binary bundled
+    with imageio-ffmpeg (installed together with moviepy). None if none exists.
+    """
+    configured = os.environ.get('FFMPEG_BINARY')
+    if configured and os.path.isfile(configured):
+        return configured
+    found = shutil.which('ffmpeg')
+    if found:
+        return found
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception: # Not installed, or no binary for this platform
+        return None
+
+
+def probe_media(path: str, ffmpeg: Optional[str] = None) -> MediaInfo:
+    """Duration, size and audio presence of a video, read from `ffmpeg -i` (ffprobe is not always there)."""
+    ffmpeg = ffmpeg or find_ffmpeg()
+    if not ffmpeg:
+        raise RenderError("No se encontró ffmpeg.")
+    out = subprocess.run([ffmpeg, '-hide_banner', '-nostdin', '-i', path],
+                         capture_output=True, text=True, errors='replace').stderr
+    duration = DURATION_RE.search(out)
+    size = VIDEO_STREAM_RE.search(out)
+    if not duration or not size:
+        raise RenderError(f"No se pudo leer '{os.path.basename(path)}' con ffmpeg.")
+    h, m, s = duration.groups()
+    return MediaInfo(int(h) * 3600 + int(m) * 60 + float(s), int(size.group(1)), int(size.group(2)),
+                     bool(re.search(r'Stream #\d+:\d+.*?: Audio:', out)))
+
+
+def is_video(path: Optional[str]) -> bool:
+    return bool(path) and os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def is_image(path: Optional[str]) -> bool:
+    return bool(path) and os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def poster_cache_path(video: str) -> str:
+    """Where the poster frame of `video` is cached: keyed by path + mtime + size."""
+    st = os.stat(video)
+    raw = f"{os.path.abspath(video)}|{st.st_mtime_ns}|{st.st_size}"
+    key = hashlib.sha1(raw.encode('utf-8', 'surrogatepass')).hexdigest()
+    return os.path.join(get_cache_dir(POSTER_CACHE_NAME), key[:2], f"{key}.jpg")
+
+
+def extract_poster(video: str, ffmpeg: Optional[str] = None) -> str:
+    """
+    JPEG of the frame at POSTER_TIME (or the first one, for shorter clips),
+    extracted once and reused from the cache afterwards.
+    """
+    dst = poster_cache_path(video)
+    if os.path.exists(dst):
+        return dst
+    ffmpeg = ffmpeg or find_ffmpeg()
+    if not ffmpeg:
+        raise RenderError("No se encontró ffmpeg.")
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.jpg"
+    try:
+        for seek in (POSTER_TIME, 0.0):
+            # -ss before -i seeks by keyframe: fast even on long videos
+            subprocess.run([ffmpeg, '-hide_banner', '-nostdin', '-y', '-ss', f"{seek:.3f}", '-i', video,
+                            '-frames:v', '1', '-q:v', '3', tmp], capture_output=True)
+            if os.path.exists(tmp) and os.path.getsize(tmp):
+                os.replace(tmp, dst)
+                return dst
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    raise RenderError(f"No se pudo extraer un fotograma de '{os.path.basename(video)}'.")
+
+
+def select_numbered_images(folder: str, names: Optional[Iterable[str]] = None,
+                           prefer_pixelated: bool = True) -> List[str]:
+    """
+    Numbered images of `folder` in number order, preferring the `_pixelado`
+    variant of each number (or the original, with `prefer_pixelated=False`,
+    for callers that censor through censura.censored_variant). `names` skips
+    the listing when the caller already has it (e.g. from scanner.scan_tree).
+    """
+    matches = {}
+    for name in (os.listdir(folder) if names is None else names):
+        m = NUMBERED_IMAGE_RE.match(name)
+        if m:
+            num = int(m.group(1))
+            if num not in matches or ('_pixelado' in name.lower()) == prefer_pixelated:
+                matches[num] = name
+    return [os.path.join(folder, matches[num]) for num in sorted(matches)]
+
+
+def even_size(width: int, height: int) -> Tuple[int, int]:
+    # yuv420p needs even dimensions
+    return max(2, width - width % 2), max(2, height - height % 2)
+
+
+def prepare_image(src: str, dst: str, size: Tuple[int, int]) -> str:
+    """
+    Letterboxes `src` into a `size` RGB JPEG. The concat demuxer needs every
+    file to share codec and pixel format, so PNG/GIF/BMP/RGBA inputs are
+    normalized here (GIFs keep their first frame, like moviepy's ImageClip).
+    """
+    with Image.open(src) as img:
+        img.draft('RGB', size) # JPEG: decode directly at a reduced scale when possible
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGBA', img.size, (0, 0, 0, 255))
+            img = Image.alpha_composite(background, img)
+        img = img.convert('RGB')
+        if img.size != size:
+            scale = min(size[0] / img.width, size[1] / img.height)
+            fitted = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            img = img.resize(fitted, Image.LANCZOS)
+            canvas = Image.new('RGB', size, (0, 0, 0))
+            canvas.paste(img, ((size[0] - fitted[0]) // 2, (size[1] - fitted[1]) // 2))
+            img = canvas
+        img.save(dst, 'JPEG', quality=PREPARED_JPEG_QUALITY, subsampling=0)
+    return dst
+
+
+def prepared_cache_key(src: str, size: Tuple[int, int]) -> str:
+    """Cache key of a prepared frame: source path + mtime + target resolution."""
+    st = os.stat(src)
+    raw = f"{PREPARED_CACHE_VERSION}|{os.path.abspath(src)}|{st.st_mtime_ns}|{st.st_size}|{size[0]}x{size[1]}"
+    return hashlib.sha1(raw.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def _prepare_cached(src: str, dst: str, size: Tuple[int, int]) -> str:
+    """prepare_image for the pool: skips cache hits and writes atomically (no half JPEGs in the cache)."""
+    if os.path.exists(dst):
+        return dst
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        prepare_image(src, tmp, size)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return dst
+
+
+def prepare_images(paths: Sequence[str], size: Tuple[int, int], work_dir: str,
+                   cache_dir: Optional[str] = None, workers: Optional[int] = None,
+                   log: Callable[[str], None] = print, monitor: Optional[RenderMonitor] = None) -> List[str]:
+    """
+    Prepares every image of `paths` (see prepare_image) in a process pool and
+    returns the prepared JPEG of each one, in order.
+
+    With `cache_dir` the frames are kept there keyed by path+mtime+resolution,
+    so re-exporting a group only decodes the images that changed. Only
+    workers*PREPARE_WINDOW_PER_WORKER images are submitted at a time: the
+    parent never holds pixels, and at most that many decodes are queued.
+    """
+    workers = workers or DEFAULT_PREPARE_WORKERS
+    targets = {} # src -> prepared path (an image repeated in the timeline is prepared once)
+    for src in paths:
+        if src not in targets:
+            if cache_dir:
+                key = prepared_cache_key(src, size)
+                targets[src] = os.path.abspath(os.path.join(cache_dir, key[:2], f"{key}.jpg"))
+            else:
+                targets[src] = os.path.join(work_dir, f"{len(targets):06d}.jpg")
+    pending = [(src, dst) for src, dst in targets.items() if not os.path.exists(dst)]
+    hits = len(targets) - len(pending)
+    if hits:
+        log(f"INFO: {hits}/{len(targets)} imágenes ya preparadas en caché.")
+    count = [hits]
+
+    def finished(future=None):
+        if future is not None:
+            future.result() # Re-raises decode errors with the original message
+        count[0] += 1
+        if monitor:
+            monitor.prepared(count[0], len(targets))
+            monitor.check()
+
+    if len(pending) <= 1 or workers <= 1:
+        for src, dst in pending:
+            _prepare_cached(src, dst, size)
+            finished()
+    else:
+        window = workers * PREPARE_WINDOW_PER_WORKER
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+            in_flight = set()
+            try:
+                for src, dst in pending:
+                    in_flight.add(pool.submit(_prepare_cached, src, dst, size))
+                    if len(in_flight) >= window:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            finished(future)
+                for future in as_completed(in_flight):
+                    finished(future)
+            except BaseException:
+                for future in in_flight: # Don't wait for the queued ones on cancel/error
+                    future.cancel()
+                raise
+    for dst in targets.values():
+        if cache_dir:
+            os.utime(dst) # Recently used frames survive prune_prepared_cache
+    return [targets[src] for src in paths]
+
+
+def prune_prepared_cache(cache_dir: str, max_bytes: int = PREPARED_CACHE_MAX_BYTES):
+    """Deletes the least recently used prepared frames until the cache fits in `max_bytes`."""
+    prune_cache_dir(cache_dir, max_bytes)
+
+
+def _concat_path(path: str) -> str:
+    return "'" + path.replace('\\', '/').replace("'", "'\\''") + "'"
+
+
+def write_concat_list(entries: Sequence[Tuple[str, float]], list_path: str, hold_last: bool = True):
+    """ffconcat file showing each (image, seconds) in order."""
+    lines = ['ffconcat version 1.0']
+    for path, duration in entries:
+        lines.append(f"file {_concat_path(path)}")
+        lines.append(IMAGE_TIMESTAMP_OPTION) # Slides start on the millisecond, not on a 1/25 s tick
+        lines.append(f"duration {duration:.3f}")
+    if hold_last:
+        # The demuxer ignores the duration of the last entry unless the file is repeated
+        lines.append(f"file {_concat_path(entries[-1][0])}")
+        lines.append(IMAGE_TIMESTAMP_OPTION)
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def _fit_filter(width: int, height: int) -> str:
+    return (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p,settb=AVTB")
+
+
+def _run_ffmpeg(cmd: List[str], log: Callable[[str], None], monitor: Optional[RenderMonitor] = None,
+                task: Optional[str] = None):
+    """
+    Runs ffmpeg. With a monitor its `-progress` output (key=value blocks on
+    stdout) is reported as `task`, and the process can be killed by cancel().
+    """
+    log("INFO: " + ' '.join(cmd[:1] + [os.path.basename(c) if os.path.isabs(c) else c for c in cmd[1:]]))
+    if monitor:
+        monitor.check()
+    # -progress is a global option: right after the executable
+    cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    with tempfile.TemporaryFile() as stderr: # A file, so a chatty stderr can never block the stdout reader
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, stdin=subprocess.DEVNULL,
+                                text=True, errors='replace')
+        if monitor:
+            monitor.attach(proc)
+        try:
+            block = {}
+            for line in proc.stdout:
+                key, _, value = line.strip().partition('=')
+                block[key] = value
+                if key == 'progress': # Last line of every block ('continue' or 'end')
+                    if monitor and task:
+                        seconds = int(block.get('out_time_us', '0') or 0) / 1e6 \
+                            if block.get('out_time_us', 'N/A') != 'N/A' else 0.0
+                        monitor.encoded(task, seconds, int(block.get('frame', '0') or 0), value == 'end')
+                    block = {}
+            proc.wait()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            if monitor:
+                monitor.detach(proc)
+        if monitor:
+            monitor.check()
+        if proc.returncode != 0:
+            stderr.seek(0)
+            output = stderr.read().decode('utf-8', 'replace')
+            tail = '\n'.join(output.strip().splitlines()[-8:])
+            raise RenderError(f"ffmpeg terminó con código {proc.returncode}:\n{tail}")
+
+
+class SlideshowPlan(NamedTuple):
+    slides: List[Tuple[str, float]]  # (image, seconds), picture intro/outro included
+    video_intro: Optional[str]
+    intro_info: Optional[MediaInfo]
+    video_outro: Optional[str]
+    outro_info: Optional[MediaInfo]
+    width: int
+    height: int
+
+    @property
+    def total(self) -> float:
+        return ((self.intro_info.duration if self.intro_info else 0.0) + sum(d for _, d in self.slides)
+                + (self.outro_info.duration if self.outro_info else 0.0))
+
+
+def plan_slideshow(images: Sequence[str], durations: Sequence[float], intro: Optional[str] = None,
+                   outro: Optional[str] = None, size: Optional[Tuple[int, int]] = None,
+                   ffmpeg: Optional[str] = None) -> SlideshowPlan:
+    """Timeline of a slideshow: slides in order, video intro/outro and the output size."""
+    slides = [(path, float(d)) for path, d in zip(images, durations)]
+    if intro and is_image(intro):
+        slides.insert(0, (intro, IMAGE_INTRO_DURATION))
+    if outro and is_image(outro):
+        slides.append((outro, IMAGE_INTRO_DURATION))
+    video_intro = intro if is_video(intro) else None
+    video_outro = outro if is_video(outro) else None
+    if not slides and not video_intro and not video_outro:
+        raise RenderError("No hay contenido para crear el video.")
+
+    intro_info = probe_media(video_intro, ffmpeg) if video_intro else None
+    outro_info = probe_media(video_outro, ffmpeg) if video_outro else None
+    if size is None:
+        if slides:
+            with Image.open(slides[0][0]) as first:
+                size = first.size
+        else:
+            size = ((intro_info or outro_info).width, (intro_info or outro_info).height)
+    return SlideshowPlan(slides, video_intro, intro_info, video_outro, outro_info, *even_size(*size))
+
+
+def _clip_audio_filters(sources: Sequence[Tuple[Optional[str], float]]) -> List[str]:
+    """
+    Audio of the video intro/outro with silence under the slides. `sources`
+    holds (input label such as '[0:a]' or None for silence, seconds) per segment.
+    """
+    filters, labels = [], ''
+    for n, (label, duration) in enumerate(sources):
+        source = label if label else 'anullsrc=r=44100:cl=stereo,'
+        filters.append(f"{source}{AUDIO_FORMAT_FILTER},apad,atrim=duration={duration:.3f}[a{n}]")
+        labels += f"[a{n}]"
+    filters.append(f"{labels}concat=n={len(sources)}:v=0:a=1[aout]")
+    return filters
+
+
+def render_slideshow(images: Sequence[str], durations: Sequence[float], out_file: str,
+                     intro: Optional[str] = None, outro: Optional[str] = None,
+                     audio: Optional[str] = None, size: Optional[Tuple[int, int]] = None,
+                     fps: Optional[float] = None, workers: Optional[int] = None,
+                     segment_images: int = SEGMENT_IMAGES, use_cache: bool = True,
+                     log: Callable[[str], None] = print, monitor: Optional[RenderMonitor] = None) -> str:
+    """
+    Renders `images` (each shown durations[i] seconds) to `out_file`.
+
+    - intro/outro: a video (.mp4/.mov, scaled/letterboxed to the slideshow
+      size) or a picture shown IMAGE_INTRO_DURATION seconds.
+    - audio: looped/cut to the length of the video. Without it, the audio of
+      video intros/outros is kept and the slides are silent.
+    - size: output size; by default that of the first image (rounded to even).
+    - fps: None encodes one frame per slide (variable frame rate); a number
+      forces a constant (low) frame rate for players that need one.
+    - workers: segments encoded at once (see render_segmented). Short
+      slideshows without video intro/outro are rendered in a single ffmpeg pass.
+    - use_cache: keep the prepared frames in the user cache (see prepare_images).
+    - monitor: receives progress and can cancel (see RenderMonitor). A
+      cancelled or failed render removes its partial `out_file`.
+    """
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        raise RenderError("No se encontró ffmpeg (instala ffmpeg o imageio-ffmpeg).")
+    plan = plan_slideshow(images, durations, intro, outro, size, ffmpeg)
+    workers = workers or DEFAULT_SEGMENT_WORKERS
+    cache_dir = get_cache_dir(PREPARED_CACHE_NAME) if use_cache else None
+    try:
+        with tempfile.TemporaryDirectory(prefix='zorro_render_') as work_dir:
+            frames = prepare_images([path for path, _ in plan.slides], (plan.width, plan.height),
+                                    work_dir, cache_dir, log=log, monitor=monitor)
+            prepared = list(zip(frames, [d for _, d in plan.slides]))
+            # Video intros/outros are always their own segments: joining them by
+            # timestamp inside one filter graph loses the frame durations of the slides.
+            if plan.video_intro or plan.video_outro or (workers > 1 and len(prepared) > segment_images):
+                render_segmented(plan, prepared, out_file, work_dir, ffmpeg, audio, fps, workers,
+                                 segment_images, log, monitor)
+            else:
+                _render_single_pass(plan, prepared, out_file, work_dir, ffmpeg, audio, fps, log, monitor)
+    except BaseException:
+        if os.path.exists(out_file): # Half-written by ffmpeg; never leave it looking finished
+            os.remove(out_file)
+        raise
+    if use_cache:
+        prune_prepared_cache(cache_dir)
+    log(f"INFO: Video exportado ({plan.total:.1f}s, {plan.width}x{plan.height}): {out_file}")
+    return out_file
+
+
+def _render_single_pass(plan: SlideshowPlan, prepared, out_file, work_dir, ffmpeg, audio, fps, log, monitor=None):
+    """Slides and music in one ffmpeg command (timelines without video intro/outro)."""
+    list_path = os.path.join(work_dir, 'slides.ffconcat')
+    write_concat_list(prepared, list_path)
+    cmd = [ffmpeg, '-hide_banner', '-nostdin', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+    # The music is looped and cut as an input, so it never outlasts the last slide
+    if audio:
+        cmd += ['-stream_loop', '-1', '-t', f"{plan.total:.3f}", '-i', audio, '-map', '0:v', '-map', '1:a']
+    cmd += ['-vf', 'setsar=1,format=yuv420p' + (f",fps={fps}" if fps else '')]
+    cmd += VIDEO_CODEC_ARGS + ([] if fps else ['-fps_mode', 'vfr'])
+    cmd += (AUDIO_CODEC_ARGS if audio else []) + ['-movflags', '+faststart', out_file]
+    if monitor:
+        monitor.start_encoding([('video', plan.total)])
+    _run_ffmpeg(cmd, log, monitor, 'video')
+
+
+class Segment(NamedTuple):
+    path: str                 # Encoded video-only .mp4
+    duration: float           # Its place on the timeline
+    audio_source: Optional[str] # Intro/outro whose audio is kept when there is no music
+    cmd: List[str]
+
+
+def plan_segments(plan: SlideshowPlan, prepared, work_dir: str, ffmpeg: str, fps: Optional[float],
+                  segment_images: int, threads: int) -> List[Segment]:
+    """
+    Splits the timeline into independent segments: the intro, chunks of
+    `segment_images` slides and the outro. All use VIDEO_CODEC_ARGS and the
+    same size/pixel format/time base, so they can be joined without re-encoding.
+    """
+    def encode_cmd(inputs, video_filter, seg_path):
+        if fps:
+            video_filter += f",fps={fps}"
+        return ([ffmpeg, '-hide_banner', '-nostdin', '-y'] + inputs + ['-vf', video_filter, '-an']
+                + VIDEO_CODEC_ARGS + ['-threads', str(threads)] + ([] if fps else ['-fps_mode', 'vfr'])
+                + ['-video_track_timescale', '1000000', seg_path])
+
+    segments = []
+    if plan.video_intro:
+        seg_path = os.path.join(work_dir, 'seg_intro.mp4')
+        duration = plan.intro_info.duration
+        segments.append(Segment(seg_path, duration, plan.video_intro if plan.intro_info.has_audio else None,
+                                encode_cmd(['-i', plan.video_intro],
+                                           _fit_filter(plan.width, plan.height) + f",trim=duration={duration:.3f}", seg_path)))
+    chunks = [prepared[i:i + segment_images] for i in range(0, len(prepared), segment_images)]
+    for n, chunk in enumerate(chunks):
+        seg_path = os.path.join(work_dir, f"seg_{n:04d}.mp4")
+        list_path = os.path.join(work_dir, f"seg_{n:04d}.ffconcat")
+        # Only the very last slide needs its duration held; elsewhere the next segment's
+        # start (the `duration` of the joining list) ends it exactly on time. With a
+        # fixed fps every chunk needs its end, or the fps filter stops at its last slide.
+        is_last = n == len(chunks) - 1 and not plan.video_outro
+        write_concat_list(chunk, list_path, hold_last=is_last or bool(fps))
+        segments.append(Segment(seg_path, sum(d for _, d in chunk), None,
+                                encode_cmd(['-f', 'concat', '-safe', '0', '-i', list_path],
+                                           'setsar=1,format=yuv420p,settb=AVTB', seg_path)))
+    if plan.video_outro:
+        seg_path = os.path.join(work_dir, 'seg_outro.mp4')
+        duration = plan.outro_info.duration
+        segments.append(Segment(seg_path, duration, plan.video_outro if plan.outro_info.has_audio else None,
+                                encode_cmd(['-i', plan.video_outro],
+                                           _fit_filter(plan.width, plan.height) + f",trim=duration={duration:.3f}", seg_path)))
+    return segments
+
+
+def render_segmented(plan: SlideshowPlan, prepared, out_file: str, work_dir: str, ffmpeg: str,
+                     audio: Optional[str], fps: Optional[float], workers: int, segment_images: int,
+                     log: Callable[[str], None], monitor: Optional[RenderMonitor] = None):
+    """
+    Encodes the segments in parallel, then joins them with a stream copy and
+    muxes the audio once.
+
+    Every segment is encoded by its own ffmpeg process and up to `workers`
+    of them run at once; the Python threads here only wait for them (and
+    keep their handles, so an export can be stopped). x264 threads are split
+    between the processes so the machine is not oversubscribed.
+    """
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    segments = plan_segments(plan, prepared, work_dir, ffmpeg, fps, segment_images, threads)
+    log(f"INFO: {len(segments)} segmentos, {workers} codificadores en paralelo")
+    if monitor:
+        monitor.start_encoding([(seg.path, seg.duration) for seg in segments])
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segment") as pool:
+        futures = [pool.submit(_run_ffmpeg, seg.cmd, log, monitor, seg.path) for seg in segments]
+        try:
+            for future in as_completed(futures):
+                future.result() # First failure (or the cancel) is raised...
+        except BaseException:
+            for future in futures: # ...without starting the segments still queued
+                future.cancel()
+            raise
+
+    list_path = os.path.join(work_dir, 'segments.ffconcat')
+    lines = ['ffconcat version 1.0']
+    for seg in segments:
+        # `duration` places the next segment exactly, whatever the last frame's length
+        lines += [f"file {_concat_path(seg.path)}", f"duration {seg.duration:.6f}"]
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    cmd = [ffmpeg, '-hide_banner', '-nostdin', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+    keep_clip_audio = not audio and any(seg.audio_source for seg in segments)
+    if audio:
+        cmd += ['-stream_loop', '-1', '-t', f"{plan.total:.3f}", '-i', audio, '-map', '0:v', '-map', '1:a']
+    elif keep_clip_audio:
+        sources, next_input = [], 1
+        for seg in segments:
+            if seg.audio_source:
+                cmd += ['-i', seg.audio_source]
+                sources.append((f"[{next_input}:a]", seg.duration))
+                next_input += 1
+            else:
+                sources.append((None, seg.duration))
+        cmd += ['-filter_complex', ';'.join(_clip_audio_filters(sources)), '-map', '0:v', '-map', '[aout]']
+    cmd += ['-c:v', 'copy'] + (AUDIO_CODEC_ARGS if audio or keep_clip_audio else [])
+    cmd += ['-movflags', '+faststart', out_file]
+    if monitor:
+        monitor.joining()
+    _run_ffmpeg(cmd, log, monitor)
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 3:
+        print("Uso: python video_render.py <carpeta_con_imagenes> <salida.mp4> [segundos_por_imagen] [musica]")
+        sys.exit(1)
+    folder, output = sys.argv[1], sys.argv[2]
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+    pictures = sorted(os.path.join(folder, f) for f in os.listdir(folder) if is_image(f))
+    render_slideshow(pictures, [seconds] * len(pictures), output, audio=sys.argv[4] if len(sys.argv) > 4 else None)
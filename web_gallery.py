@@ -9,19 +9,50 @@ import time
 import socket
 import shutil
 import re # Para validaciones y extraccion de numeros
+import json
+import stat
+import mimetypes
+import uuid
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # <<< Imports para Flask >>>
 from flask import (
     Flask, request, redirect, url_for, send_from_directory,
-    abort, Response, flash, session, get_flashed_messages
+    abort, Response, flash, session, get_flashed_messages, jsonify
 )
 from flask_cors import CORS
 
+from scanner import scan_tree
+from censura import CENSURA_SUFFIX, SidecarMismatchError, censored_variant, is_sidecar, orphan_sidecars, pixelated_path, sidecar_path, sidecar_renames
+from group_manifest import GroupManifest, MANIFEST_FILENAME, MANIFEST_JSON_FILENAME
+from rename_planner import (
+    JOURNAL_FILENAME as RENAME_JOURNAL_FILENAME, RenamePlanError,
+    apply_renames, detect_padding, plan_renames, recover_pending_renames, sequential_names
+)
+
 # --- Configuración ---
 # ¡¡¡ASEGÚRATE DE QUE ESTA RUTA SEA CORRECTA!!!
 ROOT_GALLERY_DIR = Path("E:/El_Zorro/downloads") # <<< CAMBIA ESTO A TU RUTA EXACTA
 DEFAULT_PORT = 8088
 ALLOWED_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif')
+GROUP_MANIFEST_FILES = frozenset({MANIFEST_FILENAME, MANIFEST_JSON_FILENAME}) # Written by the downloader in every group
+GROUP_BOOKKEEPING_FILES = GROUP_MANIFEST_FILES | {RENAME_JOURNAL_FILENAME, MANIFEST_JSON_FILENAME + ".tmp"}
+SEQUENCE_STEM_RE = re.compile(r'^(\d+)(.*)$') # '0001' / '0001_pixelado' -> number + variant
+MERGE_COPY_WORKERS = 4 # Parallel copies when a merge crosses filesystems
+
+# --- Caché HTTP de imágenes ---
+# Las URLs de imagen llevan un parámetro ?v=<mtime-tamaño>. Si coincide con el archivo
+# actual, la respuesta se marca como 'immutable' (el nombre puede reutilizarse tras
+# reorganizar, pero la URL versionada cambia con el contenido).
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+DEFAULT_CACHE_CONTROL = 'public, max-age=3600'
+# Delegación de los bytes al servidor frontal: None (Flask sirve el archivo),
+# 'x-sendfile' (Apache/lighttpd) o 'x-accel' (nginx con un location 'internal'
+# que apunte a ROOT_GALLERY_DIR bajo X_ACCEL_PREFIX).
+SENDFILE_MODE = os.environ.get('ELZORRO_SENDFILE') or None
+X_ACCEL_PREFIX = os.environ.get('ELZORRO_ACCEL_PREFIX', '/_gallery_files/')
 
 # <<< Inicialización de Flask y CORS >>>
 app = Flask(__name__)
@@ -30,10 +61,13 @@ app.secret_key = b'_5#y2L"F4Q8z\n\xec]/' # Cambia esto por algo aleatorio y secr
 print("Flask-CORS inicializado. Secret Key configurada.")
 
 # Almacenamiento del estado
-current_selection = {
-    "creator_dir": None,
-    "creator_name": None
-}
+# El creador seleccionado vive en la sesión firmada de cada navegador (ver
+# get_current_creator), así que usuarios distintos pueden navegar creadores
+# distintos a la vez. Las rutas validadas se memorizan por creador/grupo.
+GROUP_PATH_CACHE_MAX_ENTRIES = 4096
+_creator_path_cache = {} # creator_name -> Path validada y resuelta
+_group_path_cache = OrderedDict() # (creator_name, group_name) -> Path validada
+_path_cache_lock = threading.Lock()
 
 # --- HTML Templates (Incluidos estilos y script básicos) ---
 HTML_STYLE_BLOCK = """
@@ -77,6 +111,7 @@ HTML_STYLE_BLOCK = """
     .image-item .item-info { padding: 5px 8px; font-size: 0.8em; color: #ccc; text-align: center; flex-grow: 1; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; } /* Info below image */
     .image-item .item-actions { position: absolute; bottom: 5px; left: 0; right: 0; text-align: center; background-color: rgba(42,42,42,0.8); padding: 2px 0; } /* Background for actions */
     .image-item .item-actions form { margin: 0; } /* No margin for inner form */
+    .image-item[draggable=true] { cursor: move; } .image-item.dragging { opacity: 0.4; }
     .breadcrumb { margin-bottom: 20px; font-size: 0.9em; text-align:center; }
     /* Lightbox styles */
     .lightbox { display: none; position: fixed; z-index: 999; padding-top: 50px; left: 0; top: 0; width: 100%; height: 100%; overflow: auto; background-color: rgba(0,0,0,0.9); justify-content: center; align-items: center; }
@@ -89,6 +124,10 @@ HTML_STYLE_BLOCK = """
     .controls-bar form input[type="text"], .controls-bar form input[type="submit"], .controls-bar form button { vertical-align: middle; }
     .merge-controls { margin-top: 20px; padding-top: 15px; border-top: 1px solid #444; }
     .merge-controls label { margin-right: 10px; }
+    /* Background job indicator */
+    .job-indicator { position: fixed; bottom: 20px; right: 20px; z-index: 1000; min-width: 260px; max-width: 400px; background-color: #2a2a2a; border: 1px solid #666; border-radius: 5px; padding: 10px 15px; font-size: 0.9em; box-shadow: 0 2px 8px rgba(0,0,0,0.6); }
+    .job-indicator progress { width: 100%; margin: 6px 0; }
+    .job-indicator .job-message { color: #888; font-size: 0.85em; overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
 </style>
 <script>
     function confirmDelete(message) { return confirm(message || '¿Estás seguro? Esta acción no se puede deshacer.'); }
@@ -143,10 +182,36 @@ HTML_STYLE_BLOCK = """
              });
         }
 
+        // Drag-and-drop ordering (Group Page)
+        const imageGrid = document.querySelector('#reorganizeForm .image-grid');
+        let draggedItem = null;
+        let orderChanged = false;
+        if (imageGrid) {
+            imageGrid.querySelectorAll('.image-item').forEach(item => {
+                item.setAttribute('draggable', 'true');
+                item.addEventListener('dragstart', event => { draggedItem = item; item.classList.add('dragging'); event.dataTransfer.effectAllowed = 'move'; });
+                item.addEventListener('dragend', () => { item.classList.remove('dragging'); draggedItem = null; });
+                item.addEventListener('dragover', event => {
+                    if (!draggedItem || draggedItem === item) return;
+                    event.preventDefault();
+                    const rect = item.getBoundingClientRect();
+                    const after = (event.clientX - rect.left) > rect.width / 2;
+                    imageGrid.insertBefore(draggedItem, after ? item.nextSibling : item);
+                    orderChanged = true;
+                });
+            });
+        }
+
         // Reorganize functionality script (Group Page)
         const reorganizeForm = document.getElementById('reorganizeForm');
         if (reorganizeForm) {
             reorganizeForm.addEventListener('submit', function(event) {
+                if (orderChanged) {
+                    // Send the dragged order as JSON and keep the number inputs consistent with it
+                    const order = Array.from(imageGrid.querySelectorAll('.image-item')).map(item => item.dataset.filename);
+                    document.getElementById('orderJson').value = JSON.stringify(order);
+                    imageGrid.querySelectorAll('.image-item input[type="number"]').forEach((input, i) => { input.value = i + 1; });
+                }
                 const numberInputs = document.querySelectorAll('.image-item input[type="number"]');
                 const numbers = Array.from(numberInputs).map(input => input.value.trim()); // Trim whitespace
                 const filenames = document.querySelectorAll('.image-item input[type="hidden"][name^="filename_"]');
@@ -195,6 +260,38 @@ HTML_STYLE_BLOCK = """
         }
 
     });
+
+    // Background job indicator: polls /jobs/<id> while ?job=<id> is in the URL
+    document.addEventListener('DOMContentLoaded', function() {
+        const jobId = new URLSearchParams(window.location.search).get('job');
+        if (!jobId) return;
+        const jobUrl = '/jobs/' + encodeURIComponent(jobId);
+        const box = document.createElement('div');
+        box.className = 'job-indicator';
+        box.innerHTML = '<div class="job-title">Procesando...</div><progress></progress><div class="job-message"></div>';
+        document.body.appendChild(box);
+        const title = box.querySelector('.job-title');
+        const bar = box.querySelector('progress');
+        const message = box.querySelector('.job-message');
+
+        function poll() {
+            fetch(jobUrl)
+                .then(response => response.json())
+                .then(job => {
+                    if (job.status === 'unknown') { title.textContent = 'Trabajo no encontrado.'; bar.remove(); return; }
+                    title.textContent = job.description + (job.status === 'queued' ? ' (en cola)' : '');
+                    if (job.total > 0) { bar.max = job.total; bar.value = job.done; } else { bar.removeAttribute('value'); }
+                    message.textContent = job.message || '';
+                    if (job.status === 'done' || job.status === 'error') {
+                        window.location = jobUrl + '/finish'; // Shows the job's messages as flashes
+                    } else {
+                        setTimeout(poll, 1000);
+                    }
+                })
+                .catch(() => setTimeout(poll, 3000));
+        }
+        poll();
+    });
 </script>
 """
 
@@ -264,7 +361,7 @@ HTML_GROUP_TEMPLATE = """
 <!DOCTYPE html><html lang="es"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0">
 <title>{group_name_display} - Galería El Zorro</title>{style_block}</head>
 <body><div class="container">
-    <div class="breadcrumb"><a href="{breadcrumb_link}">« Volver a '{creator_name}'</a></div>
+    <div class="breadcrumb"><a href="{breadcrumb_link}">« Volver a '{creator_name}'</a> | <a href="{censored_toggle_link}">{censored_toggle_text}</a></div>
     <h1>{group_name_display}</h1>{flash_messages}
     <div class="controls-bar">
         <form action="{rename_group_action}" method="post" style="display:inline;" onsubmit="var name=this.new_name.value; if(!name || !name.trim()) {{alert('Ingresa un nombre.'); return false;}} return confirm('¿Renombrar grupo a \\'' + name.trim() + '\\'?');">
@@ -279,8 +376,9 @@ HTML_GROUP_TEMPLATE = """
     <h2>Imágenes:</h2>
     <form id="reorganizeForm" action="{reorganize_action}" method="post">
         <div class="controls-bar">
+             <input type="hidden" name="order_json" id="orderJson" value="">
              <button type="submit">Guardar Orden</button>
-             <span class="info" style="margin-left: 15px;">Asigna números a las imágenes para cambiar su orden.</span>
+             <span class="info" style="margin-left: 15px;">Arrastra las imágenes o asigna números para cambiar su orden.</span>
         </div>
         <div class="image-grid">
             {image_items_html}
@@ -380,6 +478,142 @@ def get_safe_path(base_dir, *subdirs):
         return None
 
 
+# --- ETags de contenido ---
+_etag_lock = threading.Lock()
+_manifest_fingerprint_cache = OrderedDict() # carpeta de grupo -> (mtime_ns del manifest, {archivo: (sha1, tamaño, mtime_ns)})
+
+def file_version_token(stat_result):
+    """Token corto que cambia cuando cambia el archivo (mtime + tamaño)."""
+    return f"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"
+
+def get_image_etag(file_path, stat_result):
+    """Devuelve un ETag fuerte sin leer nunca los bytes de la imagen.
+
+    El descargador guarda el sha1 de cada archivo en el _manifest.json del grupo:
+    si tamaño y mtime siguen coincidiendo, ese hash es el ETag. Si no (archivos
+    anteriores al manifest, o modificados después), se usa mtime_ns + tamaño,
+    que también cambia con cualquier reescritura del archivo.
+    """
+    known = get_manifest_fingerprints(Path(file_path).parent).get(Path(file_path).name)
+    if known and known[1] == stat_result.st_size and known[2] == stat_result.st_mtime_ns:
+        return known[0]
+    return file_version_token(stat_result)
+
+def get_manifest_fingerprints(group_dir):
+    """filename -> (sha1, size, mtime_ns) from the group's _manifest.json, reloaded only when it changes."""
+    manifest_path = group_dir / MANIFEST_JSON_FILENAME
+    try:
+        version = manifest_path.stat().st_mtime_ns
+    except OSError:
+        return {}
+    key = str(group_dir)
+    with _etag_lock:
+        cached = _manifest_fingerprint_cache.get(key)
+        if cached and cached[0] == version:
+            _manifest_fingerprint_cache.move_to_end(key)
+            return cached[1]
+    fingerprints = {
+        entry['filename']: (entry['sha1'], entry.get('size'), entry.get('mtime_ns'))
+        for entry in GroupManifest.load(group_dir).files.values() if entry.get('sha1')
+    }
+    with _etag_lock:
+        _manifest_fingerprint_cache[key] = (version, fingerprints)
+        while len(_manifest_fingerprint_cache) > GROUP_PATH_CACHE_MAX_ENTRIES:
+            _manifest_fingerprint_cache.popitem(last=False)
+    return fingerprints
+
+def build_image_url(group_name, filename, stat_result=None, censored=False):
+    """URL absoluta de una imagen, versionada si se conoce su stat. `censored` pide su versión censurada."""
+    values = {'group_name_encoded': quote(group_name), 'filename': quote(filename)}
+    if stat_result is not None:
+        values['v'] = file_version_token(stat_result)
+    if censored:
+        values['censurado'] = '1'
+    return build_absolute_url('serve_image', **values)
+
+def get_censored_etag(file_path, variant_path, variant_stat):
+    """ETag de la versión censurada de una imagen.
+
+    Las generadas a partir del sidecar se llaman como su clave en la caché de
+    censura, que ya es un hash de (original, zonas, nivel); su mtime no sirve
+    porque la caché lo actualiza en cada uso. Un _pixelado antiguo es un archivo
+    más del grupo.
+    """
+    if variant_path.name == Path(pixelated_path(str(file_path))).name:
+        return get_image_etag(variant_path, variant_stat)
+    return f"c-{variant_path.stem}"
+
+# --- Estado por sesión y rutas memorizadas ---
+def get_creator_path(creator_name):
+    """Devuelve la ruta validada y resuelta de un creador, o None si no es válida.
+
+    El resultado se memoriza: get_safe_path (y sus resolve()) sólo se ejecuta la
+    primera vez. Las rutas que renombran/eliminan invalidan la caché.
+    """
+    with _path_cache_lock:
+        cached = _creator_path_cache.get(creator_name)
+    if cached is not None:
+        return cached
+    if not is_safe_name(creator_name):
+        return None
+    creator_path = get_safe_path(ROOT_GALLERY_DIR, creator_name)
+    if not creator_path or not creator_path.is_dir():
+        return None
+    creator_path = creator_path.resolve()
+    with _path_cache_lock:
+        _creator_path_cache[creator_name] = creator_path
+    return creator_path
+
+def get_group_path(creator_name, group_name):
+    """Ruta validada de un grupo dentro del creador (memorizada), o None.
+
+    No comprueba que el directorio exista: eso lo hace quien la usa con su propio
+    stat/is_dir, que de todos modos necesita.
+    """
+    key = (creator_name, group_name)
+    with _path_cache_lock:
+        cached = _group_path_cache.get(key)
+        if cached is not None:
+            _group_path_cache.move_to_end(key)
+            return cached
+    creator_path = get_creator_path(creator_name)
+    if creator_path is None:
+        return None
+    group_path = get_safe_path(creator_path, group_name)
+    if group_path is None:
+        return None
+    with _path_cache_lock:
+        _group_path_cache[key] = group_path
+        while len(_group_path_cache) > GROUP_PATH_CACHE_MAX_ENTRIES:
+            _group_path_cache.popitem(last=False)
+    return group_path
+
+def invalidate_path_cache(creator_name, group_name=None):
+    """Olvida las rutas memorizadas de un creador (o sólo de uno de sus grupos)."""
+    with _path_cache_lock:
+        if group_name is None:
+            _creator_path_cache.pop(creator_name, None)
+            for key in [k for k in _group_path_cache if k[0] == creator_name]:
+                del _group_path_cache[key]
+        else:
+            _group_path_cache.pop((creator_name, group_name), None)
+
+def get_current_creator():
+    """Devuelve (creator_name, creator_path) de la sesión actual, o (None, None)."""
+    creator_name = session.get('creator_name')
+    if not creator_name:
+        return None, None
+    creator_path = get_creator_path(creator_name)
+    if creator_path is None:
+        return creator_name, None
+    return creator_name, creator_path
+
+def set_current_creator(creator_name):
+    session['creator_name'] = creator_name
+
+def clear_current_creator():
+    session.pop('creator_name', None)
+
 def build_absolute_url(endpoint, **values):
     """Construye una URL absoluta HTTP usando el host de la solicitud."""
     # Needs request context
@@ -416,26 +650,102 @@ def find_empty_dirs(base_path):
          print(f"ERROR: find_empty_dirs - Invalid base_path: {base_path}, {e}"); return empty_dirs
 
 
-    for root, dirs, files in os.walk(base_path, topdown=False): # topdown=False visits children before parent
-        current_dir_path = Path(root)
-        try:
-             # Ensure the current directory being checked is inside the original base path
-             if not is_safe_path(base_resolved, current_dir_path):
-                  print(f"SECURITY WARNING: find_empty_dirs - Skipping path outside base: {current_dir_path}"); continue
-
-             # Check if the current directory (root) is empty after visiting its children
-             # It's empty if there are no files AND no subdirectories left (since we visited subdirs already)
-             if not os.listdir(root): # Check if directory is truly empty
-                  empty_dirs.append(current_dir_path)
+    try:
+        snapshot = scan_tree(base_path, keep_names=False)
+    except OSError as e:
+        print(f"ERROR: find_empty_dirs - Error scanning {base_path}: {e}"); return empty_dirs
 
-        except Exception as e:
-             print(f"ERROR: find_empty_dirs - Error processing dir {current_dir_path}: {e}"); continue
+    for dir_path in snapshot.empty_dirs(): # Deepest first
+        current_dir_path = Path(dir_path)
+        # Ensure the current directory being checked is inside the original base path
+        if not is_safe_path(base_resolved, current_dir_path):
+             print(f"SECURITY WARNING: find_empty_dirs - Skipping path outside base: {current_dir_path}"); continue
+        empty_dirs.append(current_dir_path)
 
 
-    # Filter out the base_path itself if it was accidentally included (shouldn't be with topdown=False unless base_path is empty initially)
+    # Filter out the base_path itself if it was accidentally included (empty_dirs() never returns the root)
     # and re-ensure they are still within the base_path for safety (belt and suspenders)
     return [d for d in empty_dirs if d != base_path and is_safe_path(base_resolved, d)]
 
+# --- Trabajos en segundo plano ---
+# Las operaciones largas (fusionar, eliminar creador, limpiar carpetas, reorganizar)
+# se ejecutan fuera de la petición. Todas modifican el árbol de descargas, así que el
+# ejecutor tiene un único hilo: los trabajos se aplican en serie, en orden de llegada.
+JOB_MAX_WORKERS = 1
+JOB_HISTORY_LIMIT = 200
+_job_executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="gallery-job")
+_jobs = OrderedDict() # job_id -> GalleryJob
+_jobs_lock = threading.Lock()
+
+class GalleryJob:
+    """Estado de un trabajo en segundo plano, consultable desde /jobs/<id>.
+
+    Los trabajos no tienen contexto de petición: en lugar de flash() acumulan
+    mensajes que /jobs/<id>/finish convierte en flashes al terminar.
+    """
+    def __init__(self, kind, description, redirect_url):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.description = description
+        self.redirect_url = redirect_url
+        self.status = "queued" # queued -> running -> done | error
+        self.done = 0
+        self.total = 0
+        self.message = ""
+        self.messages = [] # [(category, message)]
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def set_progress(self, done, total=None, message=None):
+        with self._lock:
+            self.done = done
+            if total is not None: self.total = total
+            if message is not None: self.message = message
+
+    def add_message(self, message, category="info"):
+        with self._lock:
+            self.messages.append((category, message))
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "id": self.id, "kind": self.kind, "description": self.description,
+                "status": self.status, "done": self.done, "total": self.total,
+                "message": self.message, "messages": list(self.messages),
+                "error": self.error, "redirect": self.redirect_url,
+                "elapsed": round((self.finished_at or time.time()) - self.created_at, 1),
+            }
+
+def _run_job(job, func, args):
+    with job._lock: job.status = "running"
+    try:
+        func(job, *args)
+        with job._lock: job.status = "done"
+    except Exception as e:
+        print(f"ERROR: Trabajo {job.kind} ({job.id}) falló: {e}")
+        traceback.print_exc()
+        with job._lock: job.status = "error"; job.error = str(e)
+    finally:
+        job.finished_at = time.time()
+
+def submit_job(kind, description, redirect_url, func, *args):
+    """Encola func(job, *args) y devuelve el GalleryJob inmediatamente."""
+    job = GalleryJob(kind, description, redirect_url)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        # Keep a bounded history: drop the oldest finished jobs
+        for old_id in [jid for jid, j in _jobs.items() if j.finished_at][:max(0, len(_jobs) - JOB_HISTORY_LIMIT)]:
+            del _jobs[old_id]
+    _job_executor.submit(_run_job, job, func, args)
+    print(f"INFO: Trabajo encolado: {kind} ({job.id}) - {description}")
+    return job
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
 # --- Rutas de Flask ---
 
 @app.route('/')
@@ -444,31 +754,27 @@ def index():
     flash_html = render_flash_messages()
     query = request.args.get('query', '').strip() # Get search query
 
-    if current_selection["creator_dir"]:
+    creator_name, creator_path_obj = get_current_creator()
+    if creator_name:
         # --- Mostrar Índice del Creador Seleccionado ---
-        creator_dir = current_selection["creator_dir"]
-        creator_name = current_selection["creator_name"]
-
         # Re-validar el directorio actual por si fue eliminado/movido externamente
-        creator_path_obj = get_safe_path(ROOT_GALLERY_DIR, creator_name) # Re-validate using safe path getter
         if not creator_path_obj or not creator_path_obj.is_dir():
-             print(f"ERROR: Estado inválido en index (dir: {creator_dir}). Reseteando.")
+             print(f"ERROR: Estado inválido en index (creador: {creator_name}). Reseteando.")
              flash('El directorio del creador ya no es válido.', 'error')
-             current_selection.update({"creator_dir": None, "creator_name": None})
+             invalidate_path_cache(creator_name)
+             clear_current_creator()
              # Redirecting back to index without creator will show the selector
              return redirect(url_for('index'))
 
-        # Update current_selection["creator_dir"] to the resolved safe path string
-        # This handles cases where the path might have been symbolic or slightly different before resolving
-        # Ensures consistency for future operations.
-        current_selection["creator_dir"] = str(creator_path_obj)
-
 
         group_items_html = []
         no_groups_msg = ""
         try:
             # Use the validated creator_path_obj for file system operations
-            all_group_paths = sorted([d for d in creator_path_obj.iterdir() if d.is_dir()])
+            # One parallel scandir pass: group folders plus their images (with size/mtime)
+            snapshot = scan_tree(creator_path_obj, extensions=ALLOWED_IMAGE_EXTENSIONS, max_depth=1)
+            group_snapshots = {Path(d.path): d for d in snapshot.children()}
+            all_group_paths = sorted(group_snapshots)
 
             # Apply search filter if query is present
             if query:
@@ -491,17 +797,14 @@ def index():
 
                     preview_img_src_abs = None
                     item_count = 0
-                    try:
-                         # Use iterdir for efficiency on potentially large directories
-                         image_files = [f.name for f in group_path_obj.iterdir() if f.is_file() and f.suffix.lower() in ALLOWED_IMAGE_EXTENSIONS]
-                         item_count = len(image_files)
-                         # Attempt numeric sort first, fallback to alphabetical
-                         try: images_sorted = sorted(image_files, key=lambda x: int(Path(x).stem))
-                         except (ValueError, TypeError): images_sorted = sorted(image_files)
-                         if images_sorted:
-                             # Need to encode group_name and filename for the URL
-                             preview_img_src_abs = build_absolute_url('serve_image', group_name_encoded=quote(group_name), filename=quote(images_sorted[0]))
-                    except OSError as e: print(f"WARN: Leyendo grupo {group_path_obj} para preview: {e}"); pass # Silently skip preview on error
+                    image_files = group_snapshots[group_path_obj].files
+                    item_count = len(image_files)
+                    # Attempt numeric sort first, fallback to alphabetical
+                    try: images_sorted = sorted(image_files, key=lambda f: int(Path(f.name).stem))
+                    except (ValueError, TypeError): images_sorted = sorted(image_files)
+                    if images_sorted:
+                        # Versioned URL so the browser can cache the preview as immutable (the scan already has size/mtime)
+                        preview_img_src_abs = build_image_url(group_name, images_sorted[0].name, images_sorted[0])
 
                     preview_html = "<div class='no-preview'>Sin Previa</div>"
                     if preview_img_src_abs: preview_html = f'<img src="{preview_img_src_abs}" alt="Previa de {group_name}" loading="lazy">'
@@ -530,7 +833,7 @@ def index():
                         f'<div class="group-item">{merge_checkbox}{count_html}<a href="{group_link}">{preview_html}<span>{group_name}</span></a>{actions_html}</div>'
                     )
         except OSError as e:
-            print(f"ERROR: Leyendo {creator_path_obj}: {e}. Reseteando."); current_selection.update({"creator_dir": None, "creator_name": None}); flash(f"Error al leer grupos de '{creator_name}'.", "error"); return redirect(url_for('index'))
+            print(f"ERROR: Leyendo {creator_path_obj}: {e}. Reseteando."); invalidate_path_cache(creator_name); clear_current_creator(); flash(f"Error al leer grupos de '{creator_name}'.", "error"); return redirect(url_for('index'))
 
         # --- URLs for creator-level actions ---
         rename_creator_action = build_absolute_url('rename_creator')
@@ -588,44 +891,78 @@ def load_creator():
     if not creator_encoded: abort(400, description="Falta parámetro 'creator'.")
     creator_name = unquote(creator_encoded)
     if not is_safe_name(creator_name): flash("Nombre de creador inválido.", "error"); return redirect(url_for('index'))
-    # Use get_safe_path to validate that it's DENTRO de ROOT_GALLERY_DIR
-    potential_path_obj = get_safe_path(ROOT_GALLERY_DIR, creator_name)
+    # Validate that it's DENTRO de ROOT_GALLERY_DIR (always fresh: the folder may be new)
+    invalidate_path_cache(creator_name)
+    potential_path_obj = get_creator_path(creator_name)
 
-    if potential_path_obj and potential_path_obj.is_dir():
-        # Store the validated, resolved path string
-        current_selection.update({"creator_dir": str(potential_path_obj.resolve()), "creator_name": creator_name})
+    if potential_path_obj:
+        # Only the name goes into the session; the validated path is memoized server-side
+        set_current_creator(creator_name)
         print(f"INFO: Cargado creador: {creator_name}"); flash(f"Galería '{creator_name}' cargada.", "success")
         return redirect(url_for('index'))
     else: print(f"ERROR: Intento de carga inválida: {potential_path_obj}"); flash(f"Directorio '{creator_name}' no encontrado/inválido.", "error"); return redirect(url_for('index'))
 
 @app.route('/select')
 def select_creator():
-    current_selection.update({"creator_dir": None, "creator_name": None}); print("INFO: Selección reseteada."); flash("Selección de creador reiniciada.", "success"); return redirect(url_for('index'))
+    clear_current_creator(); print("INFO: Selección reseteada."); flash("Selección de creador reiniciada.", "success"); return redirect(url_for('index'))
+
+# --- Rutas de Trabajos en segundo plano ---
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Estado JSON de un trabajo (lo consulta el indicador de la interfaz)."""
+    job = get_job(job_id)
+    if not job: return jsonify({"id": job_id, "status": "unknown", "error": "Trabajo no encontrado."}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/finish')
+def job_finish(job_id):
+    """Convierte los mensajes del trabajo terminado en flashes y redirige a su destino."""
+    job = get_job(job_id)
+    if not job: flash("El trabajo ya no existe (puede que el servidor se reiniciara).", "error"); return redirect(url_for('index'))
+    info = job.to_dict()
+    if info["status"] in ("queued", "running"): return redirect(url_for('index', job=job_id))
+    for category, message in info["messages"]: flash(message, category)
+    if info["status"] == "error": flash(f"Error en '{info['description']}': {info['error']}", "error")
+    return redirect(info["redirect"] or url_for('index'))
 
 # --- Ruta para mostrar Grupo ---
 @app.route('/group/<path:group_name_encoded>')
 def show_group(group_name_encoded):
     flash_html = render_flash_messages()
-    if not current_selection["creator_dir"]: flash("Selecciona creador primero.", "error"); return redirect(url_for('index'))
+    creator_name, creator_dir = get_current_creator()
+    if not creator_dir: flash("Selecciona creador primero.", "error"); return redirect(url_for('index'))
 
     group_name = unquote(group_name_encoded)
-    creator_dir = current_selection["creator_dir"]
-    creator_name = current_selection["creator_name"]
+    censored = request.args.get('censurado') == '1' # Muestra las versiones censuradas (sidecars .censura.json)
 
     if not is_safe_name(group_name): abort(400, "Nombre de grupo inválido.")
 
     # Get the validated group path relative to the creator directory
-    group_dir_path_obj = get_safe_path(creator_dir, group_name)
+    group_dir_path_obj = get_group_path(creator_name, group_name)
 
     # Re-validar si el grupo existe and is a directory within the validated creator_dir
     if not group_dir_path_obj or not group_dir_path_obj.is_dir(): flash(f"Grupo '{group_name}' no encontrado.", "error"); return redirect(url_for('index'))
 
+    # A reorder interrupted by a crash is rolled forward before listing the images
+    if (group_dir_path_obj / RENAME_JOURNAL_FILENAME).exists():
+        try:
+            recovered = recover_pending_renames(group_dir_path_obj, on_finish=manifest_follower(group_dir_path_obj))
+            if recovered: flash(f"Se completó un reordenado interrumpido ({recovered} renombrados pendientes).", "success")
+        except (OSError, RenamePlanError) as e:
+            print(f"ERROR: Recuperando reordenado en {group_dir_path_obj}: {e}"); flash(f"No se pudo completar un reordenado interrumpido: {e}", "error")
+
 
     image_items_html = []
     no_images_msg = ""
     try:
-        # Get only image files using the validated group path
-        image_files = [f.name for f in group_dir_path_obj.iterdir() if f.is_file() and f.suffix.lower() in ALLOWED_IMAGE_EXTENSIONS]
+        # Get only image files using the validated group path.
+        # scandir keeps the stat results, reused to version the image URLs.
+        image_stats = {}
+        with os.scandir(group_dir_path_obj) as entries:
+            for entry in entries:
+                if entry.is_file() and Path(entry.name).suffix.lower() in ALLOWED_IMAGE_EXTENSIONS:
+                    image_stats[entry.name] = entry.stat()
+        image_files = list(image_stats)
         # Attempt numeric sort first, fallback to alphabetical
         try: image_files_sorted = sorted(image_files, key=lambda x: int(Path(x).stem))
         except (ValueError, TypeError): image_files_sorted = sorted(image_files) # Fallback a orden alfabético
@@ -639,7 +976,7 @@ def show_group(group_name_encoded):
                      continue # Seguridad
 
                 encoded_img_file = quote(img_file)
-                img_src_abs = build_absolute_url('serve_image', group_name_encoded=group_name_encoded, filename=encoded_img_file)
+                img_src_abs = build_image_url(group_name, img_file, image_stats.get(img_file), censored)
                 alt_text = f"{img_file} (Grupo: {group_name})"
                 delete_action = build_absolute_url('delete_image', group_name_encoded=group_name_encoded, filename=encoded_img_file)
 
@@ -657,7 +994,7 @@ def show_group(group_name_encoded):
                 </div>"""
                 # Add image filename below the image
                 image_items_html.append(
-                    f'<div class="image-item"><img src="{img_src_abs}" alt="{alt_text}" loading="lazy" onclick="openLightbox(this)"><div class="item-info">{img_file}</div>{actions_html}</div>'
+                    f'<div class="image-item" data-filename="{img_file}"><img src="{img_src_abs}" alt="{alt_text}" loading="lazy" onclick="openLightbox(this)"><div class="item-info">{img_file}</div>{actions_html}</div>'
                 )
     except OSError as e: print(f"ERROR leyendo grupo '{group_name}': {e}"); flash(f"Error al leer grupo '{group_name}'.", "error"); return redirect(url_for('index'))
 
@@ -665,6 +1002,8 @@ def show_group(group_name_encoded):
     rename_group_action = build_absolute_url('rename_group', group_name_encoded=group_name_encoded)
     delete_group_action = build_absolute_url('delete_group', group_name_encoded=group_name_encoded)
     reorganize_action = build_absolute_url('reorganize_group', group_name_encoded=group_name_encoded)
+    if censored: censored_toggle_link, censored_toggle_text = build_absolute_url('show_group', group_name_encoded=group_name_encoded), "Ver originales"
+    else: censored_toggle_link, censored_toggle_text = build_absolute_url('show_group', group_name_encoded=group_name_encoded, censurado='1'), "Ver censuradas"
 
 
     html_content = HTML_GROUP_TEMPLATE.format(
@@ -672,14 +1011,16 @@ def show_group(group_name_encoded):
         image_items_html="\n".join(image_items_html), no_images_message=no_images_msg,
         creator_name=creator_name or "", breadcrumb_link=build_absolute_url('index'),
         rename_group_action=rename_group_action, delete_group_action=delete_group_action,
-        reorganize_action=reorganize_action
+        reorganize_action=reorganize_action, censored_toggle_link=censored_toggle_link,
+        censored_toggle_text=censored_toggle_text
     )
     return Response(html_content, mimetype='text/html')
 
 # --- Ruta para servir Imágenes ---
 @app.route('/<path:group_name_encoded>/<path:filename>')
 def serve_image(group_name_encoded, filename):
-    if not current_selection["creator_dir"]: abort(404, description="No hay creador seleccionado.")
+    creator_name, creator_dir = get_current_creator()
+    if not creator_dir: abort(404, description="No hay creador seleccionado.")
     group_name = unquote(group_name_encoded); filename_decoded = unquote(filename)
 
     # Validate group name
@@ -689,15 +1030,70 @@ def serve_image(group_name_encoded, filename):
     filename_path = Path(filename_decoded)
     if not is_safe_name(filename_path.name) or filename_path.suffix.lower() not in ALLOWED_IMAGE_EXTENSIONS: abort(400, "Nombre/tipo de archivo inválido.")
 
-    # Obtener ruta segura al directorio del grupo
-    group_dir_path_obj = get_safe_path(current_selection["creator_dir"], group_name)
-    if not group_dir_path_obj or not group_dir_path_obj.is_dir(): abort(404, f"Grupo '{group_name}' no encontrado.")
+    # Obtener ruta segura (memorizada) al directorio del grupo; el stat del archivo
+    # cubre también el caso de que el grupo ya no exista.
+    group_dir_path_obj = get_group_path(creator_name, group_name)
+    if not group_dir_path_obj: abort(404, f"Grupo '{group_name}' no encontrado.")
+
+    file_path = group_dir_path_obj / filename_path.name
+    try:
+        file_stat = file_path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        abort(404, f"Archivo '{filename_decoded}' no encontrado en '{group_name}'.")
+    except OSError as e: print(f"ERROR sirviendo {filename_decoded}: {e}"); abort(500, "Error interno.")
+    if not stat.S_ISREG(file_stat.st_mode): abort(404, f"Archivo '{filename_decoded}' no encontrado en '{group_name}'.")
+
+    # ?censurado=1: la versión censurada, generada desde el sidecar (o de la caché) sin tocar la original.
+    # Una imagen sin censura se sirve tal cual.
+    variant = None
+    if request.args.get('censurado') == '1':
+        try:
+            variant = censored_variant(str(file_path))
+        except SidecarMismatchError as e: print(f"ERROR censurando {file_path}: {e}"); abort(409, str(e))
+        except (OSError, ValueError) as e: print(f"ERROR censurando {file_path}: {e}"); abort(500, "No se pudo censurar la imagen.")
+        if variant == str(file_path): variant = None # Sidecar sin zonas
+
+    try:
+        if variant:
+            serve_path = Path(variant); serve_stat = serve_path.stat()
+            etag = get_censored_etag(file_path, serve_path, serve_stat)
+        else:
+            serve_path, serve_stat = file_path, file_stat
+            etag = get_image_etag(file_path, file_stat)
+    except OSError as e: print(f"ERROR calculando ETag de {file_path}: {e}"); abort(500, "Error interno.")
+
+    # Versioned URLs never change content, so the browser may keep them forever
+    # (not censored ones: editing the zones changes them without changing the original)
+    requested_version = request.args.get('v')
+    if not variant and requested_version and requested_version == file_version_token(file_stat):
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        cache_control = DEFAULT_CACHE_CONTROL
+
+    # Revalidation is answered from the ETag alone, without touching the image data
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
 
-    # Use send_from_directory for serving the file safely
     try:
-        # send_from_directory handles path validation internally, ensuring 'filename' is within 'directory'.
-        response = send_from_directory(directory=str(group_dir_path_obj), path=filename_decoded, conditional=True)
-        response.headers['Cache-Control'] = 'public, max-age=3600'; return response
+        # The render cache of censura.py lives outside ROOT_GALLERY_DIR: nginx cannot map it, Flask sends it
+        in_gallery = serve_path.parent == group_dir_path_obj
+        if SENDFILE_MODE == 'x-accel' and in_gallery:
+            # nginx serves the bytes from an internal location mapped to ROOT_GALLERY_DIR
+            relative_path = serve_path.relative_to(creator_dir.parent)
+            response = Response(mimetype=mimetypes.guess_type(serve_path.name)[0] or 'application/octet-stream')
+            response.headers['X-Accel-Redirect'] = X_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative_path.as_posix())
+        elif SENDFILE_MODE == 'x-sendfile':
+            response = Response(mimetype=mimetypes.guess_type(serve_path.name)[0] or 'application/octet-stream')
+            response.headers['X-Sendfile'] = str(serve_path.resolve())
+        else:
+            # send_from_directory handles path validation internally, ensuring 'filename' is within 'directory'.
+            response = send_from_directory(directory=str(serve_path.parent), path=serve_path.name, conditional=True, etag=etag)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
     except FileNotFoundError: abort(404, f"Archivo '{filename_decoded}' no encontrado en '{group_name}'.")
     except Exception as e: print(f"ERROR sirviendo {filename_decoded}: {e}"); abort(500, "Error interno.")
 
@@ -706,34 +1102,41 @@ def serve_image(group_name_encoded, filename):
 
 @app.route('/delete_image/<path:group_name_encoded>/<path:filename>', methods=['POST'])
 def delete_image(group_name_encoded, filename):
-    if not current_selection["creator_dir"]: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
+    creator_name, creator_dir = get_current_creator()
+    if not creator_dir: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
     group_name = unquote(group_name_encoded); filename_decoded = unquote(filename)
 
     if not is_safe_name(group_name): flash("Nombre de grupo inválido.", "error"); return redirect(url_for('index'))
     if not is_safe_name(filename_decoded) or Path(filename_decoded).suffix.lower() not in ALLOWED_IMAGE_EXTENSIONS: flash("Nombre/tipo de archivo inválido.", "error"); return redirect(url_for('index'))
 
-    img_path = get_safe_path(current_selection["creator_dir"], group_name, filename_decoded)
+    img_path = get_safe_path(creator_dir, group_name, filename_decoded)
 
     if not img_path or not img_path.is_file(): flash(f"Imagen '{filename_decoded}' no encontrada.", "error")
     else:
         try: os.remove(img_path); print(f"INFO: Eliminada: {img_path}"); flash(f"Imagen '{filename_decoded}' eliminada.", "success")
         except OSError as e: print(f"ERROR: Eliminando {img_path}: {e}"); flash(f"Error al eliminar '{filename_decoded}': {e}", "error")
         except Exception as e: print(f"ERROR: Eliminando {img_path}: {e}"); flash("Error inesperado.", "error")
+        # Its censor sidecar goes too: left behind, the next image with this name would inherit the zones
+        sidecar = Path(sidecar_path(str(img_path)))
+        if not img_path.exists() and sidecar.exists():
+            try: os.remove(sidecar); print(f"INFO: Eliminado: {sidecar}")
+            except OSError as e: print(f"ERROR: Eliminando {sidecar}: {e}"); flash(f"No se pudo eliminar la censura de '{filename_decoded}': {e}", "error")
 
     # Redirigir de vuelta al grupo
     return redirect(url_for('show_group', group_name_encoded=group_name_encoded))
 
 @app.route('/delete_group/<path:group_name_encoded>', methods=['POST'])
 def delete_group(group_name_encoded):
-    if not current_selection["creator_dir"]: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
+    creator_name, creator_dir = get_current_creator()
+    if not creator_dir: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
     group_name = unquote(group_name_encoded)
     if not is_safe_name(group_name): flash("Nombre de grupo inválido.", "error"); return redirect(url_for('index'))
 
-    group_path = get_safe_path(current_selection["creator_dir"], group_name)
+    group_path = get_group_path(creator_name, group_name)
 
     if not group_path or not group_path.is_dir(): flash(f"Grupo '{group_name}' no encontrado.", "error")
     else:
-        try: shutil.rmtree(group_path); print(f"INFO: Grupo eliminado: {group_path}"); flash(f"Grupo '{group_name}' eliminado.", "success")
+        try: shutil.rmtree(group_path); invalidate_path_cache(creator_name, group_name); print(f"INFO: Grupo eliminado: {group_path}"); flash(f"Grupo '{group_name}' eliminado.", "success")
         except OSError as e: print(f"ERROR: Eliminando {group_path}: {e}"); flash(f"Error al eliminar '{group_name}': {e}", "error")
         except Exception as e: print(f"ERROR: Eliminando {group_path}: {e}"); flash("Error inesperado.", "error")
 
@@ -742,32 +1145,48 @@ def delete_group(group_name_encoded):
 
 @app.route('/delete_creator', methods=['POST'])
 def delete_creator():
-    if not current_selection["creator_dir"]: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
-    creator_dir = current_selection["creator_dir"]; creator_name = current_selection["creator_name"]
+    creator_name, creator_dir = get_current_creator()
+    if not creator_dir: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
 
     # Re-validar que es hijo directo de ROOT for extra safety, though get_safe_path should cover this
     try:
          creator_path_obj = Path(creator_dir) # Use Path object
          # Resolve both paths before comparing parent
          if not creator_path_obj.resolve().parent == ROOT_GALLERY_DIR.resolve():
-              flash("Error de seguridad grave: Intento de eliminar directorio fuera del ROOT.", "error"); print(f"SECURITY ERROR: Intento de eliminar {creator_dir}"); current_selection.update({"creator_dir": None, "creator_name": None}); return redirect(url_for('index'))
+              flash("Error de seguridad grave: Intento de eliminar directorio fuera del ROOT.", "error"); print(f"SECURITY ERROR: Intento de eliminar {creator_dir}"); invalidate_path_cache(creator_name); clear_current_creator(); return redirect(url_for('index'))
          if not creator_path_obj.is_dir(): # Also check if it's actually a directory
-              flash("Error: El directorio del creador no es válido.", "error"); print(f"SECURITY ERROR: Creador dir no es directorio: {creator_dir}"); current_selection.update({"creator_dir": None, "creator_name": None}); return redirect(url_for('index'))
+              flash("Error: El directorio del creador no es válido.", "error"); print(f"SECURITY ERROR: Creador dir no es directorio: {creator_dir}"); invalidate_path_cache(creator_name); clear_current_creator(); return redirect(url_for('index'))
 
     except Exception as e:
-         flash("Error de seguridad al validar ruta.", "error"); print(f"SECURITY ERROR: Excepción al validar {creator_dir}: {e}"); current_selection.update({"creator_dir": None, "creator_name": None}); return redirect(url_for('index'))
+         flash("Error de seguridad al validar ruta.", "error"); print(f"SECURITY ERROR: Excepción al validar {creator_dir}: {e}"); invalidate_path_cache(creator_name); clear_current_creator(); return redirect(url_for('index'))
+
 
+    # The selection is released right away; the tree is removed in the background
+    invalidate_path_cache(creator_name); clear_current_creator()
+    job = submit_job('delete_creator', f"Eliminando creador '{creator_name}'", url_for('index'),
+                     _delete_creator_job, creator_path_obj, creator_name)
+    return redirect(url_for('index', job=job.id))
 
+def _delete_creator_job(job, creator_dir, creator_name):
+    """Elimina el directorio del creador grupo a grupo, informando del progreso."""
     try:
-        shutil.rmtree(creator_dir); print(f"INFO: Creador eliminado: {creator_dir}"); flash(f"Creador '{creator_name}' eliminado.", "success"); current_selection.update({"creator_dir": None, "creator_name": None}); return redirect(url_for('index'))
-    except OSError as e: print(f"ERROR: Eliminando {creator_dir}: {e}"); flash(f"Error al eliminar '{creator_name}': {e}", "error"); return redirect(url_for('index')) # Volver al índice del creador si falla
-    except Exception as e: print(f"ERROR: Eliminando {creator_dir}: {e}"); flash("Error inesperado.", "error"); return redirect(url_for('index'))
+        children = list(creator_dir.iterdir())
+        job.set_progress(0, len(children) + 1, f"Eliminando {len(children)} elementos...")
+        for i, child in enumerate(children, start=1):
+            if child.is_dir() and not child.is_symlink(): shutil.rmtree(child)
+            else: child.unlink()
+            job.set_progress(i, message=f"Eliminado '{child.name}'")
+        os.rmdir(creator_dir)
+        job.set_progress(len(children) + 1)
+        print(f"INFO: Creador eliminado: {creator_dir}"); job.add_message(f"Creador '{creator_name}' eliminado.", "success")
+    except OSError as e: print(f"ERROR: Eliminando {creator_dir}: {e}"); job.add_message(f"Error al eliminar '{creator_name}': {e}", "error")
+    finally: invalidate_path_cache(creator_name)
 
 @app.route('/rename_group/<path:group_name_encoded>', methods=['POST'])
 def rename_group(group_name_encoded):
-    if not current_selection["creator_dir"]: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
+    creator_name, creator_dir = get_current_creator()
+    if not creator_dir: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
     old_group_name = unquote(group_name_encoded); new_group_name = request.form.get('new_name', '').strip()
-    creator_dir = current_selection["creator_dir"]
 
     redirect_url_on_fail = url_for('show_group', group_name_encoded=group_name_encoded) # Where to go back if it fails
 
@@ -787,7 +1206,7 @@ def rename_group(group_name_encoded):
     if new_path.exists() and new_path != old_path: flash(f"Ya existe '{new_group_name}'.", "error"); return redirect(redirect_url_on_fail)
 
     try:
-        os.rename(old_path, new_path); print(f"INFO: Renombrado: {old_path} -> {new_path}"); flash(f"Renombrado a '{new_group_name}'.", "success")
+        os.rename(old_path, new_path); invalidate_path_cache(creator_name, old_group_name); print(f"INFO: Renombrado: {old_path} -> {new_path}"); flash(f"Renombrado a '{new_group_name}'.", "success")
         # Redirect to the *new* name's URL
         return redirect(url_for('show_group', group_name_encoded=quote(new_group_name)))
     except OSError as e: print(f"ERROR: Renombrando {old_path}: {e}"); flash(f"Error al renombrar: {e}", "error"); return redirect(redirect_url_on_fail)
@@ -795,9 +1214,8 @@ def rename_group(group_name_encoded):
 
 @app.route('/rename_creator', methods=['POST'])
 def rename_creator():
-    if not current_selection["creator_dir"]: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
-    old_creator_dir = current_selection["creator_dir"]
-    old_creator_name = current_selection["creator_name"]
+    old_creator_name, old_creator_dir = get_current_creator()
+    if not old_creator_dir: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
     new_creator_name = request.form.get('new_name', '').strip()
 
     redirect_url_on_fail = url_for('index') # Always redirect to index if creator rename fails
@@ -815,7 +1233,7 @@ def rename_creator():
 
     if not old_creator_path_obj or not old_creator_path_obj.is_dir():
          flash(f"Directorio original del creador '{old_creator_name}' no encontrado o inválido.", "error");
-         current_selection.update({"creator_dir": None, "creator_name": None}); # Reset selection if original path is bad
+         invalidate_path_cache(old_creator_name); clear_current_creator(); # Reset selection if original path is bad
          return redirect(url_for('index'))
 
     if not new_creator_path_obj: flash("Nueva ruta de creador inválida/insegura.", "error"); return redirect(redirect_url_on_fail)
@@ -826,8 +1244,9 @@ def rename_creator():
 
     try:
         os.rename(old_creator_path_obj, new_creator_path_obj); print(f"INFO: Renombrado creador: {old_creator_path_obj} -> {new_creator_path_obj}"); flash(f"Creador renombrado a '{new_creator_name}'.", "success")
-        # Update session with the new path and name (store the resolved path string)
-        current_selection.update({"creator_dir": str(new_creator_path_obj.resolve()), "creator_name": new_creator_name})
+        # Update session with the new name; the old memoized paths are stale now
+        invalidate_path_cache(old_creator_name); invalidate_path_cache(new_creator_name)
+        set_current_creator(new_creator_name)
         return redirect(url_for('index')) # Redirect to the newly named creator's index
     except OSError as e: print(f"ERROR: Renombrando creador {old_creator_path_obj}: {e}"); flash(f"Error al renombrar creador: {e}", "error"); return redirect(redirect_url_on_fail)
     except Exception as e: print(f"ERROR: Renombrando creador {old_creator_path_obj}: {e}"); flash("Error inesperado.", "error"); return redirect(redirect_for('index')) # Redirect to index on unexpected error
@@ -836,118 +1255,150 @@ def rename_creator():
 # --- FEATURE: Reorganize Images ---
 @app.route('/reorganize_group/<path:group_name_encoded>', methods=['POST'])
 def reorganize_group(group_name_encoded):
-    if not current_selection["creator_dir"]: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
+    creator_name, creator_dir = get_current_creator()
+    if not creator_dir: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
     group_name = unquote(group_name_encoded)
 
     redirect_url_on_fail = url_for('show_group', group_name_encoded=group_name_encoded)
 
     if not is_safe_name(group_name): flash("Nombre de grupo inválido.", "error"); return redirect(url_for('index'))
 
-    group_dir_path = get_safe_path(current_selection["creator_dir"], group_name)
+    group_dir_path = get_group_path(creator_name, group_name)
     if not group_dir_path or not group_dir_path.is_dir(): flash(f"Grupo '{group_name}' no encontrado.", "error"); return redirect(url_for('index'))
 
-    # Get data from the form
-    # The form sends input fields named like "order_encodedfilename" and "filename_encodedfilename"
+    # Get data from the form.
+    # Drag-and-drop sends the full order as JSON in "order_json"; otherwise the form sends
+    # input fields named like "order_encodedfilename" and "filename_encodedfilename"
     order_data = []
-    for key, value in request.form.items():
-        if key.startswith('order_'):
-            try:
-                # Extract the original encoded filename from the input name
-                encoded_filename = key[len('order_'):]
-                # Get the desired number
-                order_num_str = value.strip()
-                if not order_num_str: raise ValueError("Empty number")
-                order_num = int(order_num_str)
-
-                # Get the actual filename from the corresponding hidden input
-                original_encoded_filename = request.form.get(f'filename_{encoded_filename}')
-
-                if not original_encoded_filename or original_encoded_filename != encoded_filename:
-                     # Basic consistency check - something is wrong with the form data
-                     print(f"WARN: reorganize_group - Data mismatch for key {key}");
-                     flash("Error interno: Datos del formulario inconsistentes.", "error")
-                     return redirect(redirect_url_on_fail) # Abort early on bad form data
-
-                # Decode the original filename for validation and processing
-                original_filename = unquote(original_encoded_filename)
-
-                # Validate filename and order number
-                if not is_safe_name(original_filename) or Path(original_filename).suffix.lower() not in ALLOWED_IMAGE_EXTENSIONS:
-                     print(f"WARN: reorganize_group - Unsafe or invalid filename in form: {original_filename}");
-                     flash(f"Nombre de archivo inválido en el formulario: {original_filename}", "error")
-                     return redirect(redirect_url_on_fail) # Abort early
-                if order_num <= 0:
-                     flash(f"Número de orden inválido ({order_num}) para {original_filename}.", "error");
-                     return redirect(redirect_url_on_fail) # Abort early
-
-                order_data.append((order_num, original_filename))
-            except ValueError:
-                flash(f"Número de orden inválido ('{value}') para un archivo.", "error"); return redirect(redirect_url_on_fail)
-            except Exception as e:
-                print(f"ERROR: reorganize_group - Processing form data for key {key}: {e}");
-                flash("Error procesando datos del formulario.", "error"); return redirect(redirect_url_on_fail)
+    order_json = request.form.get('order_json', '').strip()
+    if order_json:
+        try:
+            ordered_filenames = json.loads(order_json)
+            if not isinstance(ordered_filenames, list) or not all(isinstance(n, str) for n in ordered_filenames): raise ValueError("Not a list of names")
+        except ValueError:
+            flash("Error interno: Orden de arrastre inválido.", "error"); return redirect(redirect_url_on_fail)
+        if len(set(ordered_filenames)) != len(ordered_filenames):
+            flash("Error interno: El orden de arrastre contiene imágenes repetidas.", "error"); return redirect(redirect_url_on_fail)
+        for original_filename in ordered_filenames:
+            if not is_safe_name(original_filename) or Path(original_filename).suffix.lower() not in ALLOWED_IMAGE_EXTENSIONS:
+                print(f"WARN: reorganize_group - Unsafe or invalid filename in order_json: {original_filename}")
+                flash(f"Nombre de archivo inválido en el formulario: {original_filename}", "error"); return redirect(redirect_url_on_fail)
+        order_data = [(i + 1, name) for i, name in enumerate(ordered_filenames)]
+
+    if not order_json:
+        for key, value in request.form.items():
+            if key.startswith('order_'):
+                try:
+                    # Extract the original encoded filename from the input name
+                    encoded_filename = key[len('order_'):]
+                    # Get the desired number
+                    order_num_str = value.strip()
+                    if not order_num_str: raise ValueError("Empty number")
+                    order_num = int(order_num_str)
+
+                    # Get the actual filename from the corresponding hidden input
+                    original_encoded_filename = request.form.get(f'filename_{encoded_filename}')
+
+                    if not original_encoded_filename or original_encoded_filename != encoded_filename:
+                         # Basic consistency check - something is wrong with the form data
+                         print(f"WARN: reorganize_group - Data mismatch for key {key}");
+                         flash("Error interno: Datos del formulario inconsistentes.", "error")
+                         return redirect(redirect_url_on_fail) # Abort early on bad form data
+
+                    # Decode the original filename for validation and processing
+                    original_filename = unquote(original_encoded_filename)
+
+                    # Validate filename and order number
+                    if not is_safe_name(original_filename) or Path(original_filename).suffix.lower() not in ALLOWED_IMAGE_EXTENSIONS:
+                         print(f"WARN: reorganize_group - Unsafe or invalid filename in form: {original_filename}");
+                         flash(f"Nombre de archivo inválido en el formulario: {original_filename}", "error")
+                         return redirect(redirect_url_on_fail) # Abort early
+                    if order_num <= 0:
+                         flash(f"Número de orden inválido ({order_num}) para {original_filename}.", "error");
+                         return redirect(redirect_url_on_fail) # Abort early
+
+                    order_data.append((order_num, original_filename))
+                except ValueError:
+                    flash(f"Número de orden inválido ('{value}') para un archivo.", "error"); return redirect(redirect_url_on_fail)
+                except Exception as e:
+                    print(f"ERROR: reorganize_group - Processing form data for key {key}: {e}");
+                    flash("Error procesando datos del formulario.", "error"); return redirect(redirect_url_on_fail)
 
     if not order_data:
         flash("No se recibió información de imágenes para reorganizar.", "error"); return redirect(redirect_url_on_fail)
 
+    job = submit_job('reorganize_group', f"Reorganizando '{group_name}'", redirect_url_on_fail,
+                     _reorganize_group_job, group_dir_path, order_data)
+    return redirect(url_for('show_group', group_name_encoded=group_name_encoded, job=job.id))
+
+def manifest_follower(group_dir_path):
+    """on_finish de rename_planner: el _manifest.json del grupo sigue a los archivos renombrados.
+
+    El descargador numera y localiza los posts con él. Cada plan se aplica una
+    sola vez (GroupManifest.rename_files recuerda su id), aunque la recuperación
+    lo vuelva a llamar.
+    """
+    def follow(mapping, plan_id):
+        if not any((group_dir_path / name).exists() for name in GROUP_MANIFEST_FILES): return
+        manifest = GroupManifest.load(group_dir_path)
+        if manifest.rename_files(mapping, plan_id): manifest.save()
+    return follow
+
+def _reorganize_group_job(job, group_dir_path, order_data):
+    """Renombra las imágenes del grupo según order_data [(numero, nombre)].
+
+    Sólo se renombran los archivos cuyo nombre final cambia; los intercambios se
+    resuelven con nombres temporales y el plan queda en un diario para poder
+    completarlo si el proceso se interrumpe (ver rename_planner).
+    """
+    # Finish any reorder that was interrupted before reading the current names
+    recovered = recover_pending_renames(group_dir_path, on_finish=manifest_follower(group_dir_path))
+    if recovered: job.add_message(f"Se completó un reordenado interrumpido ({recovered} renombrados pendientes).", "info")
+
     # Sort images based on the desired order number, then by original name for stability on duplicate numbers
     order_data.sort(key=lambda x: (x[0], x[1])) # Sort by number (x[0]), then filename (x[1])
-
-    success_count = 0
-    failed_renames = []
     total_images = len(order_data)
+    if total_images == 0:
+        job.add_message("No hay imágenes en este grupo para reorganizar.", "info"); return
+
+    existing_names = {entry.name for entry in os.scandir(group_dir_path)}
+    # A censor sidecar whose image is gone would be picked up by the image renamed to that name
+    for name in orphan_sidecars(existing_names):
+        try: os.remove(group_dir_path / name); existing_names.discard(name); print(f"WARN: Eliminado sidecar huérfano {group_dir_path / name}")
+        except OSError as e: print(f"ERROR: Eliminando sidecar huérfano {group_dir_path / name}: {e}")
+    ordered_filenames = [name for _, name in order_data if name in existing_names]
+    failed_renames = [name for _, name in order_data if name not in existing_names]
+    for name in failed_renames: print(f"WARN: reorganize_group - Source file not found during rename: {group_dir_path / name}")
+
+    # Determine padding for new filenames, keeping the width the group already uses (e.g., 001 or 0001)
+    padding = detect_padding(ordered_filenames, len(ordered_filenames))
+    target_names = sequential_names(ordered_filenames, padding=padding)
+    # The censor sidecars (<imagen>.censura.json) are renamed in the same journaled plan as their images
+    file_renames = dict(target_names, **sidecar_renames(target_names, existing_names))
 
-    # Determine padding for new filenames (e.g., 001, 010, 100)
-    padding = len(str(total_images))
-    if padding < 3: padding = 3 # Minimum padding of 3 digits
-
-    # Iterate through the sorted list and rename files sequentially
-    for i, (order_num, original_filename) in enumerate(order_data):
-        # Construct the new filename (NNN.ext) using the index in the sorted list (0-based)
-        new_filename = f"{i+1:0{padding}d}{Path(original_filename).suffix}" # Use 1-based index for filenames
-
-        old_file_path = get_safe_path(group_dir_path, original_filename)
-        # Construct the new path using the group_dir_path as base (already validated)
-        new_file_path = group_dir_path / new_filename # Path handles joining safely
-
-        # Safety checks: ensure old file path is valid/exists and new path is within the group dir
-        if not old_file_path or not old_file_path.is_file():
-             print(f"WARN: reorganize_group - Source file not found or invalid during rename: {old_file_path}");
-             failed_renames.append(original_filename)
-             continue # Skip this rename
-
-        if not is_safe_path(group_dir_path, new_file_path):
-             print(f"SECURITY ERROR: reorganize_group - Attempted to create file outside group dir: {new_file_path}");
-             failed_renames.append(original_filename)
-             continue # Skip this rename
-
-        # Only attempt rename if the new name is different from the old name
-        if old_file_path != new_file_path:
-            try:
-                os.rename(old_file_path, new_file_path)
-                success_count += 1
-                # print(f"INFO: Renamed: {old_file_path.name} -> {new_file_path.name}") # Debug
-            except OSError as e:
-                print(f"ERROR: Renaming {old_file_path}: {e}"); failed_renames.append(original_filename)
-            except Exception as e:
-                print(f"ERROR: Renaming {old_file_path}: {e}"); failed_renames.append(original_filename)
-        else:
-            # File is already in the correct position and has the correct name (NNN.ext)
-            # or user assigned a number that coincidentally resulted in the same sequential name
-            pass # No rename needed
+    try:
+        steps = plan_renames(file_renames, occupied=existing_names)
+    except RenamePlanError as e:
+        print(f"ERROR: reorganize_group - {e}"); job.add_message(f"No se puede reorganizar sin sobrescribir archivos: {e}", "error"); return
 
+    job.set_progress(0, len(steps), f"{len(steps)} renombrados necesarios.")
+    try:
+        # The manifest update is part of the journaled plan: a crash before it is rolled forward too
+        apply_renames(group_dir_path, steps, progress_callback=lambda done, total: job.set_progress(done),
+                      mapping=file_renames, on_finish=manifest_follower(group_dir_path))
+    except (OSError, RenamePlanError) as e:
+        # The journal is kept, so the next reorder (or opening the group) rolls it forward
+        print(f"ERROR: Renaming in {group_dir_path}: {e}"); job.add_message(f"Error al renombrar: {e}", "error"); return
+
+    success_count = sum(1 for src, dst in target_names.items() if src != dst)
     if success_count > 0:
-        flash(f"Reorganización completada. {success_count} imágenes renombradas.", "success")
+        job.add_message(f"Reorganización completada. {success_count} imágenes renombradas.", "success")
     if failed_renames:
-        flash(f"Error al renombrar las siguientes imágenes: {', '.join(failed_renames)}", "error")
-    elif success_count == 0 and total_images > 0:
-         flash("No se necesitaron cambios de nombre (ya estaban en el orden especificado).", "info")
-    elif total_images == 0:
-         flash("No hay imágenes en este grupo para reorganizar.", "info")
+        job.add_message(f"Error al renombrar las siguientes imágenes: {', '.join(failed_renames)}", "error")
+    elif success_count == 0:
+         job.add_message("No se necesitaron cambios de nombre (ya estaban en el orden especificado).", "info")
 
 
-    return redirect(redirect_url_on_fail) # Redirect back to the group page to see new order
-
 # --- FEATURE: Clean Empty Folders ---
 @app.route('/cleanup_empty_folders_root', methods=['POST'])
 def cleanup_empty_folders_root():
@@ -965,64 +1416,27 @@ def cleanup_empty_folders_root():
          return redirect(url_for('index'))
 
 
-    empty_dirs_to_delete = find_empty_dirs(ROOT_GALLERY_DIR)
-    deleted_count = 0
-    failed_count = 0
-    failed_list = []
-
-    # Sort by path depth ascending so parents are attempted last (safer with rmdir)
-    # Although find_empty_dirs returns deepest first, attempting rmdir on parents last is still good
-    empty_dirs_to_delete.sort(key=lambda p: len(p.parts))
-
-    for empty_dir_path in empty_dirs_to_delete:
-        # Double check safety although find_empty_dirs should filter
-        if not is_safe_path(root_resolved, empty_dir_path) or not empty_dir_path.is_dir() or list(empty_dir_path.iterdir()):
-             print(f"SECURITY WARNING: Skipping potentially unsafe or non-empty dir during cleanup: {empty_dir_path}")
-             failed_count += 1
-             failed_list.append(str(empty_dir_path))
-             continue
-
-        try:
-            os.rmdir(empty_dir_path) # rmdir only removes truly empty directories
-            print(f"INFO: Removed empty dir: {empty_dir_path}")
-            deleted_count += 1
-        except OSError as e:
-            print(f"ERROR: Could not remove empty dir {empty_dir_path}: {e}")
-            failed_count += 1
-            failed_list.append(str(empty_dir_path))
-        except Exception as e:
-            print(f"ERROR: Unexpected error removing empty dir {empty_dir_path}: {e}")
-            failed_count += 1
-            failed_list.append(str(empty_dir_path))
-
-
-    if deleted_count > 0:
-        flash(f"Limpieza completada. Eliminadas {deleted_count} carpetas vacías bajo '{ROOT_GALLERY_DIR.name}'.", "success")
-    else:
-        flash("No se encontraron carpetas vacías para eliminar.", "info")
-
-    if failed_count > 0:
-        flash(f"No se pudieron eliminar {failed_count} carpetas: {', '.join(failed_list)} (pueden no estar vacías o haber un error).", "error")
-
-    return redirect(url_for('index')) # Redirect back to selector
+    job = submit_job('cleanup_root', "Limpiando carpetas vacías (raíz)", url_for('index'),
+                     _cleanup_empty_dirs_job, ROOT_GALLERY_DIR, root_resolved,
+                     f"Limpieza completada. Eliminadas {{count}} carpetas vacías bajo '{ROOT_GALLERY_DIR.name}'.",
+                     "No se encontraron carpetas vacías para eliminar.")
+    return redirect(url_for('index', job=job.id)) # Back to selector, which polls the job
 
 @app.route('/cleanup_empty_folders_creator', methods=['POST'])
 def cleanup_empty_folders_creator():
     """Cleans empty folders within the current creator's directory."""
-    if not current_selection["creator_dir"]:
+    creator_name, creator_dir = get_current_creator()
+    if not creator_name:
         flash("Selecciona un creador primero para limpiar sus carpetas vacías.", "error")
         return redirect(url_for('index'))
 
-    creator_dir = current_selection["creator_dir"]
-    creator_name = current_selection["creator_name"] # Get name before potential reset
-
-    # Re-validate creator_dir using ROOT_GALLERY_DIR as base
-    creator_dir_path_obj = get_safe_path(ROOT_GALLERY_DIR, Path(creator_dir).name) # Get path obj from name, base is ROOT
+    # Re-validate creator_dir (memoized, already checked against ROOT_GALLERY_DIR)
+    creator_dir_path_obj = creator_dir
 
     if not creator_dir_path_obj or not creator_dir_path_obj.is_dir():
          flash(f"Directorio del creador inválido para la limpieza.", "error")
          print(f"ERROR: cleanup_empty_folders_creator - Invalid creator_dir: {creator_dir}")
-         current_selection.update({"creator_dir": None, "creator_name": None})
+         invalidate_path_cache(creator_name); clear_current_creator()
          return redirect(url_for('index'))
 
     # Resolve the creator path for safe comparison
@@ -1031,27 +1445,41 @@ def cleanup_empty_folders_creator():
     except (FileNotFoundError, Exception) as e:
          print(f"ERROR: cleanup_empty_folders_creator - Cannot resolve creator_dir: {creator_dir_path_obj}, {e}");
          flash(f"Error al validar el directorio del creador: {e}", "error")
-         current_selection.update({"creator_dir": None, "creator_name": None})
+         invalidate_path_cache(creator_name); clear_current_creator()
          return redirect(url_for('index'))
 
 
-    empty_dirs_to_delete = find_empty_dirs(creator_dir_path_obj)
+    job = submit_job('cleanup_creator', f"Limpiando carpetas vacías de '{creator_name}'", url_for('index'),
+                     _cleanup_empty_dirs_job, creator_dir_path_obj, creator_resolved,
+                     f"Limpieza completada. Eliminadas {{count}} carpetas vacías del creador '{creator_name}'.",
+                     f"No se encontraron carpetas vacías en el creador '{creator_name}'.")
+    # Redirect back to the creator's index page, which polls the job
+    return redirect(url_for('index', job=job.id))
+
+def _cleanup_empty_dirs_job(job, base_path, base_resolved, success_message, nothing_message):
+    """Busca y elimina las carpetas vacías bajo base_path (trabajo en segundo plano)."""
+    job.set_progress(0, 0, "Buscando carpetas vacías...")
+    empty_dirs_to_delete = find_empty_dirs(base_path)
     deleted_count = 0
     failed_count = 0
     failed_list = []
 
-    # Sort by path depth ascending
+    # Sort by path depth ascending so parents are attempted last (safer with rmdir)
+    # Although find_empty_dirs returns deepest first, attempting rmdir on parents last is still good
     empty_dirs_to_delete.sort(key=lambda p: len(p.parts))
+    job.set_progress(0, len(empty_dirs_to_delete), f"{len(empty_dirs_to_delete)} carpetas vacías encontradas.")
 
-    for empty_dir_path in empty_dirs_to_delete:
-        # Double check safety - ensure dir is within the *resolved* creator dir and is empty
-        if not is_safe_path(creator_resolved, empty_dir_path) or not empty_dir_path.is_dir() or list(empty_dir_path.iterdir()):
-             print(f"SECURITY WARNING: Skipping potentially unsafe or non-empty dir during creator cleanup: {empty_dir_path}")
+    for i, empty_dir_path in enumerate(empty_dirs_to_delete, start=1):
+        job.set_progress(i)
+        # Double check safety - ensure dir is within the *resolved* base dir and is empty
+        if not is_safe_path(base_resolved, empty_dir_path) or not empty_dir_path.is_dir() or list(empty_dir_path.iterdir()):
+             print(f"SECURITY WARNING: Skipping potentially unsafe or non-empty dir during cleanup: {empty_dir_path}")
              failed_count += 1
              failed_list.append(str(empty_dir_path))
              continue
+
         try:
-            os.rmdir(empty_dir_path)
+            os.rmdir(empty_dir_path) # rmdir only removes truly empty directories
             print(f"INFO: Removed empty dir: {empty_dir_path}")
             deleted_count += 1
         except OSError as e:
@@ -1065,25 +1493,19 @@ def cleanup_empty_folders_creator():
 
 
     if deleted_count > 0:
-        flash(f"Limpieza completada. Eliminadas {deleted_count} carpetas vacías del creador '{creator_name}'.", "success")
+        job.add_message(success_message.format(count=deleted_count), "success")
     else:
-        flash(f"No se encontraron carpetas vacías en el creador '{creator_name}'.", "info")
+        job.add_message(nothing_message, "info")
 
     if failed_count > 0:
-        flash(f"No se pudieron eliminar {failed_count} carpetas: {', '.join(failed_list)}", "error")
-
-
-    # Redirect back to the creator's index page
-    return redirect(url_for('index'))
+        job.add_message(f"No se pudieron eliminar {failed_count} carpetas: {', '.join(failed_list)} (pueden no estar vacías o haber un error).", "error")
 
 
 # --- FEATURE: Merge Groups ---
 @app.route('/merge_groups', methods=['POST'])
 def merge_groups():
-    if not current_selection["creator_dir"]: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
-
-    creator_dir = current_selection["creator_dir"]
-    creator_name = current_selection["creator_name"] # For flash messages
+    creator_name, creator_dir = get_current_creator()
+    if not creator_dir: flash("Operación no permitida.", "error"); return redirect(url_for('index'))
     selected_groups_encoded = request.form.getlist('selected_groups')
     new_group_name = request.form.get('new_group_name', '').strip()
 
@@ -1103,7 +1525,7 @@ def merge_groups():
             flash(f"Nombre de grupo seleccionado inválido: {group_name}", "error"); return redirect(redirect_url)
 
         # Get the safe path relative to the creator directory
-        group_path = get_safe_path(creator_dir, group_name)
+        group_path = get_group_path(creator_name, group_name)
 
         if not group_path or not group_path.is_dir():
             flash(f"Grupo seleccionado no encontrado o inválido: {group_name}", "error"); return redirect(redirect_url)
@@ -1147,124 +1569,189 @@ def merge_groups():
         print(f"ERROR: Creando directorio para fusión {new_group_path}: {e}"); flash("Error inesperado al crear el nuevo grupo.", "error"); return redirect(redirect_url)
 
 
+    job = submit_job('merge_groups', f"Fusionando {len(selected_group_paths)} grupos en '{new_group_name}'", redirect_url,
+                     _merge_groups_job, creator_name, creator_dir, selected_group_paths, new_group_path, new_group_name,
+                     url_for('show_group', group_name_encoded=quote(new_group_name)))
+    return redirect(url_for('index', job=job.id))
+
+def _merge_sort_key(filename):
+    """Orden de las imágenes dentro de un grupo: número de secuencia, variante, nombre."""
+    stem = Path(filename).stem
+    match = SEQUENCE_STEM_RE.match(stem)
+    if match: return (0, int(match.group(1)), match.group(2), filename)
+    return (1, 0, '', filename)
+
+def _unique_name(name, taken):
+    """Devuelve name, o name_N si ya está en `taken` (conjunto en memoria, sin stat)."""
+    if name not in taken: return name
+    stem, suffix = Path(name).stem, Path(name).suffix
+    counter = 1
+    while f"{stem}_{counter}{suffix}" in taken: counter += 1
+    return f"{stem}_{counter}{suffix}"
+
+def _move_files(moves, same_device):
+    """Aplica [(src, dst)]. Mismo disco: renombrados en lote; si no, copias en paralelo.
+
+    Devuelve la lista de (src, error) que fallaron.
+    """
+    failures = []
+    if same_device:
+        for src, dst in moves:
+            try: os.rename(src, dst)
+            except OSError as e: failures.append((src, e))
+        return failures
+    with ThreadPoolExecutor(max_workers=MERGE_COPY_WORKERS) as executor:
+        futures = {executor.submit(shutil.move, src, dst): src for src, dst in moves}
+        for future, src in futures.items():
+            try: future.result()
+            except (OSError, shutil.Error) as e: failures.append((src, e))
+    return failures
+
+def _merge_groups_job(job, creator_name, creator_dir, selected_group_paths, new_group_path, new_group_name, success_redirect_url):
+    """Mueve las imágenes de los grupos seleccionados al nuevo grupo (trabajo en segundo plano).
+
+    Cada directorio se lista una sola vez y los nombres finales se asignan en memoria:
+    las imágenes se renumeran en una única secuencia continua (en el orden de los
+    grupos seleccionados) y las variantes como 0001_pixelado.jpg siguen a su original.
+    Los manifests de origen se fusionan en el del grupo nuevo con los nombres nuevos,
+    y cada sidecar de censura (<imagen>.censura.json) sigue a su imagen.
+    """
     moved_count = 0
     skipped_count = 0
     skipped_files = [] # Store names of skipped files
     deleted_groups_count = 0
     failed_delete_groups = [] # Store names of groups not deleted
 
-    # Iterate through source groups and move files
+    # 1. List every directory once
+    taken = {entry.name for entry in os.scandir(new_group_path)}
+    sources = [] # [(source_group_path, image_names, other_names, has_manifest)]
     for source_group_path in selected_group_paths:
+        # Check if source group still exists and is a directory and is within the creator_dir
+        if not source_group_path.is_dir() or not is_safe_path(creator_dir, source_group_path):
+             print(f"WARN: Source group disappeared or became invalid during merge: {source_group_path}");
+             job.add_message(f"Advertencia: El grupo de origen '{source_group_path.name}' ya no es válido. Saltando.", "warning")
+             continue
         try:
-            # Check if source group still exists and is a directory and is within the creator_dir
-            if not source_group_path.is_dir() or not is_safe_path(creator_dir, source_group_path):
-                 print(f"WARN: Source group disappeared or became invalid during merge: {source_group_path}");
-                 flash(f"Advertencia: El grupo de origen '{source_group_path.name}' ya no es válido. Saltando.", "warning")
-                 continue
-
-            # Get image files in the source group
-            source_image_files = [f for f in source_group_path.iterdir() if f.is_file() and f.suffix.lower() in ALLOWED_IMAGE_EXTENSIONS]
-
-            for source_file_path in source_image_files:
-                # Ensure source file is safe (redundant with group_path safety, but harmless)
-                if not is_safe_path(source_group_path, source_file_path):
-                     print(f"SECURITY WARNING: Skipping potentially unsafe source file during merge: {source_file_path}");
-                     skipped_count += 1
-                     skipped_files.append(source_file_path.name)
-                     continue
-
-                target_file_name = source_file_path.name
-                target_file_path = new_group_path / target_file_name
-
-                # Conflict resolution: If target file exists, rename the incoming file
-                conflict_counter = 1
-                original_stem = source_file_path.stem
-                original_suffix = source_file_path.suffix
-
-                # Loop to find a unique name if conflict exists
-                while target_file_path.exists():
-                    target_file_name = f"{original_stem}_{conflict_counter}{original_suffix}"
-                    target_file_path = new_group_path / target_file_name
-                    conflict_counter += 1
-                    if conflict_counter > 10000: # Safety break for excessive conflicts
-                        print(f"ERROR: Too many conflicts for {source_file_path.name}, skipping.");
-                        skipped_count += 1
-                        skipped_files.append(source_file_path.name)
-                        target_file_path = None # Mark as not to move
-                        break # Exit while loop
-
-                if target_file_path: # If not skipped due to too many conflicts
-                     # Re-validate the target path is still within the new group dir
-                     if not is_safe_path(new_group_path, target_file_path):
-                          print(f"SECURITY ERROR: merge_groups - Attempted to create file outside target group dir: {target_file_path}");
-                          skipped_count += 1
-                          skipped_files.append(source_file_path.name)
-                          continue
-
-                     try:
-                         shutil.move(source_file_path, target_file_path)
-                         moved_count += 1
-                         # print(f"INFO: Moved: {source_file_path.name} -> {target_file_path.name}") # Debug
-                     except OSError as e:
-                         print(f"ERROR: Moving {source_file_path} to {target_file_path}: {e}")
-                         skipped_count += 1
-                         skipped_files.append(source_file_path.name)
-                     except Exception as e:
-                         print(f"ERROR: Moving {source_file_path} to {target_file_path}: {e}")
-                         skipped_count += 1
-                         skipped_files.append(source_file_path.name)
-
-
-            # After moving files, attempt to remove the source group directory if it's empty
-            try:
-                 # Check if the directory is empty before attempting rmdir
-                 if not list(source_group_path.iterdir()):
-                     os.rmdir(source_group_path)
-                     print(f"INFO: Removed empty source group after merge: {source_group_path}")
-                     deleted_groups_count += 1
-                 else:
-                     print(f"WARN: Source group not empty after moving files: {source_group_path}")
-                     failed_delete_groups.append(source_group_path.name) # Didn't delete, maybe log as failed or just warn
-            except OSError as e:
-                 print(f"ERROR: Could not remove source group {source_group_path}: {e}")
-                 failed_delete_groups.append(source_group_path.name)
-            except Exception as e:
-                 print(f"ERROR: Could not remove source group {source_group_path}: {e}")
-                 failed_delete_groups.append(source_group_path.name)
-
-
+            with os.scandir(source_group_path) as entries:
+                file_names = [entry.name for entry in entries if entry.is_file(follow_symlinks=False)]
         except OSError as e:
             print(f"ERROR: Processing source group {source_group_path} during merge: {e}")
-            # Continue with other groups even if one fails
-            flash(f"Error procesando grupo '{source_group_path.name}'.", "error")
-            continue
-        except Exception as e:
-            print(f"ERROR: Processing source group {source_group_path} during merge: {e}")
-            flash(f"Error inesperado procesando grupo '{source_group_path.name}'.", "error")
+            job.add_message(f"Error procesando grupo '{source_group_path.name}'.", "error")
             continue
+        # Censor sidecars of missing images would land on whichever image gets their name
+        for name in orphan_sidecars(file_names):
+            try: os.remove(source_group_path / name); file_names.remove(name); print(f"WARN: Eliminado sidecar huérfano {source_group_path / name}")
+            except OSError as e: print(f"ERROR: Eliminando sidecar huérfano {source_group_path / name}: {e}")
+        image_names = sorted((n for n in file_names if Path(n).suffix.lower() in ALLOWED_IMAGE_EXTENSIONS), key=_merge_sort_key)
+        # Sidecars are not moved under their own name: they follow their image (step 3)
+        other_names = sorted(n for n in file_names if n not in image_names and n not in GROUP_BOOKKEEPING_FILES and not is_sidecar(n))
+        sources.append((source_group_path, image_names, other_names, set(file_names), bool(GROUP_MANIFEST_FILES & set(file_names))))
+
+    # 2. Assign final names in memory: one continuous sequence for all images
+    # Variants share the slot of their original, so count distinct numbers per source
+    slot_count = sum(len({SEQUENCE_STEM_RE.match(Path(n).stem).group(1) if SEQUENCE_STEM_RE.match(Path(n).stem) else n for n in images})
+                     for _, images, _, _, _ in sources)
+    padding = detect_padding([n for _, images, _, _, _ in sources for n in images], slot_count)
+    next_seq = 1
+    plans = [] # [(source_group_path, [(src_name, dst_name)], {sidecar: new sidecar name}, has_manifest)]
+    for source_group_path, image_names, other_names, file_names, has_manifest in sources:
+        renames = []
+        slot_of = {} # sequence number in the source -> sequence number in the merged group
+        for name in image_names:
+            kind, number, variant, _ = _merge_sort_key(name)
+            if kind == 0:
+                if number not in slot_of: slot_of[number] = next_seq; next_seq += 1
+                new_name = f"{slot_of[number]:0{padding}d}{variant}{Path(name).suffix}"
+            else:
+                new_name = f"{next_seq:0{padding}d}{Path(name).suffix}"; next_seq += 1
+            new_name = _unique_name(new_name, taken)
+            taken.add(new_name)
+            renames.append((name, new_name))
+        for name in other_names:
+            new_name = _unique_name(name, taken)
+            taken.add(new_name)
+            renames.append((name, new_name))
+        sidecars = sidecar_renames(dict(renames), file_names)
+        for src, dst in [(src, dst) for src, dst in sidecars.items() if dst in taken]:
+            # A stray sidecar already has that name in the target: never overwrite it, the image stays uncensored
+            del sidecars[src]
+            print(f"WARN: merge - '{dst}' ya existe en {new_group_path}; '{src}' no se mueve.")
+            job.add_message(f"La censura de '{source_group_path.name}/{src[:-len(CENSURA_SUFFIX)]}' no se movió (ya existe '{dst}' en el destino).", "warning")
+        taken.update(sidecars.values())
+        plans.append((source_group_path, renames, sidecars, has_manifest))
+
+    # 3. Move (batched renames on the same device) and merge the manifests
+    total_files = sum(len(renames) for _, renames, _, _ in plans)
+    job.set_progress(0, total_files)
+    merged_manifest = GroupManifest(new_group_path)
+    target_device = os.stat(new_group_path).st_dev
+    for source_group_path, renames, sidecars, has_manifest in plans:
+        job.set_progress(moved_count + skipped_count, message=f"Moviendo imágenes de '{source_group_path.name}'...")
+        same_device = os.stat(source_group_path).st_dev == target_device
+        failures = _move_files([(source_group_path / src, new_group_path / dst) for src, dst in renames], same_device)
+        failed_sources = {Path(src).name for src, _ in failures}
+        for src, e in failures:
+            print(f"ERROR: Moving {src} to {new_group_path}: {e}")
+            skipped_files.append(Path(src).name)
+        skipped_count += len(failures)
+        moved_count += sum(1 for src, _ in renames if src not in failed_sources and Path(src).suffix.lower() in ALLOWED_IMAGE_EXTENSIONS)
+        job.set_progress(moved_count + skipped_count)
+        # Sidecars only follow images that did move; the others keep theirs in the source group
+        sidecar_moves = [(source_group_path / src, new_group_path / dst) for src, dst in sidecars.items()
+                         if src[:-len(CENSURA_SUFFIX)] not in failed_sources]
+        for src, e in _move_files(sidecar_moves, same_device):
+            print(f"ERROR: Moving {src} to {new_group_path}: {e}")
+            skipped_files.append(Path(src).name)
+
+        if has_manifest:
+            # Keep the manifest entries of the files that moved, pointing at their new names
+            new_name_of = {src: dst for src, dst in renames if src not in failed_sources}
+            merged_manifest.merge_from(GroupManifest.load(source_group_path), new_name_of)
+            if not failed_sources:
+                for manifest_name in GROUP_MANIFEST_FILES:
+                    try: os.remove(source_group_path / manifest_name)
+                    except FileNotFoundError: pass
+                    except OSError as e: print(f"ERROR: Removing {source_group_path / manifest_name}: {e}")
+
+        # After moving files, attempt to remove the source group directory if it's empty
+        try:
+             # Check if the directory is empty before attempting rmdir
+             if not any(source_group_path.iterdir()):
+                 os.rmdir(source_group_path)
+                 invalidate_path_cache(creator_name, source_group_path.name)
+                 print(f"INFO: Removed empty source group after merge: {source_group_path}")
+                 deleted_groups_count += 1
+             else:
+                 print(f"WARN: Source group not empty after moving files: {source_group_path}")
+                 failed_delete_groups.append(source_group_path.name) # Didn't delete, maybe log as failed or just warn
+        except OSError as e:
+             print(f"ERROR: Could not remove source group {source_group_path}: {e}")
+             failed_delete_groups.append(source_group_path.name)
 
+    if merged_manifest.files:
+        try:
+            merged_manifest.save()
+        except OSError as e:
+            print(f"ERROR: Writing merged manifest in {new_group_path}: {e}")
+            job.add_message(f"No se pudo escribir el manifest fusionado: {e}", "error")
 
     # Provide summary feedback
     if moved_count > 0:
-        flash(f"Fusión completada. Movidas {moved_count} imágenes al grupo '{new_group_name}'.", "success")
+        job.add_message(f"Fusión completada. Movidas {moved_count} imágenes al grupo '{new_group_name}'.", "success")
         # Redirect to the newly merged group if successful moves occurred
-        redirect_url = url_for('show_group', group_name_encoded=quote(new_group_name))
+        job.redirect_url = success_redirect_url
     else:
-         flash(f"No se movieron imágenes durante la fusión de grupos del creador '{creator_name}' (puede que los grupos estuvieran vacíos o hubiera errores).", "info")
+         job.add_message(f"No se movieron imágenes durante la fusión de grupos del creador '{creator_name}' (puede que los grupos estuvieran vacíos o hubiera errores).", "info")
 
 
     if skipped_count > 0:
-        flash(f"Saltadas {skipped_count} imágenes debido a errores o conflictos de nombre.", "error")
-        # Optionally log or show the skipped files list: print(f"Skipped files: {skipped_files}")
+        job.add_message(f"Saltados {skipped_count} archivos debido a errores: {', '.join(skipped_files)}", "error")
     if deleted_groups_count > 0:
-        flash(f"Eliminadas {deleted_groups_count} carpetas de origen vacías.", "success")
+        job.add_message(f"Eliminadas {deleted_groups_count} carpetas de origen vacías.", "success")
     # Only show failed deletions if they actually happened and there were groups to delete
     if failed_delete_groups and (deleted_groups_count > 0 or skipped_count > 0 or moved_count > 0):
-         flash(f"No se pudieron eliminar las siguientes carpetas de origen (puede que no estuvieran vacías): {', '.join(failed_delete_groups)}", "warning")
-
-
-    # Redirect to the final destination (new group page if successful, otherwise creator index)
-    return redirect(redirect_url)
+         job.add_message(f"No se pudieron eliminar las siguientes carpetas de origen (puede que no estuvieran vacías): {', '.join(failed_delete_groups)}", "warning")
+    job.set_progress(total_files)
 
 
 # --- Manejo de Errores ---
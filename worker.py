@@ -13,7 +13,11 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Dependencias de la Lógica de la Aplicación
 from api_client import KemonoAPI
-from grouper import group_posts_by_title # Mantenemos el fallback
+from grouper import ( # Mantenemos el fallback por título
+    group_posts_by_title, group_posts_incremental, reconcile_grouping_index,
+    load_grouping_index, save_grouping_index, GROUPING_INDEX_FILENAME
+)
+from group_manifest import GroupManifest, MANIFEST_FILENAME, file_fingerprint, locate_posts
 from utils import sanitize_filename, ensure_dir, get_base_url
 
 # Dependencias de Google Gemini y Pydantic
@@ -23,7 +27,7 @@ from pydantic import BaseModel, Field, ValidationError
 # --- Constantes ---
 MAX_CONCURRENT_DOWNLOADS = 5
 FILENAME_PADDING = 4
-MANIFEST_FILENAME = "_manifest.txt"
+RAW_POSTS_FILENAME = "_posts_raw.jsonl"
 
 # --- Modelos Pydantic para la IA de Gemini (Clave para la solución) ---
 class PostForGemini(BaseModel):
@@ -115,12 +119,17 @@ class DownloadWorker(QThread):
     groups_ready = pyqtSignal(list)
     image_processed = pyqtSignal(str, bool, bool, bool)
 
-    def __init__(self, service: str, creator_id: str, output_dir: str):
+    def __init__(self, service: str, creator_id: str, output_dir: str, keep_raw_posts: bool = False,
+                 api_base_url: Optional[str] = None):
         super().__init__()
         self.service = service
         self.creator_id = creator_id
         self.output_dir = Path(output_dir)
-        self.api = KemonoAPI()
+        # Los posts se guardan en memoria como PostRecord (sin HTML ni embeds). Con
+        # keep_raw_posts, el JSON completo de la API se vuelca a RAW_POSTS_FILENAME.
+        self.keep_raw_posts = keep_raw_posts
+        # api_base_url apunta el worker a otro servidor (p. ej. fake_kemono.py para pruebas y benchmarks)
+        self.api = KemonoAPI(api_base_url) if api_base_url else KemonoAPI()
         self._is_cancelled = False
         self.site_base_url = get_base_url(self.api.base_url)
         self.processed_urls_in_session = set()
@@ -130,6 +139,7 @@ class DownloadWorker(QThread):
         self.total_images_skipped_exists = 0
         self.total_images_failed = 0
         self.images_processed_count = 0
+        self.group_manifests: Dict[str, GroupManifest] = {}
 
     def is_cancelled(self) -> bool:
         return self._is_cancelled
@@ -138,13 +148,36 @@ class DownloadWorker(QThread):
         self.log.emit("Solicitud de cancelación recibida...")
         self._is_cancelled = True
 
-    def _prepare_download_tasks_and_manifests(self, grouped_posts: Dict[str, List[Dict]]) -> Tuple[List[Dict], List[Tuple[str, str, int]]]:
+    def _creator_dir(self) -> Path:
+        return self.output_dir / sanitize_filename(f"{self.service}_{self.creator_id}")
+
+    def _post_images(self, post: Dict) -> List[Dict]:
+        """Imágenes de un post (file + attachments), en orden estable de attachment."""
+        post_id = post.get('id', 'unknown_id')
+        images = []
+        if post.get('file') and post['file'].get('path'):
+            file_info = post['file']
+            images.append({
+                'url': f"{self.site_base_url}{file_info['path']}",
+                'original_name': file_info.get('name', 'file'),
+                'post_id': post_id,
+                'path_in_api': file_info['path'],
+            })
+        for attachment in post.get('attachments', []):
+            if attachment.get('path'):
+                images.append({
+                    'url': f"{self.site_base_url}{attachment['path']}",
+                    'original_name': attachment.get('name', f'att_{attachment.get("id")}'),
+                    'post_id': post_id,
+                    'path_in_api': attachment['path'],
+                })
+        return images
+
+    def _prepare_download_tasks_and_manifests(self, grouped_posts: Dict[str, List[Dict]], grouping_index: Dict) -> Tuple[List[Dict], List[Tuple[str, str, int]]]:
         all_tasks = []
         group_info_for_gui = []
-        manifest_lines_by_group = {}
 
-        sanitized_creator_folder = sanitize_filename(f"{self.service}_{self.creator_id}")
-        base_user_dir = self.output_dir / sanitized_creator_folder
+        base_user_dir = self._creator_dir()
         ensure_dir(str(base_user_dir))
         self.log.emit(f"Directorio base del creador: {base_user_dir}")
 
@@ -154,64 +187,84 @@ class DownloadWorker(QThread):
             posts_in_group = grouped_posts[group_name]
             group_dir = base_user_dir / group_name
             ensure_dir(str(group_dir))
-            manifest_path = group_dir / MANIFEST_FILENAME
-            manifest_lines_by_group[group_name] = []
+            # Cada (post, attachment) conserva su nombre de archivo entre sincronizaciones:
+            # los nuevos reciben el siguiente número libre, así que nada existente se desplaza.
+            manifest = GroupManifest.load(group_dir)
+            self.group_manifests[group_name] = manifest
 
-            images_in_group = []
+            group_tasks = []
             for post in posts_in_group:
                 post_id = post.get('id', 'unknown_id')
-                if post.get('file') and post['file'].get('path'):
-                    file_info = post['file']
-                    images_in_group.append({
-                        'url': f"{self.site_base_url}{file_info['path']}",
-                        'original_name': file_info.get('name', 'file'),
-                        'post_id': post_id,
-                        'path_in_api': file_info['path'],
+                for att_index, img_data in enumerate(self._post_images(post)):
+                    original_extension = Path(img_data['path_in_api']).suffix or ".jpg"
+                    sanitized_original_name = sanitize_filename(img_data['original_name'], replace_space_with='_')
+                    new_filename = manifest.assign(post_id, att_index, img_data['path_in_api'], sanitized_original_name,
+                                                   original_extension, padding=FILENAME_PADDING)
+                    group_tasks.append({
+                        'url': img_data['url'],
+                        'save_path': group_dir / new_filename,
+                        'group_name': group_name,
+                        'manifest_key': (post_id, att_index),
+                        'identifier': f"'{new_filename}' (Grupo: '{group_name}', Original: '{sanitized_original_name}', Post: {post_id})"
                     })
-                for attachment in post.get('attachments', []):
-                    if attachment.get('path'):
-                        images_in_group.append({
-                            'url': f"{self.site_base_url}{attachment['path']}",
-                            'original_name': attachment.get('name', f'att_{attachment.get("id")}'),
-                            'post_id': post_id,
-                            'path_in_api': attachment['path'],
-                        })
-
-            group_image_count = len(images_in_group)
+            group_tasks.sort(key=lambda task: task['save_path'].name)
+            all_tasks.extend(group_tasks)
+
+            group_image_count = len(group_tasks)
             if group_image_count > 0:
                  group_info_for_gui.append((group_name, str(group_dir), group_image_count))
-
-            for seq_index, img_data in enumerate(images_in_group):
-                seq_num = seq_index + 1
-                seq_str = f"{seq_num:0{FILENAME_PADDING}d}"
-                original_extension = Path(img_data['path_in_api']).suffix or ".jpg"
-                sanitized_original_name = sanitize_filename(img_data['original_name'], replace_space_with='_')
-                new_filename = f"{seq_str}{original_extension}"
-                save_path = group_dir / new_filename
-
-                task = {
-                    'url': img_data['url'],
-                    'save_path': save_path,
-                    'group_name': group_name,
-                    'identifier': f"'{new_filename}' (Grupo: '{group_name}', Original: '{sanitized_original_name}', Post: {img_data['post_id']})"
-                }
-                all_tasks.append(task)
-
-                manifest_line = f"{new_filename} : {sanitized_original_name} (PostID: {img_data['post_id']})"
-                manifest_lines_by_group[group_name].append(manifest_line)
-
-            if manifest_lines_by_group[group_name]:
                  try:
-                     with open(manifest_path, 'w', encoding='utf-8') as f_manifest:
-                         f_manifest.write("# Mapping: Sequential Filename : Original Filename (PostID: ...)\n")
-                         f_manifest.write("-" * 60 + "\n")
-                         f_manifest.write("\n".join(manifest_lines_by_group[group_name]))
-                     self.log.emit(f"Manifest creado para '{group_name}': {manifest_path.name}")
-                 except IOError as e:
+                     manifest.save()
+                     self.log.emit(f"Manifest creado para '{group_name}': {MANIFEST_FILENAME}")
+                 except OSError as e:
                      self.log.emit(f"ERROR: No se pudo escribir el manifest para '{group_name}': {e}")
 
+        # Persist the numbering before downloading: an interrupted run resumes with the same names
+        try:
+            save_grouping_index(base_user_dir, grouping_index)
+        except OSError as e:
+            self.log.emit(f"ERROR: No se pudo guardar {GROUPING_INDEX_FILENAME}: {e}")
+
         return all_tasks, group_info_for_gui
 
+    def _load_grouping_index(self) -> Dict:
+        creator_dir = self._creator_dir()
+        grouping_index = load_grouping_index(creator_dir)
+        existing_folders = {p.name for p in creator_dir.iterdir() if p.is_dir()} if creator_dir.is_dir() else set()
+        if any(entry['folder'] not in existing_folders for entry in grouping_index['posts'].values()):
+            # Carpetas renombradas/fusionadas desde la galería o fusionar.py: seguir a sus posts
+            relocated = reconcile_grouping_index(grouping_index, existing_folders, locate_posts(creator_dir))
+            if relocated:
+                self.log.emit(f"Índice de agrupación: {relocated} posts siguen a sus carpetas renombradas/fusionadas.")
+        return grouping_index
+
+    def _save_group_manifests(self):
+        """Guarda los manifests con los hashes de lo descargado (el ETag de la galería)."""
+        for group_name, manifest in self.group_manifests.items():
+            try:
+                manifest.save(write_txt=False)
+            except OSError as e:
+                self.log.emit(f"ERROR: No se pudo actualizar el manifest de '{group_name}': {e}")
+
+    def _group_with_gemini(self, posts: List[Dict], gemini_key: str) -> Optional[Dict[str, List[Dict]]]:
+        """Agrupa `posts` con Gemini. Devuelve None si falla (se usará el agrupado por título)."""
+        try:
+            gemini_result = organize_posts_with_gemini(posts, gemini_key, self.log.emit)
+        except Exception as e:
+            self.log.emit(f"[ADVERTENCIA] La organización con Gemini IA falló: {e}. Se usará el método de agrupación por título.")
+            return None
+        if not gemini_result or not gemini_result.get("groups"):
+            return None
+        posts_by_id = {p['id']: p for p in posts}
+        grouped_posts = {}
+        for group_info in gemini_result["groups"]:
+            folder_name = sanitize_filename(group_info["folder"])
+            post_list = [posts_by_id[post_id] for post_id in group_info["order"] if post_id in posts_by_id]
+            if post_list:
+                grouped_posts.setdefault(folder_name, []).extend(post_list)
+        self.log.emit("[Gemini IA] Grupos de IA procesados y listos para la descarga.")
+        return grouped_posts
+
     def _download_task_runner(self, task_info: Dict) -> Dict:
         url = task_info['url']
         save_path = task_info['save_path']
@@ -225,6 +278,10 @@ class DownloadWorker(QThread):
             url, str(save_path),
             check_cancel=self.is_cancelled
         )
+        fingerprint = None
+        if success:
+            try: fingerprint = file_fingerprint(save_path) # Hashed here, off the GUI thread
+            except OSError: pass
 
         return {
             'url': url,
@@ -232,7 +289,9 @@ class DownloadWorker(QThread):
             'cancelled': self.is_cancelled() and not success,
             'skipped': False,
             'identifier': identifier,
-            'group_name': group_name
+            'group_name': group_name,
+            'manifest_key': task_info.get('manifest_key'),
+            'fingerprint': fingerprint
         }
 
     def run(self):
@@ -244,16 +303,22 @@ class DownloadWorker(QThread):
         self.total_images_skipped_exists = 0
         self.total_images_failed = 0
         self.images_processed_count = 0
+        self.group_manifests = {}
 
         try:
             # --- 1. Fetch all posts ---
             self.log.emit("Fase 1: Obteniendo lista de posts...")
             self.progress.emit(0, 0, 0, 0)
+            raw_posts_path = None
+            if self.keep_raw_posts:
+                ensure_dir(str(self._creator_dir()))
+                raw_posts_path = str(self._creator_dir() / RAW_POSTS_FILENAME)
             all_posts = self.api.get_all_creator_posts(
                 self.service, self.creator_id,
                 progress_callback=lambda p, d: self.progress.emit(p, 0, 0, 0),
                 log_callback=self.log.emit,
-                check_cancel=self.is_cancelled
+                check_cancel=self.is_cancelled,
+                raw_spill_path=raw_posts_path
             )
             if self.is_cancelled():
                 self.finished.emit(False, "Cancelado durante obtención de posts.")
@@ -273,35 +338,24 @@ class DownloadWorker(QThread):
             load_dotenv(dotenv_path=env_path)
             gemini_key = os.getenv("GEMINI_API_KEY")
 
-            grouped_posts = None
+            # Los posts ya descargados se quedan en su carpeta; sólo los nuevos se agrupan
+            grouping_index = self._load_grouping_index()
+            known_posts = len(grouping_index['posts'])
             if gemini_key:
-                try:
-                    gemini_result = organize_posts_with_gemini(all_posts, gemini_key, self.log.emit)
-                    
-                    if gemini_result and gemini_result.get("groups"):
-                        posts_by_id = {p['id']: p for p in all_posts}
-                        grouped_posts = {}
-                        for group_info in gemini_result["groups"]:
-                            folder_name = sanitize_filename(group_info["folder"])
-                            post_list = [posts_by_id[post_id] for post_id in group_info["order"] if post_id in posts_by_id]
-                            if post_list:
-                                grouped_posts[folder_name] = post_list
-                        self.log.emit("[Gemini IA] Grupos de IA procesados y listos para la descarga.")
-                
-                except Exception as e:
-                    self.log.emit(f"[ADVERTENCIA] La organización con Gemini IA falló: {e}. Se usará el método de agrupación por título.")
+                group_new = lambda new_posts: self._group_with_gemini(new_posts, gemini_key) or group_posts_by_title(new_posts)
             else:
                 self.log.emit("[Info] No se encontró la API Key de Gemini. Se usará la agrupación por título estándar.")
-
-            if grouped_posts is None:
-                self.log.emit("Usando el método de agrupación por título...")
-                grouped_posts = group_posts_by_title(all_posts)
+                group_new = group_posts_by_title
+            grouped_posts = group_posts_incremental(all_posts, grouping_index, group_new)
+            new_posts_count = len(grouping_index['posts']) - known_posts
+            if known_posts:
+                self.log.emit(f"Índice de agrupación: {known_posts} posts conocidos, {new_posts_count} nuevos.")
 
             if not grouped_posts:
                 self.finished.emit(True, "Completado. No se encontraron posts con imágenes para agrupar.")
                 return
 
-            all_download_tasks, group_info_for_gui = self._prepare_download_tasks_and_manifests(grouped_posts)
+            all_download_tasks, group_info_for_gui = self._prepare_download_tasks_and_manifests(grouped_posts, grouping_index)
             total_images_to_process = len(all_download_tasks)
 
             if total_images_to_process == 0:
@@ -346,6 +400,9 @@ class DownloadWorker(QThread):
                         if was_successful:
                             self.total_images_downloaded += 1
                             self.processed_urls_in_session.add(result['url'])
+                            manifest = self.group_manifests.get(result['group_name'])
+                            if manifest and result['fingerprint'] and result['manifest_key']:
+                                manifest.record_file(*result['manifest_key'], *result['fingerprint'])
                             self.log.emit(f"OK: {result['identifier']}")
                         elif was_cancelled:
                             self.log.emit(f"CANCELADO: {result['identifier']}")
@@ -368,6 +425,7 @@ class DownloadWorker(QThread):
 
             # --- 4. Finalization ---
             self.log.emit("Fase de descargas completada.")
+            self._save_group_manifests()
             if not self.is_cancelled():
                  self.progress.emit(100, 100, self.images_processed_count, total_images_to_process)
 